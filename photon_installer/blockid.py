@@ -0,0 +1,107 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import os
+import subprocess
+import threading
+
+import cmdtrace
+
+
+class BlockIdCache(object):
+    """
+    Identifiers (UUID, PARTUUID, LABEL, PARTLABEL, TYPE, ...) of block
+    devices, read for many devices with a single blkid call.
+
+    The values are kept until invalidate() is called, which has to be done
+    whenever partitions or filesystems are created.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        # LVM volumes and loop partitions may be known by different names
+        # (/dev/vg/lv, /dev/mapper/vg-lv, /dev/dm-N)
+        return os.path.realpath(path)
+
+    @staticmethod
+    def parse(output):
+        """
+        Parse the output of 'blkid -o export', which has blocks of KEY=value
+        lines separated by empty lines, starting with DEVNAME
+        """
+        devices = {}
+        tags = None
+        for line in output.splitlines():
+            line = line.strip()
+            if not line:
+                tags = None
+                continue
+            key, _, value = line.partition("=")
+            if key == "DEVNAME":
+                tags = devices[value] = {}
+            elif tags is not None:
+                tags[key] = value
+        return devices
+
+    def load(self, paths):
+        """
+        Read the identifiers of all devices in 'paths'
+        """
+        paths = [p for p in paths if p]
+        if not paths:
+            return
+
+        # '-c /dev/null' to not use a stale blkid cache file. blkid returns
+        # 2 if a device has no identifiers, which is not an error here.
+        cmd = ["blkid", "-c", "/dev/null", "-o", "export"] + paths
+        self.logger.info(f"running {cmd}")
+        process = cmdtrace.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if process.returncode not in [0, 2]:
+            self.logger.warning(f"blkid failed with {process.returncode}: {process.stderr}")
+
+        devices = BlockIdCache.parse(process.stdout)
+        with self.lock:
+            for path in paths:
+                self.devices[BlockIdCache._key(path)] = {}
+            for devname, tags in devices.items():
+                self.devices[BlockIdCache._key(devname)] = tags
+
+    def tags(self, path):
+        """
+        All identifiers of device 'path', empty if blkid does not know the
+        device
+        """
+        key = BlockIdCache._key(path)
+        with self.lock:
+            tags = self.devices.get(key, None)
+        if tags is None:
+            self.load([path])
+            with self.lock:
+                tags = self.devices.get(key, {})
+        return dict(tags)
+
+    def get(self, path, tag):
+        """
+        Value of 'tag' (like "UUID") of device 'path', or '' if the device
+        has no such identifier
+        """
+        return self.tags(path).get(tag, '')
+
+    def set(self, path, tags):
+        """
+        Set the identifiers of a device that are known without asking blkid,
+        like for partitions of disk images that are built offline
+        """
+        with self.lock:
+            self.devices[BlockIdCache._key(path)] = dict(tags)
+
+    def invalidate(self):
+        with self.lock:
+            self.devices = {}
@@ -0,0 +1,217 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Trace of the external commands the installer runs, saved in the Chrome
+trace event format, which Perfetto (https://ui.perfetto.dev) opens. Each
+command is an event with its argv, pid, exit code, bytes of output and the
+installer phase that ran it. The installer phases are added as events too,
+on the lanes of the threads that ran them, so the commands show up below
+their phase. The resource sampler adds its samples as counters.
+
+Tracing is off unless enable() was called, command() then costs nothing.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+# None while tracing is off
+_events = None
+_start_time = None
+_phase_fn = None
+
+
+class TracedCommand(object):
+    """
+    Filled in by the code running the command
+    """
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.pid = None
+        self.exit_code = None
+        self.output_bytes = 0
+
+    def add_output(self, data):
+        self.output_bytes += len(data.encode() if isinstance(data, str) else data)
+
+
+def enable(start_time, phase_fn=None):
+    """
+    Start recording commands. 'start_time' (from time.monotonic()) is the
+    time 0 of the trace, 'phase_fn' returns the phase of the calling thread.
+    """
+    global _events, _start_time, _phase_fn
+    with _lock:
+        _events = []
+        _start_time = start_time
+        _phase_fn = phase_fn
+
+
+def enabled():
+    return _events is not None
+
+
+def _name(argv):
+    if isinstance(argv, list):
+        return os.path.basename(argv[0]) if argv else ""
+    words = argv.split()
+    return os.path.basename(words[0]) if words else ""
+
+
+def _us(t):
+    return int(round(t * 1000000))
+
+
+@contextmanager
+def command(argv):
+    """
+    Record the command run in the block
+    """
+    traced = TracedCommand(argv)
+    if _events is None:
+        yield traced
+        return
+
+    phase = _phase_fn() if _phase_fn is not None else None
+    start = time.monotonic()
+    try:
+        yield traced
+    finally:
+        end = time.monotonic()
+        event = {
+            'name': _name(argv),
+            'cat': "command",
+            'ph': "X",
+            'ts': _us(start - _start_time),
+            'dur': _us(end - start),
+            'thread': threading.current_thread().name,
+            'args': {
+                'argv': argv,
+                'pid': traced.pid,
+                'exit_code': traced.exit_code,
+                'output_bytes': traced.output_bytes,
+                'phase': phase,
+            },
+        }
+        with _lock:
+            if _events is not None:
+                _events.append(event)
+
+
+def counter(name, values):
+    """
+    Record the current 'values' (a dictionary of numbers) of counter 'name'
+    """
+    if _events is None:
+        return
+    event = {
+        'name': name,
+        'cat': "counter",
+        'ph': "C",
+        'ts': _us(time.monotonic() - _start_time),
+        'thread': threading.current_thread().name,
+        'args': values,
+    }
+    with _lock:
+        if _events is not None:
+            _events.append(event)
+
+
+def run(args, input=None, timeout=None, check=False, capture_output=False, **kwargs):
+    """
+    subprocess.run(), traced. Uses Popen directly, for the pid.
+    """
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+
+    with command(args) as traced:
+        with subprocess.Popen(args, **kwargs) as process:
+            traced.pid = process.pid
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise
+        traced.exit_code = process.returncode
+        traced.add_output(stdout or b"")
+        traced.add_output(stderr or b"")
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+def check_output(args, **kwargs):
+    """
+    subprocess.check_output(), traced
+    """
+    return run(args, stdout=subprocess.PIPE, check=True, **kwargs).stdout
+
+
+def _phase_events(phases):
+    events = []
+    for phase in phases:
+        if 'wall_time' not in phase:
+            continue
+        events.append({
+            'name': phase['name'],
+            'cat': "phase",
+            'ph': "X",
+            'ts': _us(phase['start']),
+            'dur': _us(phase['wall_time']),
+            'thread': phase.get('thread', None),
+            'args': {k: v for k, v in phase.items() if k not in ['name', 'start', 'wall_time', 'steps', 'thread']},
+        })
+        events.extend(_phase_events(phase.get('steps', [])))
+    return events
+
+
+def save(path, phases=None):
+    """
+    Write the trace to 'path'. 'phases' are the phases of
+    PhaseTimer.report().
+    """
+    with _lock:
+        events = sorted(_events or [], key=lambda e: e['ts'])
+    events = _phase_events(phases or []) + events
+
+    pid = os.getpid()
+    # one lane per thread, commands that overlap with others of the same
+    # thread (see CommandUtils.run_parallel()) get extra lanes, because
+    # events of a lane must nest
+    tids = {}
+    lane_ends = {}
+    for event in events:
+        thread = event.pop('thread', None) or "MainThread"
+        lane = thread
+        if event['cat'] == "command":
+            ends = lane_ends.setdefault(thread, [])
+            for i, end in enumerate(ends):
+                if end <= event['ts']:
+                    break
+            else:
+                i = len(ends)
+                ends.append(0)
+            ends[i] = event['ts'] + event['dur']
+            if i > 0:
+                lane = f"{thread} ({i + 1})"
+        event['pid'] = pid
+        event['tid'] = tids.setdefault(lane, len(tids) + 1)
+
+    metadata = [{'name': "process_name", 'ph': "M", 'pid': pid, 'tid': 0, 'args': {'name': "photon-installer"}}]
+    for thread, tid in tids.items():
+        metadata.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+
+    with open(path, "wt") as f:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': "ms"}, f)
@@ -4,27 +4,156 @@
 #  */
 #
 
+import asyncio
 import copy
 import glob
 import json
 import os
 import re
+import secrets
+import select
 import shlex
 import shutil
+import signal
 import ssl
 import subprocess
 import tempfile
+import threading
+import time
+from collections import deque
 from urllib.parse import urlparse
 from urllib.request import urlopen
 
+import cmdtrace
 import requests
 import yaml
+from logger import OUTPUT, Logger
 from OpenSSL.crypto import FILETYPE_PEM, load_certificate
 
+# lines of output kept for each command run with run_async()
+TAIL_LINES = 200
+# seconds to wait for a terminated command before killing it
+KILL_TIMEOUT = 5
+READ_SIZE = 64 * 1024
+# seconds without output after which a command in a chroot session is stopped
+CHROOT_READ_TIMEOUT = 3600
+
+
+class CommandResult(object):
+    """
+    Result of a command run with CommandUtils.run_async(). 'retval' is None
+    if the command was cancelled, 'output' are the last lines of its
+    output.
+    """
+
+    def __init__(self, cmd, prefix, retval, output, timed_out=False):
+        self.cmd = cmd
+        self.prefix = prefix
+        self.retval = retval
+        self.output = output
+        self.timed_out = timed_out
+
+
+class ChrootSessionError(Exception):
+    pass
+
+
+class ChrootSession(object):
+    """
+    A shell running in a chroot that runs the commands written to its
+    stdin, so each command does not have to start chroot and bash. Each
+    command is passed to 'eval' as a quoted string and runs in a subshell
+    with stdin from /dev/null, so like with 'bash -c' a syntax error fails
+    the command instead of leaving the shell waiting for more input. Each
+    command is followed by a marker line with its exit status.
+
+    'env' is the complete environment of the shell, a session has to be
+    restarted when it changes.
+    """
+
+    def __init__(self, root, env):
+        self.root = root
+        self.env = env
+        self.marker = f"__poi_done_{secrets.token_hex(8)}__".encode()
+        # one command at a time
+        self.lock = threading.Lock()
+        # in a new process group, so the commands are stopped with it
+        self.process = subprocess.Popen(
+            ["chroot", root, "/bin/bash", "--noprofile", "--norc"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env=env, start_new_session=True
+        )
+        self.buffer = b""
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def _readline(self, timeout):
+        while b"\n" not in self.buffer:
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            if not ready:
+                self.kill()
+                raise ChrootSessionError(f"no output for {timeout} secs, stopped the chroot session in {self.root}")
+            data = os.read(self.process.stdout.fileno(), READ_SIZE)
+            if not data:
+                raise ChrootSessionError(f"chroot session in {self.root} exited")
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line
+
+    def run(self, cmd, output_fn, timeout=None):
+        """
+        Run 'cmd', call 'output_fn' for each line of its output and return
+        its exit status. If there is no output for 'timeout' seconds the
+        session is stopped.
+        """
+        try:
+            self.process.stdin.write(f"( eval {shlex.quote(cmd)} ) </dev/null 2>&1; "
+                                     f"printf '\\n%s %d\\n' {self.marker.decode()} $?\n".encode())
+            self.process.stdin.flush()
+        except OSError as e:
+            raise ChrootSessionError(f"chroot session in {self.root} is gone: {e}")
+
+        previous = None
+        while True:
+            line = self._readline(timeout)
+            if line.startswith(self.marker):
+                # the marker is preceded by a newline, which ends output
+                # without a trailing newline
+                if previous:
+                    output_fn(previous)
+                return int(line[len(self.marker):].split()[0])
+            if previous is not None:
+                output_fn(previous)
+            previous = line.decode("utf-8", errors="replace")
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        self.process.stdout.close()
+
 
 class CommandUtils(object):
     def __init__(self, logger):
         self.logger = logger
+        # additional environment variables for commands run in a chroot
+        self.chroot_env = None
+        # chroot path -> ChrootSession
+        self.chroot_sessions = {}
+        self.chroot_sessions_lock = threading.Lock()
 
     def _update_environment_from_file(self, env_file_path):
         """Update environment variables from a temporary file."""
@@ -50,7 +179,15 @@ class CommandUtils(object):
         except Exception as e:
             self.logger.error(f"Failed to update environment from file: {e}")
 
-    def run(self, cmd, update_env=False):
+    def run(self, cmd, update_env=False, env=None):
+        """
+        Run a command and log its output. 'env' is a dictionary of additional
+        environment variables for the command.
+        """
+        with Logger.command(), cmdtrace.command(cmd) as traced:
+            return self._run(cmd, traced, update_env=update_env, env=env)
+
+    def _run(self, cmd, traced, update_env=False, env=None):
         env_file_path = None
         try:
             self.logger.info(f"running {cmd}")
@@ -81,17 +218,21 @@ class CommandUtils(object):
                         cmd = f"bash -c {shlex.quote(escaped_cmd + f'; env -0 > {env_file_path}')}"
                         use_shell = True
 
+            if env is not None:
+                env = {**os.environ, **env}
+
             with subprocess.Popen(
-                cmd, shell=use_shell, text=True,
+                cmd, shell=use_shell, text=True, env=env,
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT
             ) as process:
-                out = ""
+                traced.pid = process.pid
                 if process.stdout:
                     for line in process.stdout:
-                        self.logger.info(line.rstrip())
-                        out += line
+                        self.logger.info(line.rstrip(), extra=OUTPUT)
+                        traced.add_output(line)
 
                 retval = process.wait()
+                traced.exit_code = retval
 
                 # Update environment from the temporary file if needed
                 if update_env and env_file_path:
@@ -118,6 +259,164 @@ class CommandUtils(object):
                 except Exception as e:
                     self.logger.warning(f"Failed to remove temporary environment file {env_file_path}: {e}")
 
+    def run_buffered(self, cmd, prefix=None):
+        """
+        Run a command like run(), but log its output only after it finished,
+        each line prefixed with 'prefix'. Used for commands that run in
+        parallel, so their output does not get mixed up in the log.
+        """
+        if prefix is None:
+            prefix = os.path.basename(cmd[0] if isinstance(cmd, list) else cmd.split()[0])
+        with Logger.command():
+            self.logger.info(f"running {cmd}")
+            try:
+                process = cmdtrace.run(cmd, shell=not isinstance(cmd, list), text=True,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except (OSError, subprocess.SubprocessError) as e:
+                self.logger.error(f"[{prefix}] error running {cmd}: {e}")
+                return -1
+
+            for line in process.stdout.splitlines():
+                self.logger.info(f"[{prefix}] {line}", extra=OUTPUT)
+            if process.returncode != 0:
+                self.logger.error(f"[{prefix}] Command failed: {cmd}")
+                self.logger.error(f"[{prefix}] Error code: {process.returncode}")
+            return process.returncode
+
+    async def run_async(self, cmd, prefix=None, env=None, timeout=None, tail=TAIL_LINES):
+        """
+        Run a command from an event loop. Its output is logged as it
+        arrives, each line prefixed with 'prefix', and the last 'tail' lines
+        are kept in the result. After 'timeout' seconds, or when the task is
+        cancelled, the command is terminated, and killed if it does not exit.
+        """
+        with Logger.command(), cmdtrace.command(cmd) as traced:
+            return await self._run_async(cmd, traced, prefix, env, timeout, tail)
+
+    async def _run_async(self, cmd, traced, prefix, env, timeout, tail):
+        if prefix is None:
+            prefix = os.path.basename(cmd[0] if isinstance(cmd, list) else cmd.split()[0])
+        if env is not None:
+            env = {**os.environ, **env}
+
+        self.logger.info(f"running {cmd}")
+        # in a new process group, so children of a shell are stopped too
+        kwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT, 'env': env, 'start_new_session': True}
+        try:
+            if isinstance(cmd, list):
+                process = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+            else:
+                process = await asyncio.create_subprocess_shell(cmd, **kwargs)
+        except OSError as e:
+            self.logger.error(f"[{prefix}] error running {cmd}: {e}")
+            return CommandResult(cmd, prefix, -1, [])
+        traced.pid = process.pid
+
+        output = deque(maxlen=tail)
+
+        def _log(data):
+            line = data.decode('utf-8', errors='replace').rstrip("\r")
+            self.logger.info(f"[{prefix}] {line}", extra=OUTPUT)
+            output.append(line)
+
+        async def _read():
+            # read in chunks, lines can be longer than the stream limit
+            partial = []
+            while True:
+                chunk = await process.stdout.read(READ_SIZE)
+                if not chunk:
+                    break
+                traced.add_output(chunk)
+                lines = chunk.split(b"\n")
+                if len(lines) > 1:
+                    _log(b"".join(partial + [lines[0]]))
+                    partial = []
+                    for line in lines[1:-1]:
+                        _log(line)
+                partial.append(lines[-1])
+            if any(partial):
+                _log(b"".join(partial))
+            return await process.wait()
+
+        timed_out = False
+        try:
+            retval = await asyncio.wait_for(_read(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"[{prefix}] Command timed out after {timeout} secs: {cmd}")
+            timed_out = True
+            retval = await CommandUtils._stop(process)
+        except asyncio.CancelledError:
+            self.logger.info(f"[{prefix}] cancelled {cmd}")
+            traced.exit_code = await CommandUtils._stop(process)
+            raise
+        traced.exit_code = retval
+
+        if retval != 0:
+            self.logger.error(f"[{prefix}] Command failed: {cmd}")
+            self.logger.error(f"[{prefix}] Error code: {retval}")
+        return CommandResult(cmd, prefix, retval, list(output), timed_out=timed_out)
+
+    @staticmethod
+    async def _stop(process):
+        def _signal(sig):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                pass
+
+        if process.returncode is None:
+            _signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), KILL_TIMEOUT)
+            except asyncio.TimeoutError:
+                _signal(signal.SIGKILL)
+                await process.wait()
+        return process.returncode
+
+    async def gather(self, cmds, max_jobs=None, timeout=None, fail_fast=False):
+        """
+        Run the commands 'cmds' (commands, or pairs of command and log
+        prefix) at the same time, at most 'max_jobs' at once, each with
+        'timeout'. With 'fail_fast' the other commands are cancelled as soon
+        as one fails. Returns the results in the order of 'cmds'.
+        """
+        cmds = [c if isinstance(c, tuple) else (c, None) for c in cmds]
+        if not cmds:
+            return []
+        semaphore = asyncio.Semaphore(max_jobs or len(cmds))
+
+        async def _run(cmd, prefix):
+            async with semaphore:
+                return await self.run_async(cmd, prefix=prefix, timeout=timeout)
+
+        tasks = [asyncio.ensure_future(_run(cmd, prefix)) for cmd, prefix in cmds]
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if fail_fast and any(t.result().retval != 0 for t in done):
+                    break
+        finally:
+            # on failure, or when cancelled ourselves
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = []
+        for task, (cmd, prefix) in zip(tasks, cmds):
+            if task.cancelled():
+                results.append(CommandResult(cmd, prefix, None, []))
+            else:
+                results.append(task.result())
+        return results
+
+    def run_parallel(self, cmds, max_jobs=None, timeout=None, fail_fast=False):
+        """
+        Blocking version of gather(), for code that is not running in an
+        event loop
+        """
+        return asyncio.run(self.gather(cmds, max_jobs=max_jobs, timeout=timeout, fail_fast=fail_fast))
+
     def run_in_chroot(self, chroot_path, cmd, update_env=False):
         # Use short command here. Initial version was:
         # chroot "${BUILDROOT}" \
@@ -127,7 +426,66 @@ class CommandUtils(object):
         #   PS1='\u:\w\$ ' \
         #   PATH=/bin:/usr/bin:/sbin:/usr/sbin \
         #   /usr/bin/bash --login +h -c "cd installer;$*"
-        return self.run(["chroot", chroot_path, "/bin/bash", "-c", cmd], update_env)
+        if not update_env:
+            session = self._get_chroot_session(chroot_path)
+            # commands of parallel phases do not wait for each other
+            if session is not None and session.lock.acquire(blocking=False):
+                try:
+                    return self._run_in_session(session, cmd)
+                finally:
+                    session.lock.release()
+        return self.run(["chroot", chroot_path, "/bin/bash", "-c", cmd], update_env, env=self.chroot_env)
+
+    def _get_chroot_session(self, chroot_path):
+        # like a new 'chroot' command, the shell gets the current environment
+        env = {**os.environ, **(self.chroot_env or {})}
+        with self.chroot_sessions_lock:
+            session = self.chroot_sessions.get(chroot_path, None)
+            if session is not None and (not session.alive() or session.env != env):
+                if session.lock.locked():
+                    # still running a command of another phase
+                    return None
+                session.close()
+                session = None
+            if session is None:
+                try:
+                    session = ChrootSession(chroot_path, env)
+                except OSError as e:
+                    self.logger.warning(f"cannot start a chroot session in {chroot_path}: {e}")
+                    return None
+                self.chroot_sessions[chroot_path] = session
+            return session
+
+    def _run_in_session(self, session, cmd):
+        def _output(line):
+            self.logger.info(line, extra=OUTPUT)
+            traced.add_output(line)
+
+        with Logger.command(), cmdtrace.command(cmd) as traced:
+            # the command runs in a subshell of the session's shell
+            traced.pid = session.process.pid
+            self.logger.info(f"running {cmd} in {session.root}")
+            start = time.monotonic()
+            try:
+                retval = session.run(cmd, _output, timeout=CHROOT_READ_TIMEOUT)
+            except ChrootSessionError as e:
+                self.logger.error(f"Command failed: {cmd}: {e}")
+                return -1
+            traced.exit_code = retval
+            self.logger.debug(f"{cmd} took {time.monotonic() - start:.3f} secs")
+            if retval != 0:
+                self.logger.error(f"Command failed: {cmd}")
+                self.logger.error(f"Error code: {retval}")
+            return retval
+
+    def close_chroot_sessions(self):
+        """
+        Stop the chroot sessions, before unmounting the chroot
+        """
+        with self.chroot_sessions_lock:
+            for session in self.chroot_sessions.values():
+                session.close()
+            self.chroot_sessions = {}
 
     @staticmethod
     def is_vmware_virtualization():
@@ -297,26 +655,6 @@ class CommandUtils(object):
         retval = process.returncode
         return retval, copy.copy(out.decode())
 
-    def get_vgnames(self):
-        vg_list = []
-        try:
-            cmd = ["vgdisplay", "-c"]
-            process = subprocess.Popen(
-                cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            out, err = process.communicate()
-            retval = process.returncode
-            if retval == 0:
-                vgdisplay_output = out.decode().split("\n")
-                for vg in vgdisplay_output:
-                    if vg == "":
-                        break
-                    vg_list.append(vg.split(":")[0].strip())
-        except Exception as e:
-            retval = e.args[0]
-        self.logger.info(f"VG's list {vg_list}")
-        return retval, vg_list
-
     def replace_in_file(self, file_path, pattern, replacement, errors="ignore"):
         try:
             with open(file_path, "r", encoding="utf-8", errors=errors) as file:
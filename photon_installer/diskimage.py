@@ -0,0 +1,42 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import errno
+import os
+
+ALLOCATIONS = ["sparse", "full"]
+
+
+class DiskImageError(Exception):
+    pass
+
+
+def create_image(filename, size, allocation="sparse", logger=None):
+    """
+    Create a disk image of 'size' bytes. With 'sparse' allocation the file
+    just gets its size set and takes no space until written to. With 'full'
+    allocation the space is reserved up front (without writing to it), so the
+    installation cannot run out of space later. Falls back to a sparse file
+    if the filesystem does not support that.
+    """
+    if allocation not in ALLOCATIONS:
+        raise DiskImageError(f"unknown disk image allocation '{allocation}'")
+
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        if allocation == "full":
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError as e:
+                if e.errno not in [errno.EOPNOTSUPP, errno.EINVAL]:
+                    raise
+                if logger is not None:
+                    logger.warning(f"cannot allocate space for '{filename}': {e}, using a sparse file")
+    except OSError as e:
+        os.close(fd)
+        os.remove(filename)
+        raise DiskImageError(f"failed to create disk image '{filename}': {e}")
+    os.close(fd)
@@ -0,0 +1,63 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Suppression of fsync() and friends while building images. Every write is
+made durable once with a sync before unmounting, so rpm, ldconfig,
+systemctl and scriptlets do not need to sync each file on their own.
+
+The libeatmydata shim is preloaded into tdnf (and with it rpm and the
+scriptlets it runs in the chroot) and into all commands run in the chroot,
+once the target's glibc is installed and the shim works with it. The
+preloaded path is resolved in the chroot for the processes running there,
+so the shim is copied to the same path on the host and in the chroot's /tmp
+(which is a tmpfs and not part of the image).
+"""
+
+import glob
+import os
+import shutil
+
+EATMYDATA_PATTERNS = [
+    "/usr/lib/libeatmydata.so*",
+    "/usr/lib64/libeatmydata.so*",
+    "/usr/lib/*-linux-gnu/libeatmydata.so*",
+    "/usr/lib/libeatmydata/libeatmydata.so*",
+    "/usr/local/lib/libeatmydata.so*",
+]
+
+RPM_DEFINES = ["_flush_io 0"]
+
+
+def find_eatmydata(root="/"):
+    """
+    Path of libeatmydata below 'root', or None
+    """
+    for pattern in EATMYDATA_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(root, pattern.lstrip("/")))):
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def shim_path():
+    """
+    Path of the shim, the same on the host and in the chroot
+    """
+    return f"/tmp/poi-fast-io-{os.getpid()}/libeatmydata.so"
+
+
+def install_shim(lib, root="/"):
+    """
+    Copy the shim 'lib' to shim_path() below 'root'
+    """
+    dest = os.path.join(root, shim_path().lstrip("/"))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.copy(lib, dest)
+    return dest
+
+
+def remove_shim(root="/"):
+    shutil.rmtree(os.path.dirname(os.path.join(root, shim_path().lstrip("/"))), ignore_errors=True)
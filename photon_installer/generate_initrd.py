@@ -316,6 +316,7 @@ class IsoInitrd:
 
         # Set password expiry of initrd image to MAX
         self.cmd_util.run_in_chroot(self.initrd_path, "chage -M 99999 root")
+        self.cmd_util.close_chroot_sessions()
 
         self.logger.info(f"Generating initrd img: {self.working_dir}/initrd.img")
 
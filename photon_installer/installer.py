@@ -11,6 +11,7 @@ import copy
 import curses
 import datetime
 import glob
+import hashlib
 import importlib
 import json
 import os
@@ -19,23 +20,42 @@ import re
 import secrets
 import shutil
 import signal
-import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import uuid
 from collections import abc
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from enum import Enum
 from pathlib import Path
 
+import cmdtrace
+import diskimage
+import fastio
 import jc
+import lockfile
+import loopdev
 import modules.commons
+import offline
+import partitiontable
+import readiness
+import ressampler
+import rpmfetch
+import staging
 import tdnf
+from blockid import BlockIdCache
 from commandutils import CommandUtils
 from defaults import Defaults
-from logger import Logger
+from logger import LOG_FORMATS, OUTPUT, Logger
+from lvm import Lvm, LvmError, LvmState
 from networkmanager import NetworkManager
+from phasetimer import PhaseTimer
+from pkgcache import PackageCache
 from progressbar import ProgressBar
+from rootfscache import RootfsCache
+from scheduler import Phase, PhaseScheduler
 from window import Window
 
 BIOSSIZE = 4
@@ -75,24 +95,33 @@ class Installer(object):
         'archives',
         'autopartition',
         'bootmode',
+        'build_mode',
         'build_mounts',
+        'command_logs',
         'disk',
         'disks',
         'docker',
         'dps',
         'eject_cdrom',
         'environment',
+        'fast_io',
         'firstboot',
         'grub',
         'hostname',
         'insecure_repo',
         'linux_flavor',
         'live',
+        'lockfile',
+        'lockfile_output',
+        'log_format',
         'log_level',
+        'loop_backend',
         'manifest_file',
+        'package_cache',
         'packages',
         'packagelist_file',
         'packagelist_files',
+        'parallel_downloads',
         'partition_type',
         'partitions',
         'security',
@@ -105,16 +134,24 @@ class Installer(object):
         'postinstallscripts',
         'preinstall',
         'preinstallscripts',
+        'prefetch',
         'prepkgsinstall',
         'prepkgsinstallscripts',
         'public_key',
         'photon_docker_image',
         'plugins',
         'repos',
+        'resource_sampler',
+        'rootfs_cache',
+        'scheduler',
         'search_path',
         'setup_grub_script',
         'shadow_password',
+        'staging',
         'tdnf_cachedir',
+        'tdnf_options',
+        'tdnf_session',
+        'trace_file',
         'type',
         'ui',
         'user_grub_cfg_file',
@@ -143,6 +180,8 @@ class Installer(object):
         self.cwd = os.getcwd()
         self.progress_bar = None  # Initialize to prevent AttributeError
         self.window = None        # Initialize to prevent AttributeError
+        self.timer = PhaseTimer()
+        self.manifest = None
 
         # some keys can have arch specific variations
         self.known_keys = set(Installer.known_keys)
@@ -157,6 +196,14 @@ class Installer(object):
         self.installer_path = os.path.dirname(os.path.abspath(__file__))
 
         self.photon_root = os.path.join(self.working_directory, "photon-chroot")
+        # where the target partitions are mounted, differs from photon_root
+        # when staging on a tmpfs
+        self.target_root = self.photon_root
+        self.target_mounts = []
+        self.staging_size = None
+        self.fast_io = False
+        # libeatmydata of the host that can be preloaded with 'fast_io'
+        self.fast_io_shim = None
         self.tdnf_conf_path = os.path.join(self.working_directory, "tdnf.conf")
 
         self.setup_grub_command = os.path.join(self.installer_path, "mk-setup-grub.sh")
@@ -168,6 +215,33 @@ class Installer(object):
 
         signal.signal(signal.SIGINT, self.exit_gracefully)
         self.lvs_to_detach = {'vgs': [], 'pvs': []}
+        self.package_lock = None
+        # effective 'tdnf_options', with the profile applied
+        self.tdnf_options = {}
+        self.rootfs_cache = None
+        self.rootfs_cache_key = None
+        self.rootfs_cache_hit = False
+        self.package_cache = None
+        # private tdnf cache directory, filled from the package cache
+        self.package_cache_dir = os.path.join(self.working_directory, "tdnf-cache")
+        self.package_cache_restored = {}
+        self.package_cache_stats = None
+        self.resource_sampler = None
+        # partition path -> image file, offset, size and ids, for the offline
+        # build mode
+        self.offline_layout = {}
+
+        self.prefetch_dir = os.path.join(self.working_directory, "prefetch")
+        # tdnf.conf and repo files of the prefetch, which are not rewritten
+        # while it runs
+        self.prefetch_config_dir = os.path.join(self.working_directory, "prefetch-config")
+        self.prefetch_thread = None
+        self.prefetch_ok = False
+        self.prefetch_gpg = None
+
+        # set when using a tdnf session, see _get_merged_transaction()
+        self.merged_transaction = []
+        self.additional_rpms_merged = False
 
     """
     create, append and validate configuration date - install_config
@@ -181,8 +255,15 @@ class Installer(object):
         else:
             log_level = install_config.get('log_level', 'info')
             console = not install_config.get('ui', False)
-        self.logger = Logger.get_logger(self.log_path, log_level, console)
+        log_format = (install_config or {}).get('log_format', "text")
+        command_logs = (install_config or {}).get('command_logs', False)
+        self.logger = Logger.get_logger(self.log_path, log_level, console,
+                                        log_format=log_format, command_logs=command_logs)
+        Logger.set_phase_fn(self.timer.current_phase)
         self.cmd = CommandUtils(self.logger)
+        self.blkid = BlockIdCache(self.logger)
+        self.lvm = Lvm(self.logger)
+        self.loop_devices = loopdev.LoopRegistry(self.logger)
 
         if self.rpm_path and "repos" not in install_config and self.repo_paths == Defaults.REPO_PATHS:
             self.logger.warning("'rpm_path' key is deprecated, please use 'repo_paths' key instead")
@@ -210,10 +291,14 @@ class Installer(object):
 
         # _check_install_config will raise InstallerConfigError if there's an issue
         self._check_install_config(install_config)
-        self._execute_external_plugins(modules.commons.CHECK_CONFIG)
+        if install_config.get('trace_file', None) is not None:
+            cmdtrace.enable(self.timer.start_time, phase_fn=self.timer.current_phase)
+        with self.timer.phase(modules.commons.CHECK_CONFIG):
+            self._execute_external_plugins(modules.commons.CHECK_CONFIG)
 
         self._add_defaults(install_config)
-        self._execute_external_plugins(modules.commons.ADD_DEFAULTS)
+        with self.timer.phase(modules.commons.ADD_DEFAULTS):
+            self._execute_external_plugins(modules.commons.ADD_DEFAULTS)
 
         self._convert_partition_options()
 
@@ -224,15 +309,34 @@ class Installer(object):
                               releasever=self.photon_release_version,
                               installroot=self.photon_root)
 
+        self.tdnf_options = tdnf.resolve_options(install_config['tdnf_options'])
+        self.tdnf.rpm_defines = tdnf.options_rpm_defines(self.tdnf_options)
+        self._setup_fast_io()
+
+        # download packages in the background while the disks are prepared
+        self._start_prefetch()
+
         self.ab_present = self._is_ab_present()
-        self._prepare_devices()
-        self._get_disk_sizes()
-        self._calc_size_percentages()
-        self._insert_boot_partitions()
-        self._add_shadow_partitions()
-        self._check_disk_space()
-        self._get_vg_names()
-        self._clear_vgs()
+        try:
+            self._prepare_devices()
+            self._get_disk_sizes()
+            self._calc_size_percentages()
+            self._insert_boot_partitions()
+            self._add_shadow_partitions()
+            self._check_disk_space()
+            self._setup_staging()
+            if self.install_config['build_mode'] == "offline":
+                # no LVM in images built offline, and maybe no permission to run it
+                self.lvm_state = LvmState()
+            else:
+                self.lvm_state = self.lvm.report()
+            self._get_vg_names()
+            self._clear_vgs()
+        except Exception:
+            # the installation does not start, so nothing else detaches
+            # the loop devices of the disk images
+            self.loop_devices.detach_all()
+            raise
 
     def _convert_partition_options(self):
         def _convert_options(partition, key, sep=","):
@@ -273,7 +377,7 @@ class Installer(object):
 
     # collect LVM Volume Group names
     def _get_vg_names(self):
-        retval, host_vg_names = self.cmd.get_vgnames()
+        host_vg_names = self.lvm_state.vgs
         self.vg_names = set()
         partitions = self.install_config['partitions']
         for p in partitions:
@@ -292,10 +396,18 @@ class Installer(object):
                 filename = disk['filename']
                 size = disk['size']
                 sector_size = disk.get('sector_size', 512)
-                retval = self.cmd.run(["dd", "if=/dev/zero", f"of={filename}", "bs=1M", f"count={size}", "conv=sparse"])
-                if retval != 0:
-                    raise InstallerError(f"failed to create disk image '{filename}'")
-                device = subprocess.check_output(["losetup", "--show", "-f", "--sector-size", str(sector_size), filename], text=True).strip()
+                allocation = disk.get('allocation', "sparse")
+                self.logger.info(f"creating disk image '{filename}' with {size} MB ({allocation})")
+                try:
+                    diskimage.create_image(filename, size * 1024**2, allocation=allocation, logger=self.logger)
+                    if self.install_config['build_mode'] == "offline":
+                        # the image is written directly, no loop device
+                        device = filename
+                    else:
+                        device = self.loop_devices.attach(filename, sector_size=sector_size,
+                                                          partscan=self.install_config['loop_backend'] == "partscan")
+                except (diskimage.DiskImageError, loopdev.LoopDeviceError) as e:
+                    raise InstallerError(str(e))
                 disk['device'] = device
 
             # handle symlinks like /dev/disk/by-path/pci-* -> ../../dev/sd*
@@ -311,6 +423,9 @@ class Installer(object):
         disk_sizes = {}
         all_devices = set([p['device'] for p in partitions])
         for device in all_devices:
+            if os.path.isfile(device):
+                disk_sizes[device] = os.path.getsize(device)
+                continue
             retval, size = CommandUtils.get_disk_size_bytes(device)
             if retval != 0:
                 self.logger.info(f"Error code: {retval}")
@@ -327,6 +442,106 @@ class Installer(object):
             device = partition['device']
             partition['size'] = int(self.disk_sizes[device] * size_percent / (100 * 1024**2))
 
+    def _get_staging_size(self):
+        """
+        Upper limit for the size of the installation in MB, the sum of the
+        filesystems it will be copied to
+        """
+        sizes = {}
+        for partition in self.install_config['partitions']:
+            device = partition['device']
+            sizes.setdefault(device, [0, False])
+            sizes[device][0] += partition['size']
+            if partition['size'] == 0:
+                sizes[device][1] = True
+
+        total = 0
+        for partition in self.install_config['partitions']:
+            if partition.get('mountpoint') is None or partition.get('shadow', False):
+                continue
+            if partition['filesystem'] in ['squashfs', 'erofs']:
+                # installed to a directory in the working directory
+                continue
+            size = partition['size']
+            if size == 0:
+                # the extensible partition gets what the others leave
+                size = self.disk_sizes[partition['device']] // 1024**2 - sizes[partition['device']][0]
+            total += size
+        return total
+
+    def _setup_fast_io(self):
+        """
+        Suppress syncing of single files for tdnf, rpm and commands in the
+        chroot. Everything is synced once before unmounting.
+        """
+        if not self.install_config['fast_io']:
+            return
+        if self.install_config['live']:
+            # a crash of a live installation must not leave a broken system
+            self.logger.warning("'fast_io' is not used for live installations")
+            return
+
+        self.fast_io = True
+        self.tdnf.rpm_defines = self.tdnf.rpm_defines + fastio.RPM_DEFINES
+
+        if self.install_config['arch'] != platform.machine():
+            self.logger.info("not preloading libeatmydata for a foreign architecture")
+            return
+        # preloaded only after the packages are installed, see _preload_fast_io()
+        self.fast_io_shim = fastio.find_eatmydata()
+
+    def _preload_fast_io(self):
+        """
+        Preload libeatmydata for tdnf and commands in the chroot. The target's
+        own libeatmydata is preferred, the host's may need a newer glibc than
+        the target has, so it is only used if a command in the chroot still
+        runs with it.
+        """
+        if not self.fast_io or self.install_config['arch'] != platform.machine():
+            return
+
+        lib = fastio.find_eatmydata(root=self.photon_root) or self.fast_io_shim
+        if lib is None:
+            self.logger.info("libeatmydata not found, only disabling rpm's syncs")
+            return
+
+        # on the chroot's /tmp, so it does not end up in the image
+        fastio.install_shim(lib, root=self.photon_root)
+        env = {'LD_PRELOAD': fastio.shim_path()}
+        if self.cmd.run(["chroot", self.photon_root, "/bin/true"], env=env) != 0:
+            self.logger.info(f"{lib} cannot be preloaded in the target, only disabling rpm's syncs")
+            fastio.remove_shim(root=self.photon_root)
+            return
+
+        # tdnf itself runs on the host, its scriptlets in the chroot
+        if self.fast_io_shim is not None:
+            fastio.install_shim(self.fast_io_shim)
+            self.tdnf.env = env
+        self.cmd.chroot_env = env
+        self.logger.info(f"preloading {lib} for commands in the chroot")
+
+    def _setup_staging(self):
+        """
+        Decide if the installation is staged on a tmpfs. Falls back to
+        installing directly to the target filesystems if there is not
+        enough memory.
+        """
+        staging_config = self.install_config['staging']
+        if staging_config['type'] != "tmpfs":
+            return
+
+        size = staging_config.get('size', None)
+        if size is None:
+            size = self._get_staging_size()
+        available = staging.mem_available() // 1024**2
+        if available < size + staging.MEM_RESERVE:
+            self.logger.warning(f"not enough memory to stage the installation ({size} MB needed, {available} MB available), installing directly")
+            return
+
+        self.logger.info(f"staging the installation on a tmpfs of {size} MB")
+        self.staging_size = size
+        self.target_root = os.path.join(self.working_directory, "photon-target")
+
     def _check_disk_space(self):
         partitions = self.install_config['partitions']
         disk_totals = {}
@@ -390,7 +605,8 @@ class Installer(object):
     def _load_preinstall(self, install_config):
         self.install_config = install_config
         self._set_environment_variables(install_config)
-        self._execute_modules(modules.commons.PRE_INSTALL)
+        with self.timer.phase(modules.commons.PRE_INSTALL):
+            self._execute_modules(modules.commons.PRE_INSTALL)
         for fill_values in self._fill_dynamic_conf(install_config):
             self.logger.info(f"{fill_values}")
 
@@ -466,6 +682,9 @@ class Installer(object):
             if 'fips' in security and security['fips'] is not None:
                 packages.append("openssl-fips-provider")
 
+        if install_config.get('lockfile', None) is not None:
+            packages = self._get_locked_packages(install_config, packages)
+
         packages = list(set(packages))
 
         versioned_pkgs = set()
@@ -561,6 +780,50 @@ class Installer(object):
         if 'log_level' not in install_config:
             install_config['log_level'] = 'info'
 
+        if 'tdnf_session' not in install_config:
+            install_config['tdnf_session'] = False
+
+        if 'fast_io' not in install_config:
+            install_config['fast_io'] = False
+
+        if 'tdnf_options' not in install_config:
+            install_config['tdnf_options'] = {}
+
+        if 'loop_backend' not in install_config:
+            install_config['loop_backend'] = "partscan"
+
+        if 'build_mode' not in install_config:
+            install_config['build_mode'] = "default"
+
+        if isinstance(install_config.get('staging', None), str):
+            install_config['staging'] = {'type': install_config['staging']}
+        install_config.setdefault('staging', {})
+        install_config['staging'].setdefault('type', "direct")
+
+        # run installation phases one after another by default
+        if 'scheduler' not in install_config:
+            install_config['scheduler'] = {}
+        elif isinstance(install_config['scheduler'], str):
+            install_config['scheduler'] = {'mode': install_config['scheduler']}
+        install_config['scheduler'].setdefault('mode', "serial")
+
+        if isinstance(install_config.get('rootfs_cache', None), str):
+            install_config['rootfs_cache'] = {'path': install_config['rootfs_cache']}
+        if 'rootfs_cache' in install_config:
+            install_config['rootfs_cache'].setdefault('max_size', 10240)
+
+        if isinstance(install_config.get('package_cache', None), str):
+            install_config['package_cache'] = {'path': install_config['package_cache']}
+        if 'package_cache' in install_config:
+            install_config['package_cache'].setdefault('max_size', 20480)
+
+        if install_config.get('resource_sampler', None) is False:
+            del install_config['resource_sampler']
+        elif install_config.get('resource_sampler', None) is True:
+            install_config['resource_sampler'] = {}
+        if 'resource_sampler' in install_config:
+            install_config['resource_sampler'].setdefault('interval', 1)
+
         # Default Photon docker image
         if 'photon_docker_image' not in install_config:
             install_config['photon_docker_image'] = "photon:latest"
@@ -597,6 +860,45 @@ class Installer(object):
         if 'grub' not in install_config or 'password_pbkdf2' not in install_config['grub']:
             install_config['grub'] = {'password_pbkdf2': DEFAULT_GRUB_PASSWORD_HASH}
 
+    def _get_locked_packages(self, install_config, packages):
+        """
+        Replace the package list by the exact versions of all packages in
+        the lock file given by 'lockfile'
+        """
+        lock_filename = install_config['lockfile']
+        if not lock_filename.startswith('/'):
+            lock_filename = os.path.join(self.cwd, lock_filename)
+        try:
+            self.package_lock = lockfile.load(lock_filename)
+        except (OSError, ValueError, lockfile.LockfileError) as e:
+            raise InstallerConfigError(f"cannot read lock file '{lock_filename}': {e}")
+
+        if self.package_lock.get('arch', None) not in [None, install_config['arch']]:
+            raise InstallerConfigError(f"lock file '{lock_filename}' is for arch {self.package_lock['arch']}, not {install_config['arch']}")
+        if self.package_lock.get('releasever', None) not in [None, self.photon_release_version]:
+            raise InstallerConfigError(f"lock file '{lock_filename}' is for release {self.package_lock['releasever']}, not {self.photon_release_version}")
+
+        # tdnf package specs cannot select an arch, so only the arch of the
+        # installation and noarch can be replayed. The arch of every package
+        # is checked again after the installation, see _write_lockfile().
+        for p in self.package_lock['packages']:
+            if p['arch'] not in [install_config['arch'], "noarch"]:
+                raise InstallerConfigError(f"lock file '{lock_filename}' has package {p['name']} for arch {p['arch']}")
+
+        # additional rpms are installed from 'additional_rpms_path', not
+        # from the repos
+        additional_rpms = self._get_additional_rpms(install_config)
+        self.package_lock['packages'] = [p for p in self.package_lock['packages']
+                                         if (p['name'], p['arch']) not in additional_rpms]
+
+        locked_names = set(p['name'] for p in self.package_lock['packages'])
+        missing = [p for p in packages if p.split('=', 1)[0] not in locked_names]
+        if missing:
+            self.logger.warning(f"packages {missing} are not in the lock file '{lock_filename}' and will not be installed")
+
+        self.logger.info(f"installing {len(self.package_lock['packages'])} packages from lock file '{lock_filename}'")
+        return [lockfile.package_spec(p) for p in self.package_lock['packages']]
+
     def _check_install_config(self, install_config):
         """
         Sanity check of install_config before its execution.
@@ -627,6 +929,8 @@ class Installer(object):
                     if 'sector_size' in disk:
                         if disk['sector_size'] not in [512, 4096]:
                             raise InstallerConfigError("disk sector size must be 512 or 4096")
+                    if disk.get('allocation', "sparse") not in diskimage.ALLOCATIONS:
+                        raise InstallerConfigError(f"disk image allocation must be one of {', '.join(diskimage.ALLOCATIONS)}")
 
         # if not we'll use Installer.default_partitions in _add_defaults()
         if 'partitions' in install_config:
@@ -760,6 +1064,96 @@ class Installer(object):
                 if not key.strip():
                     raise InstallerConfigError("Environment variable name cannot be empty or whitespace")
 
+        if install_config.get('loop_backend', "partscan") not in ["partscan", "kpartx"]:
+            raise InstallerConfigError("'loop_backend' must be 'partscan' or 'kpartx'")
+
+        if not isinstance(install_config.get('fast_io', False), bool):
+            raise InstallerConfigError("'fast_io' must be boolean")
+
+        if 'tdnf_options' in install_config:
+            self._check_tdnf_options(install_config['tdnf_options'])
+
+        build_mode = install_config.get('build_mode', "default")
+        if build_mode not in ["default", "offline"]:
+            raise InstallerConfigError("'build_mode' must be 'default' or 'offline'")
+        if build_mode == "offline":
+            self._check_offline_config(install_config)
+
+        if 'staging' in install_config:
+            staging_config = install_config['staging']
+            if isinstance(staging_config, str):
+                staging_config = {'type': staging_config}
+            if not isinstance(staging_config, dict):
+                raise InstallerConfigError("'staging' must be a string or a dictionary")
+            if staging_config.get('type', "direct") not in staging.STAGING_TYPES:
+                raise InstallerConfigError(f"'staging' type must be one of {', '.join(staging.STAGING_TYPES)}")
+            size = staging_config.get('size', None)
+            if size is not None and (not isinstance(size, int) or size <= 0):
+                raise InstallerConfigError("'staging' size must be a positive number of MB")
+            if staging_config.get('type', "direct") == "tmpfs" and build_mode == "offline":
+                raise InstallerConfigError("'staging' 'tmpfs' cannot be used with 'build_mode' 'offline'")
+            # grub2-install for BIOS runs before the flush and cannot map a tmpfs to the disk
+            if staging_config.get('type', "direct") == "tmpfs" and install_config.get('bootmode', 'efi') in ['dualboot', 'bios']:
+                raise InstallerConfigError("'staging' 'tmpfs' needs 'bootmode' 'efi'")
+
+        if 'scheduler' in install_config:
+            scheduler = install_config['scheduler']
+            if isinstance(scheduler, str):
+                scheduler = {'mode': scheduler}
+            if not isinstance(scheduler, dict):
+                raise InstallerConfigError("'scheduler' must be a string or a dictionary")
+            if scheduler.get('mode', "serial") not in PhaseScheduler.modes:
+                raise InstallerConfigError(f"'scheduler' mode must be one of {', '.join(PhaseScheduler.modes)}")
+            workers = scheduler.get('workers', None)
+            if workers is not None and (not isinstance(workers, int) or workers < 1):
+                raise InstallerConfigError("'scheduler' workers must be a positive integer")
+
+        if 'rootfs_cache' in install_config:
+            rootfs_cache = install_config['rootfs_cache']
+            if isinstance(rootfs_cache, str):
+                rootfs_cache = {'path': rootfs_cache}
+            if not isinstance(rootfs_cache, dict) or 'path' not in rootfs_cache:
+                raise InstallerConfigError("'rootfs_cache' must be a path or a dictionary with a 'path'")
+            max_size = rootfs_cache.get('max_size', 10240)
+            if not isinstance(max_size, int) or max_size < 1:
+                raise InstallerConfigError("'rootfs_cache' max_size must be a positive integer")
+
+        if 'package_cache' in install_config:
+            package_cache = install_config['package_cache']
+            if isinstance(package_cache, str):
+                package_cache = {'path': package_cache}
+            if not isinstance(package_cache, dict) or 'path' not in package_cache:
+                raise InstallerConfigError("'package_cache' must be a path or a dictionary with a 'path'")
+            max_size = package_cache.get('max_size', 20480)
+            if not isinstance(max_size, int) or max_size < 1:
+                raise InstallerConfigError("'package_cache' max_size must be a positive integer")
+            if install_config.get('tdnf_cachedir', None) is not None:
+                raise InstallerConfigError("'package_cache' and 'tdnf_cachedir' cannot be used together")
+
+        if 'resource_sampler' in install_config:
+            sampler_config = install_config['resource_sampler']
+            if isinstance(sampler_config, bool):
+                sampler_config = {}
+            if not isinstance(sampler_config, dict):
+                raise InstallerConfigError("'resource_sampler' must be a boolean or a dictionary")
+            interval = sampler_config.get('interval', 1)
+            if isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+                raise InstallerConfigError("'resource_sampler' interval must be a positive number")
+            if not isinstance(sampler_config.get('file', ""), str):
+                raise InstallerConfigError("'resource_sampler' file must be a path")
+
+        if not isinstance(install_config.get('trace_file', ""), str):
+            raise InstallerConfigError("'trace_file' must be a path")
+
+        if install_config.get('log_format', "text") not in LOG_FORMATS:
+            raise InstallerConfigError(f"'log_format' must be one of {', '.join(LOG_FORMATS)}")
+        if not isinstance(install_config.get('command_logs', False), bool):
+            raise InstallerConfigError("'command_logs' must be a boolean")
+
+        parallel_downloads = install_config.get('parallel_downloads', 0)
+        if not isinstance(parallel_downloads, int) or isinstance(parallel_downloads, bool) or parallel_downloads < 0:
+            raise InstallerConfigError("'parallel_downloads' must be a non-negative integer")
+
         if 'services' in install_config:
             services = install_config['services']
             if not isinstance(services, dict):
@@ -816,6 +1210,51 @@ class Installer(object):
         # No error found
         return None
 
+    def _check_tdnf_options(self, options):
+        if not isinstance(options, dict):
+            raise InstallerConfigError("'tdnf_options' must be a dictionary")
+        unknown = options.keys() - {'profile', 'excludedocs', 'install_langs', 'exclude_paths', 'exclude_packages', 'rpm_macros'}
+        if unknown:
+            raise InstallerConfigError(f"unknown keys in 'tdnf_options': {', '.join(sorted(unknown))}")
+        if options.get('profile', 'default') not in tdnf.PROFILES:
+            raise InstallerConfigError(f"'tdnf_options' profile must be one of {', '.join(tdnf.PROFILES)}")
+        if not isinstance(options.get('excludedocs', False), bool):
+            raise InstallerConfigError("'tdnf_options' excludedocs must be boolean")
+        if not isinstance(options.get('install_langs', []), (str, list)):
+            raise InstallerConfigError("'tdnf_options' install_langs must be a string or a list")
+        for path in options.get('exclude_paths', []):
+            if not isinstance(path, str) or not path.startswith("/"):
+                raise InstallerConfigError(f"'tdnf_options' exclude_paths must be absolute paths, not '{path}'")
+        if not isinstance(options.get('exclude_packages', []), list):
+            raise InstallerConfigError("'tdnf_options' exclude_packages must be a list")
+        if not isinstance(options.get('rpm_macros', {}), dict):
+            raise InstallerConfigError("'tdnf_options' rpm_macros must be a dictionary")
+
+    def _check_offline_config(self, install_config):
+        """
+        The offline build mode has no block devices, so only disk images,
+        EFI boot and filesystems that can be built from a directory can be
+        used
+        """
+        if 'disk' in install_config or any('filename' not in disk for disk in install_config.get('disks', {}).values()):
+            raise InstallerConfigError("'build_mode' 'offline' can only be used with disk images")
+        if install_config.get('bootmode', 'efi') != 'efi':
+            raise InstallerConfigError("'build_mode' 'offline' needs 'bootmode' 'efi'")
+        if install_config.get('live', False):
+            raise InstallerConfigError("'build_mode' 'offline' cannot be used for live installations")
+        if install_config.get('no_unmount', False):
+            raise InstallerConfigError("'build_mode' 'offline' cannot be used with 'no_unmount'")
+        for partition in install_config.get('partitions', []):
+            if 'lvm' in partition:
+                raise InstallerConfigError("'build_mode' 'offline' does not support LVM")
+            if 'subvols' in partition.get('btrfs', {}):
+                raise InstallerConfigError("'build_mode' 'offline' does not support btrfs subvolumes")
+            if 'type' in partition and not partitiontable.is_supported(partition['type'], install_config.get('partition_type', 'gpt')):
+                raise InstallerConfigError(f"partition type '{partition['type']}' is not supported with 'build_mode' 'offline'")
+            filesystem = partition.get('filesystem', 'ext4')
+            if filesystem is not None and filesystem not in offline.FILESYSTEMS:
+                raise InstallerConfigError(f"filesystem '{filesystem}' is not supported with 'build_mode' 'offline'")
+
     def _is_ab_present(self):
         partitions = self.install_config['partitions']
         for partition in partitions:
@@ -892,38 +1331,161 @@ class Installer(object):
         if self.install_config.get('live', True):
             self._eject_cdrom()
 
+    def _install_phases(self):
+        """
+        Graph of the installation phases. Each phase lists the resources it
+        requires and the ones it provides. The list order is used by the
+        'serial' scheduler mode, and has to be a valid order of the graph.
+        """
+        return [
+            Phase("partition_disks", self._partition_disks,
+                  provides=["partitions"]),
+            Phase("format_partitions", self._format_partitions,
+                  requires=["partitions"], provides=["filesystems"]),
+            # mounts are done one after another to keep the unmount order
+            Phase("mount_partitions", self._mount_partitions,
+                  requires=["filesystems"], provides=["root-mounted"]),
+            Phase("mount_special_folders", self._mount_special_folders,
+                  requires=["root-mounted"], provides=["special-mounts"]),
+            Phase("build_mounts", self._build_mounts,
+                  requires=["special-mounts"], provides=["build-mounts"]),
+            Phase("setup_install_repo", self._setup_install_repo,
+                  requires=["build-mounts"], provides=["repo"]),
+            Phase("restore_rootfs_cache", self._restore_rootfs_cache,
+                  requires=["repo"], provides=["rootfs-cache"]),
+            Phase("initialize_system", self._initialize_system,
+                  requires=["rootfs-cache"], provides=["rootfs-base"]),
+            Phase(modules.commons.PRE_PKGS_INSTALL, lambda: self._execute_modules(modules.commons.PRE_PKGS_INSTALL),
+                  requires=["rootfs-base"], provides=["pre-pkgs-install"]),
+            Phase("install_packages", self._install_packages,
+                  requires=["pre-pkgs-install"], provides=["packages"]),
+            # needs the glibc of the target
+            Phase("preload_fast_io", self._preload_fast_io,
+                  requires=["packages"], provides=["fast-io"]),
+            Phase("install_additional_rpms", self._install_additional_rpms,
+                  requires=["fast-io"], provides=["rootfs-installed"]),
+            # before anything that is specific to this installation
+            Phase("store_rootfs_cache", self._store_rootfs_cache,
+                  requires=["rootfs-installed"], provides=["rootfs"]),
+            Phase("store_package_cache", self._store_package_cache,
+                  requires=["rootfs-installed"], provides=["package-cache"]),
+            Phase("setup_network", self._setup_network,
+                  requires=["rootfs"], provides=["network-config"]),
+            # additional files may overwrite resolv.conf
+            Phase("enable_network_in_chroot", self._enable_network_in_chroot,
+                  requires=["network-config"], provides=["chroot-network"]),
+            # additional files may overwrite network configs, and may be
+            # overwritten by fstab, abupdate and security settings
+            Phase("finalize_system", self._finalize_system,
+                  requires=["chroot-network"], provides=["finalized"]),
+            Phase("cleanup_tdnf_cache", self._cleanup_tdnf_cache,
+                  requires=["finalized", "package-cache"], provides=["tdnf-cache-clean"]),
+            Phase("setup_security", self._setup_security,
+                  requires=["finalized"], provides=["security"]),
+            # needs the kernel command line from setup_security
+            Phase("setup_grub", self._setup_grub,
+                  requires=["security"], provides=["grub"]),
+            Phase("create_fstab", self._create_fstab,
+                  requires=["finalized"], provides=["fstab"]),
+            Phase("update_abupdate", self._update_abupdate,
+                  requires=["finalized"], provides=["abupdate"]),
+            Phase("ansible_run", self._ansible_run,
+                  requires=["chroot-network", "grub", "fstab", "abupdate", "tdnf-cache-clean"], provides=["ansible"]),
+            Phase("docker_images", self._docker_images,
+                  requires=["chroot-network", "finalized"], provides=["docker"]),
+            Phase(modules.commons.POST_INSTALL, lambda: self._execute_modules(modules.commons.POST_INSTALL),
+                  requires=["ansible", "docker"], provides=["post-install"]),
+            # after everything that may install or remove packages
+            Phase("write_lockfile", self._write_lockfile,
+                  requires=["post-install"], provides=["lockfile"]),
+            Phase("final_check", self._final_check,
+                  requires=["post-install"], provides=["checked"]),
+            Phase("deactivate_network_in_chroot", self._deactivate_network_in_chroot,
+                  requires=["post-install"], provides=["chroot-network-off"]),
+            Phase("write_manifest", self._write_manifest,
+                  requires=["checked", "chroot-network-off", "lockfile", "package-cache"], provides=["manifest"]),
+            # run after last possible file creation
+            Phase("selinux_label", self._selinux_label,
+                  requires=["manifest"], provides=["labeled"]),
+            Phase("cleanup_install_repo", self._cleanup_install_repo,
+                  requires=["manifest"], provides=["repo-clean"]),
+            Phase("create_archive", self._create_archive,
+                  requires=["labeled", "repo-clean"], provides=["archives"]),
+            # after the last change to the installation
+            Phase("flush_staging", self._flush_staging,
+                  requires=["labeled", "repo-clean"], provides=["flushed"]),
+            Phase("unmount_all", self._unmount_all,
+                  requires=["archives", "flushed"], provides=["unmounted"]),
+        ]
+
     def _unsafe_install(self):
         """
         Install photon system
         """
-        self._partition_disks()
-        self._format_partitions()
-        self._mount_partitions()
-        self._mount_special_folders()
-        self._build_mounts()
-        self._setup_install_repo()
-        self._initialize_system()
-        self._execute_modules(modules.commons.PRE_PKGS_INSTALL)
-        self._install_packages()
-        self._install_additional_rpms()
-        self._enable_network_in_chroot()
-        self._setup_network()
-        self._finalize_system()
-        self._cleanup_tdnf_cache()
-        self._setup_security()
-        self._setup_grub()
-        self._create_fstab()
-        self._update_abupdate()
-        self._ansible_run()
-        self._docker_images()
-        self._execute_modules(modules.commons.POST_INSTALL)
-        self._final_check()
-        self._deactivate_network_in_chroot()
-        self._write_manifest()
-        self._selinux_label()  # run after last possible file creation
-        self._cleanup_install_repo()
-        self._create_archive()
-        self._unmount_all()
+        scheduler_config = self.install_config['scheduler']
+        mode = scheduler_config['mode']
+        if mode != "serial" and self.install_config['ui']:
+            # the progress bar cannot be updated from multiple threads
+            self.logger.info("using serial scheduler mode for UI installation")
+            mode = "serial"
+
+        scheduler = PhaseScheduler(self._install_phases(), self.timer, self.logger,
+                                   mode=mode, workers=scheduler_config.get('workers', None))
+        self._start_resource_sampler()
+        try:
+            scheduler.run()
+        finally:
+            # must not replace an exception from the installation
+            for func in [self._stop_resource_sampler, self._write_trace]:
+                try:
+                    func()
+                except Exception as e:
+                    self.logger.warning(f"{func.__name__} failed: {e}")
+
+        self._update_manifest_timing()
+
+    def _start_resource_sampler(self):
+        if 'resource_sampler' not in self.install_config:
+            return
+
+        def _disks():
+            names = []
+            for disk in self.install_config['disks'].values():
+                if disk.get('device', None):
+                    names.append(os.path.basename(os.path.realpath(disk['device'])))
+            return names
+
+        self.resource_sampler = ressampler.ResourceSampler(self.install_config['resource_sampler']['interval'],
+                                                           self.timer.start_time, self.timer.active_phases,
+                                                           _disks, self.logger)
+        self.resource_sampler.start()
+
+    def _stop_resource_sampler(self):
+        """
+        Stop sampling and write the samples to the sidecar file, if set.
+        Otherwise they are added to the manifest.
+        """
+        if self.resource_sampler is None:
+            return
+        self.resource_sampler.stop()
+
+        sidecar_file = self.install_config['resource_sampler'].get('file', None)
+        if sidecar_file is not None:
+            with open(sidecar_file, "wt") as f:
+                json.dump({'summary': self.resource_sampler.summary(),
+                           'samples': self.resource_sampler.samples}, f)
+            self.logger.info(f"wrote resource samples to {sidecar_file}")
+
+    def _write_trace(self):
+        """
+        Write the trace of all commands and phases, also for a failed
+        installation
+        """
+        trace_file = self.install_config.get('trace_file', None)
+        if trace_file is None:
+            return
+        cmdtrace.save(trace_file, self.timer.report()['phases'])
+        self.logger.info(f"wrote command trace to {trace_file}")
 
     def exit_gracefully(self, signal1=None, frame1=None):
         """
@@ -932,6 +1494,10 @@ class Installer(object):
         """
         del signal1
         del frame1
+        if threading.current_thread() is not threading.main_thread():
+            # a phase running on a scheduler worker failed, clean up is
+            # done by the main thread once the running phases are done
+            raise InstallerError("Installer failed")
         if not self.exiting and self.install_config:
             self.exiting = True
             if self.install_config['ui'] and self.progress_bar is not None:
@@ -942,7 +1508,12 @@ class Installer(object):
                 self.window.content_window().getch()
 
             self._cleanup_install_repo()
-            self._unmount_all(success=False)
+            try:
+                self._unmount_all(success=False)
+            finally:
+                # also if unmounting failed half way
+                if not self.install_config.get('no_unmount', False):
+                    self.loop_devices.detach_all()
         raise InstallerError("Installer failed")
 
     def _setup_network(self):
@@ -1009,14 +1580,17 @@ class Installer(object):
             if ans_cfg.get('logfile', None) is not None:
                 logf = open(ans_cfg['logfile'], "wt")
 
-            self.logger.info(f"running ansible playbook {playbook}")
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-            for line in process.stdout:
-                if logf:
-                    logf.write(line)
-                else:
-                    self.logger.info(line)
-            process.wait()
+            with Logger.command(), cmdtrace.command(cmd) as traced:
+                self.logger.info(f"running ansible playbook {playbook}")
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                traced.pid = process.pid
+                for line in process.stdout:
+                    traced.add_output(line)
+                    if logf:
+                        logf.write(line)
+                    else:
+                        self.logger.info(line.rstrip("\n"), extra=OUTPUT)
+                traced.exit_code = process.wait()
             assert process.returncode == 0, f"ansible run for playbook {playbook} failed"
             if logf is not None:
                 shutil.copy(ans_cfg['logfile'], os.path.join(self.photon_root, "var/log"))
@@ -1033,13 +1607,7 @@ class Installer(object):
             os.remove(socket_file)
         # use --feature containerd-snapshotter=false because this is used in the Photon docker systemd unit file
         docker_process = subprocess.Popen(["chroot", self.photon_root, "dockerd", "--feature", "containerd-snapshotter=false"], text=True)
-        for timeout in range(15, 0, -1):
-            if os.path.exists(socket_file):
-                mode = os.stat(socket_file).st_mode
-                if stat.S_ISSOCK(mode):
-                    break
-            time.sleep(1)
-        else:
+        if not readiness.wait_for_socket(socket_file, timeout=15):
             raise InstallerError("timed out waiting for docker")
 
         images = self.install_config['docker'].get('images', [])
@@ -1048,11 +1616,11 @@ class Installer(object):
 
             if method == "pull":
                 name = image['name']
-                subprocess.run(["chroot", self.photon_root, "docker", "pull", name], check=True)
+                cmdtrace.run(["chroot", self.photon_root, "docker", "pull", name], check=True)
             elif method == "load":
                 filename = image['filename']
                 with open(filename, "rb") as fin:
-                    output = subprocess.check_output(["chroot", self.photon_root, "docker", "load"], stdin=fin, text=True)
+                    output = cmdtrace.check_output(["chroot", self.photon_root, "docker", "load"], stdin=fin, text=True)
                 prefix = "Loaded image: "
                 if (output.startswith(prefix)):
                     name = output[len(prefix):].strip()
@@ -1064,12 +1632,12 @@ class Installer(object):
             if 'name' in image:
                 name = image['name']
                 for tag in image.get('tags', []):
-                    subprocess.run(["chroot", self.photon_root, "docker", "tag", name, tag], check=True)
+                    cmdtrace.run(["chroot", self.photon_root, "docker", "tag", name, tag], check=True)
                     self.logger.info(f"image {name} has been tagged with {tag}")
                 if image.get('drop-tag', False):
                     if 'tags' not in image:
                         self.logger.warn("image has no 'tags' option, untagging it with no tags will remove it")
-                    subprocess.run(["chroot", self.photon_root, "docker", "rmi", name], check=True)
+                    cmdtrace.run(["chroot", self.photon_root, "docker", "rmi", name], check=True)
                     self.logger.info(f"image {name} has been untagged")
 
         docker_process.terminate()
@@ -1091,26 +1659,44 @@ class Installer(object):
         with open(os.path.join(self.photon_root, "etc/fstab"), "rt") as f:
             manifest['fstab'] = jc.parse("fstab", f.read())
 
-        df = jc.parse("df", subprocess.check_output(["df", "-P"], text=True))
+        df = jc.parse("df", cmdtrace.check_output(["df", "-P"], text=True))
         df = [d for d in df if d['mounted_on'].startswith(self.photon_root)]
         for d in df:
             d['mounted_on'] = d['mounted_on'][len(self.photon_root):]
         manifest['df'] = df
 
-        mount = jc.parse("mount", subprocess.check_output(["mount"], text=True))
+        mount = jc.parse("mount", cmdtrace.check_output(["mount"], text=True))
         mount = [m for m in mount if m['mount_point'].startswith(self.photon_root)]
         for m in mount:
             m['mount_point'] = m['mount_point'][len(self.photon_root):]
         manifest['mount'] = mount
 
-        systemd_units = jc.parse("systemctl-luf", subprocess.check_output(
+        systemd_units = jc.parse("systemctl-luf", cmdtrace.check_output(
             ["systemctl", f"--root={self.photon_root}", "list-unit-files", "--type=service", "--all"],
             text=True
         ))
         manifest['systemd-units'] = systemd_units
 
+        manifest['tdnf_options'] = {
+            'settings': self.tdnf_options,
+            'rpm_defines': self.tdnf.rpm_defines,
+        }
+
+        manifest['staging'] = {'type': "tmpfs" if self.staging_size is not None else "direct"}
+        if self.staging_size is not None:
+            manifest['staging']['size'] = self.staging_size
+
+        if self.rootfs_cache is not None:
+            manifest['rootfs_cache'] = {'key': self.rootfs_cache_key, 'hit': self.rootfs_cache_hit}
+
+        if self.package_cache_stats is not None:
+            manifest['package_cache'] = self.package_cache_stats
+
+        manifest['timing'] = self.timer.report()
+
         with open(mf_file, "wt") as f:
             f.write(json.dumps(manifest))
+        self.manifest = manifest
 
         # write a copy to the image itself
         mf_dir = os.path.join(self.photon_root, "var", "log", "poi")
@@ -1118,7 +1704,28 @@ class Installer(object):
         mf_file = os.path.join(mf_dir, "manifest.json")
         with open(mf_file, "wt") as f:
             f.write(json.dumps(manifest))
-        subprocess.run(["gzip", mf_file])
+        cmdtrace.run(["gzip", mf_file])
+
+    def _update_manifest_timing(self):
+        """
+        Rewrite the manifest file with the timing of all phases. The copy in
+        the image only covers the phases up to writing the manifest.
+        """
+        if self.manifest is None:
+            return
+
+        mf_file = self.install_config.get('manifest_file', "poi-manifest.json")
+        self.manifest['timing'] = self.timer.report()
+        if self.resource_sampler is not None:
+            self.manifest['resources'] = self.resource_sampler.summary()
+            if self.install_config['resource_sampler'].get('file', None) is None:
+                self.manifest['resources']['samples'] = self.resource_sampler.samples
+        with open(mf_file, "wt") as f:
+            f.write(json.dumps(self.manifest))
+
+        for phase in self.manifest['timing']['phases']:
+            self.logger.info(f"phase {phase['name']} took {phase['wall_time']} secs")
+        self.logger.info(f"installation took {self.manifest['timing']['total_wall_time']} secs")
 
     def _create_archive(self):
         if 'archives' not in self.install_config:
@@ -1157,7 +1764,7 @@ class Installer(object):
                 partition_path = partition['path']
 
                 squashfs_dir = os.path.join(self.working_directory, "squashfs_" + partition['mountpoint'].replace("/", "_"))
-                subprocess.run(["mksquashfs", squashfs_dir, partition_path, "-noappend", "-comp", "gzip"], check=True)
+                cmdtrace.run(["mksquashfs", squashfs_dir, partition_path, "-noappend", "-comp", "gzip"], check=True)
                 self.logger.info(f"compressed squashfs filesystem to {partition_path}")
                 shutil.rmtree(squashfs_dir)
                 self.logger.info(f"removed {squashfs_dir}")
@@ -1165,26 +1772,37 @@ class Installer(object):
                 partition_path = partition['path']
 
                 erofs_dir = os.path.join(self.working_directory, "erofs_" + partition['mountpoint'].replace("/", "_"))
-                subprocess.run(["mkfs.erofs", partition_path, erofs_dir], check=True)
+                cmdtrace.run(["mkfs.erofs", partition_path, erofs_dir], check=True)
                 self.logger.info(f"compressed erofs filesystem to {partition_path}")
                 shutil.rmtree(erofs_dir)
                 self.logger.info(f"removed {erofs_dir}")
 
+        self.blkid.invalidate()
+
     def _unmount_all(self, success=True):
         """
         Unmount partitions and special folders
         """
 
         partitions = self.install_config['partitions']
-        if success:
+        offline_build = self.install_config['build_mode'] == "offline"
+        if success and not offline_build:
             for p in partitions:
                 # only fstrim fs types that are supported to avoid error messages
                 # instead of filtering for the fs type we could use '--quiet-unsupported',
                 # but this is not implemented in older fstrim versions in Photon 3.0
                 if p['filesystem'] in ['ext4', 'btrfs', 'xfs'] and p['mountpoint'] is not None:
-                    mntpoint = os.path.join(self.photon_root, p['mountpoint'].strip('/'))
+                    mntpoint = os.path.join(self.target_root, p['mountpoint'].strip('/'))
                     retval = self.cmd.run(["fstrim", mntpoint])
 
+        if self.fast_io:
+            # nothing was synced during the installation
+            self.cmd.run(['sync'])
+            fastio.remove_shim()
+
+        # the shell of the chroot session keeps the root busy
+        self.cmd.close_chroot_sessions()
+
         if self.install_config.get('no_unmount', False):
             return
 
@@ -1197,6 +1815,16 @@ class Installer(object):
         self.cmd.run(['sync'])
         if os.path.exists(self.photon_root):
             shutil.rmtree(self.photon_root)
+        if self.target_root != self.photon_root and os.path.exists(self.target_root):
+            shutil.rmtree(self.target_root)
+        if self.package_cache is not None:
+            shutil.rmtree(self.package_cache_dir, ignore_errors=True)
+
+        if offline_build:
+            # there are no LVM volumes or loop devices
+            if success:
+                self._build_offline_filesystems()
+            return
 
         if success:
             # must be done after all partitions are unmounted,
@@ -1220,28 +1848,26 @@ class Installer(object):
         for disk_id in disk_ids:
             device = self.install_config['disks'][disk_id]['device']
             if 'loop' in device:
-                # Uninitialize device partitions mapping
-                retval = self.cmd.run(['kpartx', '-d', device])
-                if retval != 0:
-                    # don't raise an exception so we can continue with remaining devices
-                    self.logger.error("failed to unmap partitions of device '{device}'")
-
-                # If we have a filename then we set it up ourselves.
-                # If not, it was already set up and it's not our responsibility to clean up.
-                if 'filename' in self.install_config['disks'][disk_id]:
-                    retval = self.cmd.run(['losetup', '-d', device])
+                # Uninitialize device partitions mapping, partitions of
+                # loop devices with partition scanning go away with the device
+                if not loopdev.has_partscan(device):
+                    retval = self.cmd.run(['kpartx', '-d', device])
                     if retval != 0:
                         # don't raise an exception so we can continue with remaining devices
-                        self.logger.error("failed to detach loop device '{device}'")
+                        self.logger.error(f"failed to unmap partitions of device '{device}'")
+
+        # Detach the loop devices we set up ourselves. Devices that were
+        # already set up are not our responsibility to clean up.
+        self.loop_devices.detach_all()
 
     def _get_partuuid(self, path):
-        partuuid = subprocess.check_output(['blkid', '-s', 'PARTUUID', '-o', 'value', path],
-                                           universal_newlines=True).rstrip('\n')
-        return partuuid
+        tags = self.blkid.tags(path)
+        if not tags:
+            raise InstallerError(f"cannot read the PARTUUID of {path}")
+        return tags.get('PARTUUID', '')
 
     def _get_uuid(self, path):
-        return subprocess.check_output(['blkid', '-s', 'UUID', '-o', 'value', path],
-                                       universal_newlines=True).rstrip('\n')
+        return self.blkid.get(path, 'UUID')
 
     def _add_btrfs_subvolume_to_fstab(self, mnt_src, fstab_file, btrfs_partition, parent_subvol=''):
         """
@@ -1402,6 +2028,10 @@ class Installer(object):
         return params
 
     def _mount_partitions(self):
+        if self.staging_size is not None:
+            # install to memory, see _flush_staging()
+            self._mount('tmpfs', '/', fstype='tmpfs', options=[f"size={self.staging_size}m", "mode=0755"], create=True)
+
         for partition in self.install_config['partitions'][::1]:
             if self._get_partition_type(partition) in [PartitionType.BIOS, PartitionType.SWAP]:
                 continue
@@ -1411,6 +2041,12 @@ class Installer(object):
                 continue
 
             mntpoint = os.path.join(self.photon_root, partition['mountpoint'].strip('/'))
+            if self.install_config['build_mode'] == "offline":
+                # the filesystem will be built from this directory
+                offline_dir = self._offline_dir(partition)
+                os.makedirs(offline_dir, exist_ok=True)
+                self._mount(offline_dir, partition['mountpoint'], bind=True, create=True)
+                continue
             if not partition.get('no_build_mount', False):
                 if partition['filesystem'] == 'squashfs':
                     squashfs_dir = os.path.join(self.working_directory, "squashfs_" + partition['mountpoint'].replace("/", "_"))
@@ -1424,7 +2060,9 @@ class Installer(object):
                     options = None
                     if 'fs_options' in partition:
                         options = partition['fs_options']
-                    self._mount(partition['path'], partition['mountpoint'], options=options, create=True)
+                    self._mount(partition['path'], partition['mountpoint'], options=options, create=True,
+                                root=self.target_root)
+                    mntpoint = os.path.join(self.target_root, partition['mountpoint'].strip('/'))
             else:
                 # we need the directory, even if we do not mount it
                 os.makedirs(mntpoint, exist_ok=True)
@@ -1435,14 +2073,62 @@ class Installer(object):
                 if 'subvols' in partition["btrfs"]:
                     self._create_btrfs_subvolumes(mntpoint, partition['btrfs'], partition['path'])
 
+    def _flush_staging(self):
+        """
+        Copy the installation from the tmpfs to the target filesystems, one
+        copy per filesystem in parallel. Special and build mounts are not
+        copied, only their mount points.
+        """
+        if self.staging_size is None:
+            return
+
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Writing to disk...')
+
+        targets = [os.path.relpath(m, self.target_root) for m in self.target_mounts]
+        skipped = [os.path.relpath(m, self.photon_root) for m in self.mounts
+                   if m.startswith(self.photon_root) and m not in self.target_mounts]
+        skipped = [m for m in skipped if m != "."]
+
+        jobs = []
+        for target in targets:
+            excludes = [os.path.relpath(m, target) for m in targets + skipped if staging.is_below(m, target)]
+            src = os.path.normpath(os.path.join(self.photon_root, target))
+            dst = os.path.normpath(os.path.join(self.target_root, target))
+            jobs.append((staging.copy_command(src, dst, excludes), dst))
+
+        results = self.cmd.run_parallel(jobs, max_jobs=self._get_max_workers(), fail_fast=True)
+        self._check_parallel_results(results, lambda result: f"Failed to copy the installation to {result.prefix}")
+
+    def _check_parallel_results(self, results, message_fn):
+        """
+        Raise an InstallerError for the command of 'results' (from
+        CommandUtils.run_parallel()) that failed, with the message from
+        'message_fn(result)'. Commands cancelled because another one failed
+        have no exit code and are not reported.
+        """
+        for result in results:
+            if result.retval is None or result.retval == 0:
+                continue
+            self.logger.error(f"[{result.prefix}] {result.cmd} failed with exit code {result.retval}")
+            for line in result.output[-20:]:
+                self.logger.error(f"[{result.prefix}] {line}")
+            raise InstallerError(f"{message_fn(result)} (exit code {result.retval})")
+
+        if any(result.retval is None for result in results):
+            raise InstallerError(f"commands were cancelled: {[r.cmd for r in results if r.retval is None]}")
+
     def _initialize_system(self):
         """
         Prepare the system to install photon
         """
+        if self.rootfs_cache_hit:
+            return
+
         if self.install_config['ui']:
             self.progress_bar.update_message('Initializing system...')
 
-        rpm_db_path = subprocess.check_output(['rpm', '-E', '%_dbpath'], universal_newlines=True).rstrip('\n')
+        rpm_db_path = cmdtrace.check_output(['rpm', '-E', '%_dbpath'], universal_newlines=True).rstrip('\n')
         if not rpm_db_path:
             self.logger.error("Rpm db path empty...")
             self.exit_gracefully()
@@ -1456,11 +2142,66 @@ class Installer(object):
             self.logger.error("Failed to initialize rpm DB")
             self.exit_gracefully()
 
-        retval = self.tdnf.run(['install', 'filesystem'], do_json=False)
+        if self.install_config['tdnf_session'] and self.tdnf.start_session():
+            self.merged_transaction = self._get_merged_transaction()
+
+        # always installed first, so the filesystem layout is in place
+        # before any other package
+        retval = self.tdnf.run(['install', self._package_spec('filesystem')], do_json=False)
         if retval != 0:
             self.logger.error("Failed to install filesystem rpm")
             self.exit_gracefully()
 
+    def _has_phase_hooks(self, phase):
+        """
+        Check if any module or plugin would be run for the phase
+        """
+        if phase == modules.commons.PRE_PKGS_INSTALL:
+            if 'prepkgsinstall' in self.install_config or 'prepkgsinstallscripts' in self.install_config:
+                return True
+
+        func_name = phase.replace('-', '_')
+        for plugin_mod in self.loaded_plugins:
+            if hasattr(plugin_mod, 'has_phase'):
+                if plugin_mod.has_phase(func_name):
+                    return True
+            elif hasattr(plugin_mod, func_name):
+                return True
+        return False
+
+    def _get_merged_transaction(self):
+        """
+        Determine what can be installed in the main package transaction
+        instead of separate tdnf runs. Returns a list of packages and rpm
+        files to be added to the main transaction.
+        """
+        merged = []
+
+        # additional rpms are installed after the main transaction, so they
+        # can replace packages from it, including dependencies. Only merge
+        # them if they do not replace any package of the resolved main
+        # transaction.
+        rpms_path = self.install_config.get('additional_rpms_path', None)
+        if rpms_path and os.path.isdir(rpms_path):
+            pkgs = glob.glob(os.path.join(rpms_path, "*.rpm"))
+            # file names are <name>-<version>-<release>.<arch>.rpm
+            names = set(os.path.basename(pkg).rsplit('-', 2)[0] for pkg in pkgs)
+
+            self._adjust_packages_based_on_selected_flavor()
+            _, solved = self.tdnf.run(['--assumeno', 'install'] + self.install_config['packages'])
+            if not isinstance(solved, dict):
+                self.logger.info("cannot resolve the main transaction, installing additional rpms separately")
+                return merged
+
+            transaction = set(pkg['Name'] for key in rpmfetch.TRANSACTION_KEYS for pkg in solved.get(key, None) or [])
+            if names & transaction:
+                self.logger.info(f"additional rpms {names & transaction} are also in the main transaction, installing them separately")
+            else:
+                merged.extend(pkgs)
+                self.additional_rpms_merged = True
+
+        return merged
+
     def _mount_special_folders(self):
         for d in ["/proc", "/dev", "/dev/pts", "/sys"]:
             self._mount(d, d, bind=True, create=True)
@@ -1558,6 +2299,9 @@ class Installer(object):
     def _cleanup_tdnf_cache(self):
         if self.install_config.get('no_clean', False) or self.install_config.get('tdnf_cachedir', None) is not None:
             return
+        if self.package_cache is not None:
+            # the cache is a mount of the private cache directory
+            return
 
         # remove the tdnf cache directory
         if self.install_config['ui']:
@@ -1568,12 +2312,18 @@ class Installer(object):
             shutil.rmtree(cache_dir)
 
     def _selinux_label(self):
-        if "selinux-policy" not in self.install_config['packages']:
+        # the package may have a version, like from a lock file
+        if self._package_spec("selinux-policy") not in self.install_config['packages']:
             return
 
-        subprocess.check_call(["chroot", self.photon_root, "/usr/sbin/setfiles", "/etc/selinux/default/contexts/files/file_contexts", "/"])
+        retval = self.cmd.run_in_chroot(self.photon_root, "/usr/sbin/setfiles /etc/selinux/default/contexts/files/file_contexts /")
+        if retval != 0:
+            raise InstallerError("Failed to set SELinux labels")
 
     def _cleanup_install_repo(self):
+        # no tdnf commands with cached metadata after the installation
+        self.tdnf.end_session()
+
         if self.install_config.get('no_clean', False):
             return
 
@@ -1583,11 +2333,13 @@ class Installer(object):
         if os.path.exists(self.tdnf_conf_path):
             os.remove(self.tdnf_conf_path)
         if 'repos' in self.install_config:
-            for repo in self.install_config['repos']:
+            for repo in list(self.install_config['repos']) + ['poi-prefetch']:
                 try:
                     os.remove(os.path.join(self.working_directory, f"{repo}.repo"))
                 except FileNotFoundError:
                     pass
+        shutil.rmtree(self.prefetch_dir, ignore_errors=True)
+        shutil.rmtree(self.prefetch_config_dir, ignore_errors=True)
 
     def _setup_grub_password(self):
         grub_cfg = self.install_config.get('grub')
@@ -1706,7 +2458,10 @@ password_pbkdf2 {grub_user} {grub_password_hash}
             partitions_data['bootdirectory'],
             self.user_grub_cfg_fn,
             self.poi_kernel_cmdline,
-        ])
+        ], env={
+            'POI_ROOT_PARTUUID': self._get_partuuid(partitions_data['root']),
+            'POI_BOOT_UUID': self._get_uuid(partitions_data['boot']),
+        })
 
         if retval != 0:
             raise InstallerError("Bootloader (grub2) setup failed")
@@ -1756,7 +2511,8 @@ password_pbkdf2 {grub_user} {grub_password_hash}
                 self.logger.info(f"Executing {func_name} from plugin {plugin_name}")
                 try:
                     func = getattr(plugin_mod, func_name)
-                    func(self)
+                    with self.timer.phase(plugin_name):
+                        func(self)
                 except Exception as e:
                     self.logger.error(f"Error executing {func_name} in plugin {plugin_name}: {e}")
                     raise InstallerError(f"Plugin {plugin_name} failed during {func_name}: {e}")
@@ -1792,7 +2548,8 @@ password_pbkdf2 {grub_user} {grub_password_hash}
                 continue
             self.logger.info("Executing: " + module)
 
-            mod.execute(self)
+            with self.timer.phase(module):
+                mod.execute(self)
 
         self._execute_external_plugins(phase)
 
@@ -1831,16 +2588,103 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         """
         Install packages on VMware virtual machine if requested
         """
+        # may already be in the list, possibly with a version
+        if self._package_spec(package) in self.install_config['packages']:
+            return
         self.install_config['packages'].append(package)
 
-    def _setup_install_repo(self):
+    def _package_spec(self, name):
         """
-        Setup the tdnf repo for installation
+        Return the entry for package 'name' from the package list, which may
+        have a version (like from a lock file), or just 'name' if not listed
+        """
+        for p in self.install_config['packages']:
+            if p == name or p.startswith(f"{name}="):
+                return p
+        return name
+
+    def _get_additional_rpms(self, install_config):
+        """
+        Return (name, arch) of the rpms in 'additional_rpms_path'
+        """
+        rpms_path = install_config.get('additional_rpms_path', None)
+        if not rpms_path or not os.path.isdir(rpms_path):
+            return set()
+        pkgs = glob.glob(os.path.join(rpms_path, "*.rpm"))
+        if not pkgs:
+            return set()
+        out = cmdtrace.check_output(["rpm", "-qp", "--nosignature", "--qf", "%{NAME}\t%{ARCH}\n"] + pkgs, text=True)
+        return set(tuple(line.split("\t")) for line in out.splitlines())
+
+    def _get_installed_packages(self):
+        """
+        Return the packages installed in the target as lock file entries,
+        without the additional rpms
+        """
+        cmd = ["rpm", "--root", self.photon_root, "-qa", "--qf",
+               "%{NAME}\t%{EPOCHNUM}\t%{VERSION}\t%{RELEASE}\t%{ARCH}\t%{SHA256HEADER}\n"]
+        if self.photon_release_version != "5.0":
+            cmd.extend(["--dbpath", self.tdnf.get_rpm_dbpath()])
+        out = cmdtrace.check_output(cmd, text=True)
+
+        additional_rpms = self._get_additional_rpms(self.install_config)
+        packages = []
+        for line in out.splitlines():
+            name, epoch, version, release, arch, sha256 = line.split("\t")
+            if name == "gpg-pubkey" or (name, arch) in additional_rpms:
+                continue
+            packages.append({
+                'name': name,
+                'epoch': int(epoch),
+                'version': version,
+                'release': release,
+                'arch': arch,
+                'checksum': {'type': "sha256header", 'value': sha256},
+            })
+
+        return packages
+
+    def _write_lockfile(self):
+        """
+        Record the exact set of installed packages in a lock file, if
+        'lockfile_output' is set. If installing from a lock file, check that
+        the result matches it.
+        """
+        lock_filename = self.install_config.get('lockfile_output', None)
+        if self.package_lock is None and lock_filename is None:
+            return
+
+        packages = self._get_installed_packages()
+
+        if self.package_lock is not None:
+            mismatches, extra = lockfile.compare(self.package_lock['packages'], packages)
+            if extra:
+                self.logger.warning(f"packages {extra} were installed, but are not in the lock file")
+            if mismatches:
+                for name, expected, actual in mismatches:
+                    self.logger.error(f"package {name}: locked version {expected}, installed {actual}")
+                raise InstallerError("installed packages do not match the lock file")
+
+        if lock_filename is None:
+            return
+        repos = {id: repo.get('baseurl', None) for id, repo in self.install_config['repos'].items()}
+        lockfile.save(lock_filename, packages,
+                      releasever=self.photon_release_version,
+                      arch=self.install_config['arch'],
+                      repos=repos)
+        self.logger.info(f"wrote lock file {lock_filename} with {len(packages)} packages")
+
+    def _write_repo_config(self, reposdir=None, tdnf_conf_path=None):
+        """
+        Write the repo files and tdnf.conf used for the installation, by
+        default to the working directory
         """
         repos = self.install_config['repos']
+        reposdir = reposdir or self.working_directory
+        tdnf_conf_path = tdnf_conf_path or self.tdnf_conf_path
 
         self.logger.info(json.dumps(repos, indent=4))
-        tdnf.create_repo_conf(repos, reposdir=self.working_directory, insecure=self.install_config.get('insecure_repo', False))
+        tdnf.create_repo_conf(repos, reposdir=reposdir, insecure=self.install_config.get('insecure_repo', False))
 
         tdnf_conf = {
             'gpgcheck': 0,
@@ -1849,21 +2693,361 @@ password_pbkdf2 {grub_user} {grub_password_hash}
             'keepcache': 0
         }
 
+        if self.install_config.get('tdnf_cachedir', None) is not None or 'package_cache' in self.install_config:
+            tdnf_conf['keepcache'] = 1
+
+        if self.tdnf_options.get('exclude_packages'):
+            tdnf_conf['excludepkgs'] = " ".join(self.tdnf_options['exclude_packages'])
+
+        self.logger.info(json.dumps(tdnf_conf, indent=4))
+
+        with open(tdnf_conf_path, "wt") as f:
+            f.write("[main]\n")
+            for key, value in tdnf_conf.items():
+                f.write(f"{key}={value}\n")
+
+    def _setup_install_repo(self):
+        """
+        Setup the tdnf repo for installation
+        """
+        self._write_repo_config()
+
         tdnf_cachedir = self.install_config.get('tdnf_cachedir', None)
 
         if tdnf_cachedir is not None:
             if not tdnf_cachedir.startswith("/"):
                 tdnf_cachedir = os.path.join(os.getcwd(), tdnf_cachedir)
-            tdnf_conf['keepcache'] = 1
             os.makedirs(tdnf_cachedir, exist_ok=True)
             self._mount(tdnf_cachedir, "/var/cache/tdnf", bind=True, create=True)
 
-        self.logger.info(json.dumps(tdnf_conf, indent=4))
+        if 'package_cache' in self.install_config:
+            self._restore_package_cache()
 
-        with open(self.tdnf_conf_path, "wt") as f:
-            f.write("[main]\n")
-            for key, value in tdnf_conf.items():
-                f.write(f"{key}={value}\n")
+        self._finish_prefetch()
+
+    def _get_prefetch_packages(self):
+        """
+        List of packages the installation will need, including the ones
+        that are added while partitioning
+        """
+        self._adjust_packages_based_on_selected_flavor()
+        packages = ['filesystem'] + self.install_config['packages']
+
+        partitions = self.install_config['partitions']
+        if any(p.get('lvm', None) for p in partitions):
+            packages.append('lvm2')
+        if any(p.get('filesystem') == 'btrfs' for p in partitions):
+            packages.append('btrfs-progs')
+
+        rpms_path = self.install_config.get('additional_rpms_path', None)
+        if rpms_path and os.path.isdir(rpms_path):
+            # resolves (and downloads) the dependencies of the additional rpms
+            packages.extend(glob.glob(os.path.join(rpms_path, "*.rpm")))
+
+        return packages
+
+    def _start_prefetch(self):
+        """
+        Start downloading all packages of the installation into a local repo
+        in the background. The download runs while the disks are partitioned,
+        formatted and mounted, the repo is used by the installation if the
+        download succeeded.
+        """
+        if not self.install_config.get('prefetch', False):
+            return
+
+        if shutil.which("createrepo") is None:
+            self.logger.info("createrepo not found, not prefetching packages")
+            return
+
+        # '--downloadonly' does not check signatures, the prefetch repo has
+        # to check them like the repos the packages come from
+        repos = [repo for repo in self.install_config['repos'].values() if int(repo.get('enabled', 1))]
+        gpgchecks = set(int(repo.get('gpgcheck', 0)) for repo in repos)
+        if len(gpgchecks) > 1:
+            self.logger.info("repos with and without gpgcheck are enabled, not prefetching packages")
+            return
+        self.prefetch_gpg = {'gpgcheck': 0}
+        if gpgchecks == {1}:
+            gpgkeys = []
+            for repo in repos:
+                for gpgkey in str(repo.get('gpgkey', "")).split():
+                    if gpgkey not in gpgkeys:
+                        gpgkeys.append(gpgkey)
+            self.prefetch_gpg = {'gpgcheck': 1, 'gpgkey': " ".join(gpgkeys)}
+
+        # a config of its own, _setup_install_repo() rewrites the one of the
+        # installation while the prefetch runs
+        prefetch_conf_path = os.path.join(self.prefetch_config_dir, "tdnf.conf")
+        os.makedirs(self.prefetch_config_dir, exist_ok=True)
+        self._write_repo_config(reposdir=self.prefetch_config_dir, tdnf_conf_path=prefetch_conf_path)
+        packages = self._get_prefetch_packages()
+
+        def _prefetch():
+            try:
+                # no installroot, '--alldeps' downloads all dependencies
+                # regardless of what is installed on the host
+                prefetch_tdnf = tdnf.Tdnf(logger=self.logger,
+                                          config_file=prefetch_conf_path,
+                                          arch=self.install_config['arch'],
+                                          reposdir=self.prefetch_config_dir,
+                                          releasever=self.photon_release_version)
+                os.makedirs(self.prefetch_dir, exist_ok=True)
+                args = ["--alldeps", "--downloadonly", "--downloaddir", self.prefetch_dir, "install"] + packages
+                self._download_packages(prefetch_tdnf, args,
+                                        lambda repo_id, package: os.path.join(self.prefetch_dir, os.path.basename(package.location)))
+                retval = prefetch_tdnf.run(args, do_json=False)
+                if retval == 0:
+                    retval = self.cmd.run(["createrepo", self.prefetch_dir])
+                self.prefetch_ok = retval == 0
+            except Exception as e:
+                self.logger.warning(f"prefetching packages failed: {e}")
+
+        self.logger.info("prefetching packages in the background")
+        self.prefetch_thread = threading.Thread(target=_prefetch, name="prefetch", daemon=True)
+        self.prefetch_thread.start()
+
+    def _finish_prefetch(self):
+        """
+        Wait for the background download, and add the local repo with the
+        downloaded packages with higher priority than the configured repos
+        """
+        if self.prefetch_thread is None:
+            return
+
+        self.logger.info("waiting for prefetching packages to finish")
+        with self.timer.phase("prefetch_wait"):
+            self.prefetch_thread.join()
+        self.prefetch_thread = None
+
+        if not self.prefetch_ok:
+            self.logger.warning("prefetching packages failed, packages will be downloaded during installation")
+            return
+
+        tdnf.create_repo_conf({
+            'poi-prefetch': {
+                'name': "Photon OS Installer prefetched packages",
+                'baseurl': f"file://{self.prefetch_dir}",
+                'enabled': 1,
+                'priority': 1,
+                **self.prefetch_gpg,
+            }
+        }, reposdir=self.working_directory)
+
+    def _expand_baseurl(self, baseurl):
+        return rpmfetch.expand_baseurl(baseurl, self.photon_release_version, self.install_config['arch'])
+
+    def _download_packages(self, tdnf_cmd, args, dest_path):
+        """
+        Download the packages of the transaction of the tdnf command 'args'
+        in parallel before tdnf runs, if 'parallel_downloads' is set.
+        'dest_path(repo_id, package)' is where tdnf looks for a package.
+        Failures are not fatal, tdnf downloads whatever is missing.
+        """
+        connections = self.install_config.get('parallel_downloads', 0)
+        if not connections:
+            return
+
+        repos = {}
+        for repo_id, repo in self.install_config['repos'].items():
+            baseurl = repo.get('baseurl', None)
+            if int(repo.get('enabled', 1)) and baseurl is not None and not baseurl.startswith("file://"):
+                repos[repo_id] = self._expand_baseurl(baseurl)
+        if not repos:
+            return
+
+        _, solved = tdnf_cmd.run(['--assumeno'] + args)
+        if not isinstance(solved, dict):
+            self.logger.warning("cannot resolve the packages to download, leaving the downloads to tdnf")
+            return
+
+        fetcher = rpmfetch.RpmFetcher(self.logger, connections=connections,
+                                      verify=not self.install_config.get('insecure_repo', False))
+        with self.timer.phase("parallel_downloads"):
+            stats = rpmfetch.fetch_transaction(fetcher, solved, repos, dest_path)
+        self.logger.info(f"downloaded {stats['files']} packages ({stats['bytes']} bytes) in parallel, "
+                         f"{len(stats['failed'])} failed")
+
+    def _get_repo_state(self):
+        """
+        Return the checksums of the repo metadata of all enabled repos, which
+        change whenever the content of a repo changes. Returns None if the
+        metadata of a repo cannot be read.
+        """
+        state = {}
+        for repo_id, repo in self.install_config['repos'].items():
+            if not int(repo.get('enabled', 1)):
+                continue
+            baseurl = repo.get('baseurl', None)
+            if baseurl is None:
+                self.logger.info(f"repo '{repo_id}' has no baseurl")
+                return None
+
+            url = self._expand_baseurl(baseurl).rstrip("/") + "/repodata/repomd.xml"
+            if url.startswith("file://"):
+                try:
+                    with open(url[len("file://"):], "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    self.logger.info(f"cannot read {url}: {e}")
+                    return None
+            else:
+                r = CommandUtils._requests_get(url, not self.install_config.get('insecure_repo', False))
+                if r is None or not r.ok:
+                    self.logger.info(f"cannot download {url}")
+                    return None
+                data = r.content
+            state[repo_id] = hashlib.sha256(data).hexdigest()
+        return state
+
+    def _get_rootfs_cache_inputs(self):
+        """
+        Everything that determines the installed tree before it is finalized
+        """
+        repo_state = self._get_repo_state()
+        if repo_state is None:
+            return None
+
+        additional_rpms = {}
+        rpms_path = self.install_config.get('additional_rpms_path', None)
+        if rpms_path and os.path.isdir(rpms_path):
+            for pkg in glob.glob(os.path.join(rpms_path, "*.rpm")):
+                with open(pkg, "rb") as f:
+                    additional_rpms[os.path.basename(pkg)] = hashlib.sha256(f.read()).hexdigest()
+
+        return {
+            'packages': sorted(set(self.install_config['packages'])),
+            'repos': repo_state,
+            'additional_rpms': additional_rpms,
+            'arch': self.install_config['arch'],
+            'releasever': self.photon_release_version,
+            'rpm_dbpath': cmdtrace.check_output(['rpm', '-E', '%_dbpath'], universal_newlines=True).rstrip('\n'),
+            'tdnf_options': self.tdnf_options,
+        }
+
+    def _restore_rootfs_cache(self):
+        """
+        Restore the installed packages from the rootfs cache if a snapshot
+        for the same packages and repos exists
+        """
+        if 'rootfs_cache' not in self.install_config:
+            return
+
+        # scripts and plugins can change the tree in ways we cannot know
+        if self._has_phase_hooks(modules.commons.PRE_PKGS_INSTALL):
+            self.logger.info("not using the rootfs cache because of pre-pkgs-install scripts or plugins")
+            return
+
+        self._adjust_packages_based_on_selected_flavor()
+        inputs = self._get_rootfs_cache_inputs()
+        if inputs is None:
+            self.logger.info("not using the rootfs cache, repo state is unknown")
+            return
+
+        cache_config = self.install_config['rootfs_cache']
+        cache_dir = cache_config['path']
+        if not cache_dir.startswith("/"):
+            cache_dir = os.path.join(self.cwd, cache_dir)
+        self.rootfs_cache = RootfsCache(cache_dir, cache_config['max_size'] * 1024 * 1024, self.logger)
+        self.rootfs_cache_key = RootfsCache.key(inputs)
+
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Checking rootfs cache...')
+
+        self.rootfs_cache_hit = self.rootfs_cache.restore(self.rootfs_cache_key, self.photon_root)
+        if not self.rootfs_cache_hit:
+            self.logger.info(f"rootfs cache miss for {self.rootfs_cache_key}")
+
+    def _store_rootfs_cache(self):
+        if self.rootfs_cache is None or self.rootfs_cache_hit:
+            return
+
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Storing rootfs in cache...')
+
+        # contents of bind mounts are not part of the installation
+        exclude = list(self.install_config.get('build_mounts', {}).values())
+        self.rootfs_cache.store(self.rootfs_cache_key, self.photon_root, exclude=exclude)
+
+    def _get_package_cache_repos(self):
+        """
+        Repos whose packages are cached, by repo id, with the base urls
+        expanded so different releases and architectures do not share an
+        index. Local repos are not cached.
+        """
+        repos = {}
+        for repo_id, repo in self.install_config['repos'].items():
+            baseurl = repo.get('baseurl', None)
+            if not int(repo.get('enabled', 1)) or baseurl is None or baseurl.startswith("file://"):
+                continue
+            repos[repo_id] = self._expand_baseurl(baseurl)
+        return repos
+
+    def _restore_package_cache(self):
+        """
+        Fill a private tdnf cache directory with the cached packages, and
+        mount it as the tdnf cache of the installation. Concurrent
+        installations do not share a tdnf cache directory, only the package
+        cache.
+        """
+        cache_config = self.install_config['package_cache']
+        cache_dir = cache_config['path']
+        if not cache_dir.startswith("/"):
+            cache_dir = os.path.join(self.cwd, cache_dir)
+        self.package_cache = PackageCache(cache_dir, cache_config['max_size'] * 1024 * 1024, self.logger)
+
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Checking package cache...')
+
+        # only packages that match the current repo metadata are restored
+        repos = self._get_package_cache_repos()
+        fetcher = rpmfetch.RpmFetcher(self.logger, verify=not self.install_config.get('insecure_repo', False))
+        checksums = {}
+        for repo_id, metadata in rpmfetch.load_metadata(fetcher, repos).items():
+            checksums[repo_id] = {p.location: (p.checksum_type, p.checksum) for p in metadata.packages.values()}
+
+        shutil.rmtree(self.package_cache_dir, ignore_errors=True)
+        os.makedirs(self.package_cache_dir)
+        self.package_cache_restored = self.package_cache.restore(repos, self.package_cache_dir, checksums)
+        self._mount(self.package_cache_dir, "/var/cache/tdnf", bind=True, create=True)
+
+    def _get_installed_rpm_filenames(self):
+        """
+        File names of the rpms of the packages installed in the target
+        """
+        cmd = ["rpm", "--root", self.photon_root, "-qa", "--qf",
+               "%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}.rpm\n"]
+        if self.photon_release_version != "5.0":
+            cmd.extend(["--dbpath", self.tdnf.get_rpm_dbpath()])
+        return set(cmdtrace.check_output(cmd, text=True).splitlines())
+
+    def _store_package_cache(self):
+        """
+        Add the downloaded packages to the package cache, and count the
+        packages that did not have to be downloaded
+        """
+        if self.package_cache is None:
+            return
+
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Storing packages in cache...')
+
+        downloaded = self.package_cache.store(self._get_package_cache_repos(), self.package_cache_dir,
+                                              self.package_cache_restored)
+
+        # all cached packages of a repo are linked, count only the ones used
+        installed = self._get_installed_rpm_filenames() if not self.rootfs_cache_hit else set()
+        hits = {path: size for path, size in self.package_cache_restored.items()
+                if os.path.basename(path) in installed}
+        self.package_cache_stats = {
+            'path': self.package_cache.cache_dir,
+            'hits': len(hits),
+            'misses': len(downloaded),
+            'bytes_saved': sum(hits.values()),
+            'bytes_downloaded': sum(downloaded.values()),
+        }
+        self.logger.info(f"package cache: {len(hits)} hits, {len(downloaded)} misses, "
+                         f"{self.package_cache_stats['bytes_saved']} bytes saved")
 
     def _install_additional_rpms(self):
         rpms_path = self.install_config.get('additional_rpms_path', None)
@@ -1874,6 +3058,13 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         if not os.path.exists(rpms_path):
             raise InstallerError(f"additional rpms path '{rpms_path}' not found")
 
+        if self.additional_rpms_merged:
+            self.logger.info(f"additional rpms from '{rpms_path}' were installed with the other packages")
+            return
+
+        if self.rootfs_cache_hit:
+            return
+
         pkgs = glob.glob(os.path.join(rpms_path, "*.rpm"))
         retval = self.tdnf.run(['install'] + pkgs, do_json=False)
 
@@ -1884,62 +3075,73 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         """
         Install packages using tdnf command
         """
+        if self.rootfs_cache_hit:
+            self.logger.info("packages were restored from the rootfs cache")
+            return
+
         self._adjust_packages_based_on_selected_flavor()
-        selected_packages = self.install_config['packages']
+        selected_packages = self.merged_transaction + self.install_config['packages']
         state = 0
         packages_to_install = {}
         total_size = 0
         stderr = None
 
+        # tdnf finds the packages in its cache in the target
+        tdnf_cache_dir = os.path.join(self.photon_root, "var/cache/tdnf")
+        self._download_packages(self.tdnf, ['install'] + selected_packages,
+                                lambda repo_id, package: os.path.join(tdnf_cache_dir, repo_id, "rpms", package.location))
+
         if self.install_config['ui']:
-            tdnf_cmd = ("tdnf install -y --releasever {0} --installroot {1} "
-                        "-c {2} --setopt=reposdir={3} "
-                        "{4}").format(self.photon_release_version,
-                                      self.photon_root,
-                                      self.tdnf_conf_path,
-                                      self.working_directory,
-                                      " ".join(selected_packages))
-
-            # run in shell to do not throw exception if tdnf not found
-            process = subprocess.Popen(tdnf_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            while True:
-                output = process.stdout.readline().decode()
-                if output == '':
-                    retval = process.poll()
-                    if retval is not None:
-                        stderr = process.communicate()[1]
-                        break
-                if state == 0:
-                    if output == 'Installing:\n':
-                        state = 1
-                elif state == 1:  # N A EVR Size(readable) Size(in bytes)
-                    if output == '\n':
-                        state = 2
-                        self.progress_bar.update_num_items(total_size)
+            # same options, rpm defines and environment as all other tdnf calls
+            tdnf_cmd = self.tdnf.get_command(['install'] + selected_packages, do_json=False)
+            env = None
+            if self.tdnf.env:
+                env = {**os.environ, **self.tdnf.env}
+            self.logger.info(f"running {' '.join(tdnf_cmd)}")
+
+            with cmdtrace.command(tdnf_cmd) as traced:
+                process = subprocess.Popen(tdnf_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+                traced.pid = process.pid
+
+                while True:
+                    output = process.stdout.readline().decode()
+                    traced.add_output(output)
+                    if output == '':
+                        retval = process.poll()
+                        if retval is not None:
+                            stderr = process.communicate()[1]
+                            traced.exit_code = retval
+                            break
+                    if state == 0:
+                        if output == 'Installing:\n':
+                            state = 1
+                    elif state == 1:  # N A EVR Size(readable) Size(in bytes)
+                        if output == '\n':
+                            state = 2
+                            self.progress_bar.update_num_items(total_size)
+                        else:
+                            info = output.split()
+                            package = f'{info[0]}-{info[2]}.{info[1]}'
+                            rpm_download_size = self.cmd.convertToBytes(info[5])
+                            packages_to_install[package] = rpm_download_size
+                            total_size += rpm_download_size
+                    elif state == 2:
+                        output_status = ["Downloading", "Testing transaction"]
+                        if output.startswith(tuple(output_status)):
+                            self.progress_bar.update_message('Preparing ...')
+                            state = 3
+                    elif state == 3:
+                        self.progress_bar.update_message(output)
+                        if output == 'Running transaction\n':
+                            state = 4
                     else:
-                        info = output.split()
-                        package = f'{info[0]}-{info[2]}.{info[1]}'
-                        rpm_download_size = self.cmd.convertToBytes(info[5])
-                        packages_to_install[package] = rpm_download_size
-                        total_size += rpm_download_size
-                elif state == 2:
-                    output_status = ["Downloading", "Testing transaction"]
-                    if output.startswith(tuple(output_status)):
-                        self.progress_bar.update_message('Preparing ...')
-                        state = 3
-                elif state == 3:
-                    self.progress_bar.update_message(output)
-                    if output == 'Running transaction\n':
-                        state = 4
-                else:
-                    self.logger.info(f"[tdnf] {output}")
-                    prefix = 'Installing/Updating: '
-                    if output.startswith(prefix):
-                        package = output[len(prefix):].rstrip('\n')
-                        self.progress_bar.increment(packages_to_install[package])
+                        self.logger.info(f"[tdnf] {output}")
+                        prefix = 'Installing/Updating: '
+                        if output.startswith(prefix):
+                            package = output[len(prefix):].rstrip('\n')
+                            self.progress_bar.increment(packages_to_install[package])
 
-                    self.progress_bar.update_message(output)
+                        self.progress_bar.update_message(output)
         else:
             retval = self.tdnf.run(['install'] + selected_packages, do_json=False)
 
@@ -2008,8 +3210,8 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         if 'nvme' in disk or 'mmcblk' in disk or 'loop' in disk:
             prefix = 'p'
 
-        # loop partitions device names are /dev/mapper/loopXpY instead of /dev/loopXpY
-        if 'loop' in disk:
+        # loop partitions mapped with kpartx are /dev/mapper/loopXpY instead of /dev/loopXpY
+        if 'loop' in disk and not loopdev.has_partscan(disk):
             path = '/dev/mapper' + disk[4:] + prefix + repr(part_idx)
         else:
             path = disk + prefix + repr(part_idx)
@@ -2062,11 +3264,13 @@ password_pbkdf2 {grub_user} {grub_password_hash}
             return '8300'
         raise InstallerError(f"Unknown partition type: {ptype}")
 
-    def _mount(self, device, mntpoint, bind=False, options=None, fstype=None, create=False):
-        mntpoint = os.path.join(self.photon_root, mntpoint.strip("/"))
+    def _mount(self, device, mntpoint, bind=False, options=None, fstype=None, create=False, root=None):
+        if root is None:
+            root = self.photon_root
+        mntpoint = os.path.join(root, mntpoint.strip("/"))
 
         self.logger.info(f"mounting {device} to {mntpoint}")
-        assert mntpoint.startswith(self.photon_root)
+        assert mntpoint.startswith(root)
 
         if create:
             if bind and not os.path.isdir(device):
@@ -2094,6 +3298,8 @@ password_pbkdf2 {grub_user} {grub_password_hash}
             self.exit_gracefully()
         else:
             self.mounts.append(mntpoint)
+            if root != self.photon_root:
+                self.target_mounts.append(mntpoint)
 
     def _mount_btrfs_subvol(self, mountpoint, disk, subvol_name, fs_options=None, parent_subvol=""):
         """
@@ -2105,7 +3311,7 @@ password_pbkdf2 {grub_user} {grub_password_hash}
 
         options = fs_options.copy() if fs_options else []
         options.append(f"subvol={os.path.join(parent_subvol, subvol_name)}")
-        self._mount(disk, mountpoint, options=options, create=True)
+        self._mount(disk, mountpoint, options=options, create=True, root=self.target_root)
 
     def _create_btrfs_subvolumes(self, path, partition, disk, parent_subvol=""):
         """
@@ -2135,103 +3341,46 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         """
         Create logical volumes
         """
-        # Remove LVM logical volumes and volume groups if already exists
-        # Existing lvs & vg should be removed to continue re-installation
-        # else pvcreate command fails to create physical volumes even if executes forcefully
-        retval = self.cmd.run(['bash', '-c', f'pvs | grep {vg_name}'])
-        if retval == 0:
-            # Remove LV's associated to VG and VG
-            retval = self.cmd.run(["vgremove", "-f", vg_name])
-            if retval != 0:
-                self.logger.error(f"Error: Failed to remove existing vg before installation {vg_name}")
         # if vg is not extensible (all lvs inside are known size) then make last lv
         # extensible, i.e. shrink it. Srinking last partition is important. We will
         # not be able to provide specified size because given physical partition is
         # also used by LVM header.
-        extensible_logical_volume = None
         if not extensible:
-            extensible_logical_volume = lv_partitions[-1]
-            extensible_logical_volume['size'] = 0
+            lv_partitions[-1]['size'] = 0
 
-        # create physical volume
-        command = ['pvcreate', '-ff', '-y', physical_partition]
-        retval = self.cmd.run(command)
-        if retval != 0:
-            raise InstallerError(f"Error: Failed to create physical volume, command : {command}")
+        # Each volume group can have only one extensible logical volume, it
+        # has to be created last
+        extensible_lvs = [p for p in lv_partitions if p['size'] == 0]
+        if not extensible_lvs:
+            raise InstallerError("Can not fully partition VG: " + vg_name)
+        ordered_lvs = [p for p in lv_partitions if p['size'] != 0] + extensible_lvs[:1]
 
-        # create volume group
-        command = ['vgcreate', vg_name, physical_partition]
-        retval = self.cmd.run(command)
-        if retval != 0:
-            raise InstallerError(f"Error: Failed to create volume group, command = {command}")
-
-        def _wait_for_device(device_path, timeout=30, check_interval=0.1):
-            """
-            Wait for a device node to appear and be accessible.
-            Returns True if device appears, False if timeout.
-            """
-            elapsed = 0
-            while elapsed < timeout:
-                if os.path.exists(device_path):
-                    # Device exists, verify it's accessible
-                    try:
-                        # Try to stat the device to ensure it's fully ready
-                        os.stat(device_path)
-                        self.logger.info(f"Device {device_path} is ready (waited {elapsed:.2f}s)")
-                        return True
-                    except OSError:
-                        pass
-                time.sleep(check_interval)
-                elapsed += check_interval
-            self.logger.error(f"Timeout waiting for device {device_path} after {timeout}s")
-            return False
+        # existing lvs & vg are removed by create_vg(), else pvcreate fails
+        try:
+            self.lvm.create_vg(vg_name, physical_partition,
+                               [(p['lvm']['lv_name'], p['size']) for p in ordered_lvs])
+        except LvmError as e:
+            raise InstallerError(f"Error: Failed to create volume group {vg_name}: {e}")
 
-        # create logical volumes
         for partition in lv_partitions:
-            lv_cmd = ['lvcreate', '-y', '--zero', 'n']
             lv_name = partition['lvm']['lv_name']
-            size = partition['size']
-            if size == 0:
-                # Each volume group can have only one extensible logical volume
-                if not extensible_logical_volume:
-                    extensible_logical_volume = partition
-            else:
-                lv_cmd.extend(['-L', f'{size}M', '-n', lv_name, vg_name])
-                retval = self.cmd.run(lv_cmd)
-                if retval != 0:
-                    raise InstallerError(f"Error: Failed to create logical volumes , command: {lv_cmd}")
-
             # Determine device path
             if "loop" not in partition['device']:
                 partition['path'] = os.path.join("/dev", vg_name, lv_name)
             else:
                 partition['path'] = os.path.join("/dev/mapper", f"{vg_name}-{lv_name}")
 
-            # Wait for device node to appear after lvcreate (fixes race condition in containers)
-            if size != 0:  # Only for volumes we just created
-                self.cmd.run(['udevadm', 'settle', '-E', partition['path']])
-                if not _wait_for_device(partition['path'], timeout=30):
-                    raise InstallerError(f"Device {partition['path']} did not appear after lvcreate")
-
-        # create extensible logical volume
-        if not extensible_logical_volume:
-            raise InstallerError("Can not fully partition VG: " + vg_name)
-
-        lv_name = extensible_logical_volume['lvm']['lv_name']
-        lv_cmd = ['lvcreate', '-y', '--zero', 'n']
-        lv_cmd.extend(['-l', '100%FREE', '-n', lv_name, vg_name])
-
-        retval = self.cmd.run(lv_cmd)
-        if retval != 0:
-            raise InstallerError(f"Error: Failed to create extensible logical volume, command = {lv_cmd}")
-
-        # Wait for device node to appear after lvcreate (fixes race condition in containers)
-        self.cmd.run(['udevadm', 'settle', '-E', extensible_logical_volume['path']])
-        if not _wait_for_device(extensible_logical_volume['path'], timeout=30):
-            raise InstallerError(f"Device {extensible_logical_volume['path']} did not appear after lvcreate")
-
-        # remember pv/vg for detaching it later.
-        self.lvs_to_detach['pvs'].append(os.path.basename(physical_partition))
+        # Wait for device nodes to appear after lvcreate (fixes race condition in containers)
+        for partition in ordered_lvs:
+            start = time.monotonic()
+            if not readiness.wait_for_block_device(partition['path'], timeout=30):
+                raise InstallerError(f"Device {partition['path']} did not appear after lvcreate")
+            self.logger.info(f"Device {partition['path']} is ready (waited {time.monotonic() - start:.2f}s)")
+
+        # remember pv/vg for detaching it later. Only device mapper PVs (from
+        # kpartx) need to be removed.
+        if physical_partition.startswith("/dev/mapper/"):
+            self.lvs_to_detach['pvs'].append(os.path.basename(physical_partition))
         self.lvs_to_detach['vgs'].append(vg_name)
 
     def _get_partition_tree_view(self):
@@ -2362,18 +3511,18 @@ password_pbkdf2 {grub_user} {grub_password_hash}
                     self.__set_ab_partition_size(l2entries, used_size, total_disk_size)
 
     def _clear_vgs(self):
-        retval, active_vg_list = self.cmd.get_vgnames()
-        if retval != 0:
-            self.logger.warning("no LVM volume groups to clear found")
+        active_vg_list = self.lvm_state.vgs
+        if not active_vg_list:
+            self.logger.info("no LVM volume groups to clear found")
         else:
             # clear VG names that are in use and that we care about
             for vg_name in self.vg_names:
                 if vg_name not in active_vg_list:
                     continue
-                retval = self.cmd.run(['vgremove', '-ff', vg_name])
-                if retval == 0:
+                try:
+                    self.lvm.run(['vgremove', '-ff', vg_name])
                     self.logger.info(f"Cleared volume group {vg_name} and its associated LVs")
-                else:
+                except LvmError:
                     self.logger.error(f"Error: Failed to remove existing VG: {vg_name} before clearing the disk")
                     self.exit_gracefully()
 
@@ -2383,93 +3532,165 @@ password_pbkdf2 {grub_user} {grub_password_hash}
                 if line.startswith(device):
                     raise InstallerError("device '{device}' appears to be in use (mounted)")
 
-    def _partition_disks(self):
+    def _write_partition_table(self, device, parts, table_type, sector_size=None):
         """
-        Partition the disk
+        Write the partition table in one pass, and have the kernel re-read it
+        once, instead of running sgdisk multiple times
         """
+        self.logger.info(f"[{device}] writing {table_type} partition table with {len(parts)} partitions")
+        try:
+            if parts:
+                _, reread_ok = partitiontable.write(device, parts, table_type=table_type, sector_size=sector_size)
+            else:
+                reread_ok = partitiontable.zap(device, sector_size=sector_size)
+        except (OSError, partitiontable.PartitionTableError) as e:
+            raise InstallerError(f"failed to partition disk '{device}': {e}")
 
-        if self.install_config['ui']:
-            self.progress_bar.update_message('Partitioning...')
+        for p in parts:
+            self.logger.info(f"[{device}] partition {p.number}: sectors {p.first_lba}-{p.last_lba}, type {p.type_code}")
+        if not reread_ok and 'loop' not in device and not os.path.isfile(device):
+            # loop devices without partscan use kpartx instead
+            self.logger.warning(f"[{device}] kernel could not re-read the partition table")
 
-        ptv = self._get_partition_tree_view()
+    def _run_sgdisk(self, device, parts, table_type):
+        """
+        Partition the disk with sgdisk, for partition types the built in
+        writer does not know
+        """
+        # Clear the disk first
+        retval = self.cmd.run_buffered(["sgdisk", "-Z", device], prefix=device)
+        if retval != 0:
+            raise InstallerError(f"failed clearing disk '{device}'")
+        if not parts:
+            return
 
-        self.__ptv_update_partition_sizes(ptv)
+        # Build partition command
+        partition_cmd = ['sgdisk']
+        # command option for extensible partition
+        last_partition = None
+
+        for p in parts:
+            this_cmd = partition_cmd
+            if p.size == 0:
+                last_partition = []
+                this_cmd = last_partition
+                this_cmd.append(f'-n{p.number}')
+            else:
+                this_cmd.append(f"-n{p.number}::+{p.size}M")
 
-        self.logger.info(json.dumps(ptv, indent=4))
-        partitions = self.install_config['partitions']
-        partitions_data = {}
-        lvm_present = False
+            this_cmd.append(f"-t{p.number}:{p.type_code}")
 
-        # Partitioning disks
-        for device, l2entries in ptv.items():
-            self._check_device(device)
+            if p.name is not None:
+                this_cmd.append(f"-c{p.number}:{p.name}")
 
-            # Clear the disk first
-            retval = self.cmd.run(["sgdisk", "-Z", device])
+        # if extensible partition present, add it to the end of the disk
+        if last_partition:
+            partition_cmd.extend(last_partition)
+        partition_cmd.extend(['-p', device])
+
+        # Run the partitioning command (all physical partitions in one shot)
+        retval = self.cmd.run_buffered(partition_cmd, prefix=device)
+        if retval != 0:
+            raise InstallerError(f"failed to partition disk, command: {partition_cmd}")
+
+        # For RPi image we used 'parted' instead of 'sgdisk':
+        # parted -s $IMAGE_NAME mklabel msdos mkpart primary fat32 1M 30M mkpart primary ext4 30M 100%
+        # Try to use 'sgdisk -m' to convert GPT to MBR and see whether it works.
+        if table_type == 'msdos':
+            # m - colon separated partitions list
+            m = ":".join([str(p.number) for p in parts])
+            retval = self.cmd.run_buffered(['sgdisk', '-m', m, device], prefix=device)
             if retval != 0:
-                raise InstallerError(f"failed clearing disk '{device}'")
+                raise InstallerError("Failed to setup efi partition")
 
-            if not l2entries[0].get('all_disk', False):
-                # Build partition command and insert 'part' into 'partitions'
-                part_idx = 1
-                partition_cmd = ['sgdisk']
-                # command option for extensible partition
-                last_partition = None
+    def _partition_disk(self, device, l2entries):
+        """
+        Partition a single disk, and create its logical volumes
+        """
+        self._check_device(device)
 
-                for l2 in l2entries:
-                    if 'lvs' in l2:
-                        # will be used for _create_logical_volumes() invocation
-                        l2['path'] = self._get_partition_path(device, part_idx)
-                    else:
-                        l2['partition']['path'] = self._get_partition_path(device, part_idx)
+        all_disk = l2entries[0].get('all_disk', False)
+        table_type = self.install_config.get('partition_type', 'gpt')
 
-                    this_cmd = partition_cmd
-                    if l2['size'] == 0:
-                        last_partition = []
-                        this_cmd = last_partition
-                        this_cmd.append(f'-n{part_idx}')
-                    else:
-                        this_cmd.append(f"-n{part_idx}::+{l2['size']}M")
+        offline_build = self.install_config['build_mode'] == "offline"
+        sector_size = None
+        if offline_build:
+            # a plain file does not know the sector size of the image
+            sector_size = next((disk.get('sector_size', 512) for disk in self.install_config['disks'].values()
+                                if disk['device'] == device), 512)
 
-                    this_cmd.append(f"-t{part_idx}:{l2['type']}")
+        part_idx = 1
+        parts = []
+        for l2 in l2entries:
+            if all_disk:
+                break
+            if offline_build:
+                # there are no partition devices, the path only identifies
+                # the partition
+                path = f"{device}p{part_idx}"
+            else:
+                path = self._get_partition_path(device, part_idx)
+            if 'lvs' in l2:
+                # will be used for _create_logical_volumes() invocation
+                l2['path'] = path
+            else:
+                l2['partition']['path'] = path
+            partlabel = l2['partition'].get('partlabel') if 'partition' in l2 else None
+            parts.append(partitiontable.Partition(part_idx, l2['size'], l2['type'], partlabel))
+            part_idx += 1
 
-                    if 'partition' in l2 and l2['partition'].get('partlabel') is not None:
-                        this_cmd.append(f"-c{part_idx}:{l2['partition']['partlabel']}")
+        if offline_build or all(partitiontable.is_supported(p.type_code, table_type) for p in parts):
+            self._write_partition_table(device, parts, table_type, sector_size=sector_size)
+        else:
+            self._run_sgdisk(device, parts, table_type)
+
+        if offline_build:
+            for p in parts:
+                self.offline_layout[f"{device}p{p.number}"] = {
+                    'image': device,
+                    'offset': p.first_lba * sector_size,
+                    'size': (p.last_lba - p.first_lba + 1) * sector_size,
+                    'partuuid': p.uuid,
+                    'fs_uuid': None,
+                }
+        elif not all_disk:
+            # Make loop disk partitions available
+            if 'loop' in device:
+                if loopdev.has_partscan(device):
+                    # the kernel already re-read the partition table
+                    if loopdev.ensure_partition_nodes(device) < part_idx - 1:
+                        raise InstallerError(f"kernel did not find the partitions of {device}, try setting 'loop_backend' to 'kpartx'")
+                else:
+                    retval = self.cmd.run_buffered(['kpartx', '-avs', device], prefix=device)
+                    if retval != 0:
+                        raise InstallerError(f"failed to rescan partitions of the disk image {device}")
+
+        # Go through l2 entries again and create logical partitions
+        for l2 in l2entries:
+            if 'lvs' not in l2:
+                continue
+            self._create_logical_volumes(l2['path'], l2['vg_name'], l2['lvs'], l2['extensible'])
 
-                    part_idx += 1
+    def _partition_disks(self):
+        """
+        Partition the disk
+        """
 
-                # if extensible partition present, add it to the end of the disk
-                if last_partition:
-                    partition_cmd.extend(last_partition)
-                partition_cmd.extend(['-p', device])
+        if self.install_config['ui']:
+            self.progress_bar.update_message('Partitioning...')
 
-                # Run the partitioning command (all physical partitions in one shot)
-                retval = self.cmd.run(partition_cmd)
-                if retval != 0:
-                    raise InstallerError(f"failed to partition disk, command: {partition_cmd}")
+        ptv = self._get_partition_tree_view()
 
-                # For RPi image we used 'parted' instead of 'sgdisk':
-                # parted -s $IMAGE_NAME mklabel msdos mkpart primary fat32 1M 30M mkpart primary ext4 30M 100%
-                # Try to use 'sgdisk -m' to convert GPT to MBR and see whether it works.
-                if self.install_config.get('partition_type', 'gpt') == 'msdos':
-                    # m - colon separated partitions list
-                    m = ":".join([str(i) for i in range(1, part_idx)])
-                    retval = self.cmd.run(['sgdisk', '-m', m, device])
-                    if retval != 0:
-                        raise InstallerError("Failed to setup efi partition")
+        self.__ptv_update_partition_sizes(ptv)
 
-                # Make loop disk partitions available
-                if 'loop' in device:
-                    retval = self.cmd.run(['kpartx', '-avs', device])
-                    if retval != 0:
-                        raise InstallerError(f"failed to rescan partitions of the disk image {device}")
+        self.logger.info(json.dumps(ptv, indent=4))
+        partitions = self.install_config['partitions']
+        partitions_data = {}
 
-            # Go through l2 entries again and create logical partitions
-            for l2 in l2entries:
-                if 'lvs' not in l2:
-                    continue
-                lvm_present = True
-                self._create_logical_volumes(l2['path'], l2['vg_name'], l2['lvs'], l2['extensible'])
+        # disks are independent of each other
+        self._run_parallel(lambda item: self._partition_disk(*item), list(ptv.items()))
+        self.blkid.invalidate()
+        lvm_present = any('lvs' in l2 for l2entries in ptv.values() for l2 in l2entries)
 
         if lvm_present:
             # add lvm2 package to install list
@@ -2503,7 +3724,13 @@ password_pbkdf2 {grub_user} {grub_password_hash}
         partitions = self.install_config['partitions'].copy()
         self.logger.info(json.dumps(partitions, indent=4))
 
+        if self.install_config['build_mode'] == "offline":
+            # filesystems are built when the installation is done
+            self._set_offline_ids()
+            return
+
         # Format the filesystem
+        jobs = []
         for partition in partitions:
             # unformatted partition
             if partition['filesystem'] is None:
@@ -2540,11 +3767,126 @@ password_pbkdf2 {grub_user} {grub_password_hash}
                     mkfs_cmd.extend(["-L", partition['label']])
 
             mkfs_cmd.extend([partition['path']])
-            retval = self.cmd.run(mkfs_cmd)
+            jobs.append((partition, mkfs_cmd))
 
-            if retval != 0:
-                raise InstallerError(
-                    f"Failed to format {partition['filesystem']} partition at {partition['path']}")
+        # partitions are independent of each other, mkfs is mostly waiting
+        # for I/O
+        results = self.cmd.run_parallel([(mkfs_cmd, partition['path']) for partition, mkfs_cmd in jobs],
+                                        max_jobs=self._get_max_workers(), fail_fast=True)
+        filesystems = {partition['path']: partition['filesystem'] for partition, _ in jobs}
+        self._check_parallel_results(
+            results, lambda result: f"Failed to format {filesystems[result.prefix]} partition at {result.prefix}")
+
+        # read the identifiers of all new filesystems at once
+        self.blkid.invalidate()
+        self.blkid.load([p['path'] for p in partitions if p.get('path', None)])
+
+    def _set_offline_ids(self):
+        """
+        Choose the UUIDs of the filesystems that will be built offline, and
+        make them and the PARTUUIDs known, so fstab and the boot loader
+        configuration can use them before the filesystems exist
+        """
+        for partition in self.install_config['partitions']:
+            path = partition.get('path')
+            if path not in self.offline_layout:
+                continue
+            layout = self.offline_layout[path]
+            tags = {'PARTUUID': layout['partuuid']}
+            filesystem = partition['filesystem']
+            if filesystem == 'vfat':
+                layout['fs_uuid'], tags['UUID'] = offline.vfat_volume_id()
+            elif filesystem is not None and filesystem != 'squashfs' and self._get_partition_type(partition) != PartitionType.BIOS:
+                layout['fs_uuid'] = tags['UUID'] = str(uuid.uuid4())
+            if partition.get('partlabel') is not None:
+                tags['PARTLABEL'] = partition['partlabel']
+            if partition.get('label') is not None:
+                tags['LABEL'] = partition['label']
+            self.blkid.set(path, tags)
+
+    def _offline_dir(self, partition):
+        return os.path.join(self.working_directory, "offline_" + partition['mountpoint'].replace("/", "_"))
+
+    def _build_offline_filesystems(self):
+        """
+        Build the filesystems from the directories the installation was done
+        to, and copy them into the disk images
+        """
+        empty_dir = os.path.join(self.working_directory, "offline_empty")
+        os.makedirs(empty_dir, exist_ok=True)
+
+        jobs = []
+        for idx, partition in enumerate(self.install_config['partitions']):
+            if partition['filesystem'] is None or self._get_partition_type(partition) == PartitionType.BIOS:
+                continue
+            src_dir = empty_dir
+            if partition.get('mountpoint') is not None and not partition.get('shadow', False):
+                if os.path.isdir(self._offline_dir(partition)):
+                    src_dir = self._offline_dir(partition)
+            jobs.append((idx, partition, src_dir))
+
+        def _build(job):
+            idx, partition, src_dir = job
+            path = partition['path']
+            layout = self.offline_layout[path]
+            size = layout['size']
+            label = partition.get('label')
+            if partition['filesystem'] == 'btrfs':
+                label = partition.get('btrfs', {}).get('label', label)
+
+            fs_image = os.path.join(self.working_directory, f"offline_fs{idx}.img")
+            try:
+                diskimage.create_image(fs_image, size)
+                for cmd in offline.mkfs_commands(partition['filesystem'], src_dir, fs_image,
+                                                 uuid=layout['fs_uuid'], label=label,
+                                                 mkfs_options=partition.get('mkfs_options')):
+                    retval = self.cmd.run_buffered(cmd, prefix=path)
+                    if retval != 0:
+                        raise InstallerError(f"Failed to build {partition['filesystem']} filesystem for {path}")
+                offline.copy_into(fs_image, layout['image'], layout['offset'], size)
+            except (OSError, diskimage.DiskImageError, offline.OfflineBuildError) as e:
+                raise InstallerError(f"Failed to build filesystem for {path}: {e}")
+            finally:
+                if os.path.exists(fs_image):
+                    os.remove(fs_image)
+            self.logger.info(f"built {partition['filesystem']} filesystem for {path} from {src_dir}")
+
+        self._run_parallel(_build, jobs)
+
+        for _, _, src_dir in jobs:
+            if os.path.isdir(src_dir):
+                shutil.rmtree(src_dir)
+
+    def _get_max_workers(self):
+        """
+        Number of threads for work that is done in parallel, the same as for
+        the phase scheduler
+        """
+        workers = self.install_config['scheduler'].get('workers', None)
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        return workers
+
+    def _run_parallel(self, func, items):
+        """
+        Call func for every item on a pool of threads. If any of them raises
+        an exception, no further items are started, and the exception is
+        raised once the running ones have finished.
+        """
+        if not items:
+            return
+
+        workers = min(self._get_max_workers(), len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(func, item) for item in items]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            wait(not_done)
+
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
 
     def _final_check(self):
         """
@@ -11,12 +11,15 @@ import os
 import platform
 import shutil
 import tempfile
+import time
 from argparse import ArgumentParser
 
+import cmdtrace
 import yaml
 from commandutils import CommandUtils
 from generate_initrd import IsoInitrd
 from logger import Logger
+from rpmfetch import RpmFetcher, fetch_transaction, read_repo_files
 from tdnf import Tdnf, create_repo_conf
 
 DEFAULT_INSTALL_OPTIONS_FILE = "build_install_options_custom.json"
@@ -184,6 +187,26 @@ class IsoBuilder(object):
         self.logger.info("Creating repodata for copied packages")
         self.createRepo()
 
+    def fetchPkgs(self, tdnf_args):
+        """
+        download the packages of the transaction in parallel, tdnf
+        downloads whatever is missing afterwards
+        """
+        repos = {repo_id: baseurl for repo_id, baseurl in read_repo_files(self.yum_repos_dir, self.photon_release_version, self.arch).items()
+                 if not baseurl.startswith("file://")}
+        if not repos:
+            return
+
+        _, solved = self.tdnf.run(["--assumeno"] + tdnf_args)
+        if not isinstance(solved, dict):
+            self.logger.warning("could not resolve the packages to download")
+            return
+
+        fetcher = RpmFetcher(self.logger, connections=self.parallel_downloads)
+        stats = fetch_transaction(fetcher, solved, repos,
+                                  lambda repo_id, package: os.path.join(self.rpms_path, os.path.basename(package.location)))
+        self.logger.info(f"downloaded {stats['files']} packages ({stats['bytes']} bytes) in parallel")
+
     def downloadPkgs(self):
         """
         downloads packages as set by packages list files,
@@ -219,17 +242,16 @@ class IsoBuilder(object):
         # skip downloading if repo already exists
         if not os.path.isdir(os.path.join(self.rpms_path, "repodata")):
             self.logger.info("downloading packages...")
-            retval = self.tdnf.run(
-                [
-                    "--nogpgcheck",  # work around for installing locally built packages, like photon-os-installer
-                    "--alldeps",
-                    "--downloadonly",
-                    "--downloaddir", self.rpms_path,
-                    "install",
-                ]
-                + self.pkg_list,
-                do_json=False
-            )
+            tdnf_args = [
+                "--nogpgcheck",  # work around for installing locally built packages, like photon-os-installer
+                "--alldeps",
+                "--downloadonly",
+                "--downloaddir", self.rpms_path,
+                "install",
+            ] + self.pkg_list
+            if self.parallel_downloads:
+                self.fetchPkgs(tdnf_args)
+            retval = self.tdnf.run(tdnf_args, do_json=False)
             if retval != 0:
                 raise Exception("tdnf failed")
             self.logger.info("...done.")
@@ -563,10 +585,27 @@ def main():
         help="the install options file for the installer",
         default=None
     )
+    parser.add_argument(
+        "--parallel-downloads",
+        dest="parallel_downloads",
+        type=int,
+        help="download packages with this many parallel connections before running tdnf",
+        default=0
+    )
+    parser.add_argument(
+        "--trace-file",
+        dest="trace_file",
+        type=str,
+        help="write a trace of all commands run in Chrome trace format to this file",
+        default=None
+    )
 
     # Parse the command-line arguments
     options = parser.parse_args()
 
+    if options.trace_file:
+        cmdtrace.enable(time.monotonic())
+
     # no commandd line equiv for these, but we need to initialize them:
     options.iso_files = {}
     options.initrd_files = {}
@@ -613,6 +652,7 @@ def main():
         iso_files=options.iso_files,
         initrd_files=options.initrd_files,
         install_options_file=options.install_options_file,
+        parallel_downloads=options.parallel_downloads,
     )
 
     isoBuilder.validate_options()
@@ -640,6 +680,9 @@ def main():
     # Clean Up Working Directory and temp config file
     isoBuilder.cmdUtil.remove_files([isoBuilder.working_dir, temp_file_path])
 
+    if options.trace_file:
+        cmdtrace.save(options.trace_file)
+
 
 if __name__ == "__main__":
     main()
@@ -14,6 +14,7 @@ import subprocess
 import time
 from argparse import ArgumentParser
 
+import readiness
 import requests
 from commandutils import CommandUtils
 from defaults import Defaults
@@ -213,8 +214,10 @@ class IsoInstaller(object):
         cmdline = ['mount']
         if photon_media.startswith("UUID="):
             cmdline.extend(['-U', photon_media[len("UUID="):]])
+            device = os.path.join("/dev/disk/by-uuid", photon_media[len("UUID="):])
         elif photon_media.startswith("LABEL="):
             cmdline.extend(['-L', photon_media[len("LABEL="):]])
+            device = os.path.join("/dev/disk/by-label", photon_media[len("LABEL="):])
         elif photon_media == "cdrom":
             # Check if cdrom is listed in block devices.
             if not Device.check_cdrom():
@@ -222,9 +225,11 @@ class IsoInstaller(object):
                                 "is not readable. Ensure that you select a medium connected to a SATA "
                                 "interface and try again.")
             cmdline.append('/dev/cdrom')
+            device = '/dev/cdrom'
         else:
             # User specified mount path
             cmdline.append(photon_media)
+            device = photon_media
 
         cmdline.extend(['-o', 'ro', mount_path])
 
@@ -234,9 +239,9 @@ class IsoInstaller(object):
             retval = process.wait()
             if retval == 0:
                 return mount_path
-            print("Failed to mount the device, retry in 5 seconds")
+            print("Failed to mount the device, retrying when the device changes (at most 5 seconds)")
             Device.refresh_devices()
-            time.sleep(5)
+            readiness.wait_for_device_change(device, timeout=5)
         print("Failed to mount the device, exiting the installer")
         print("check the logs for more details")
         raise Exception(f"Cannot mount the device {str(photon_media)}")
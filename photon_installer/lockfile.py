@@ -0,0 +1,86 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import json
+
+LOCKFILE_VERSION = 1
+
+
+class LockfileError(Exception):
+    pass
+
+
+def evr(pkg):
+    """
+    Return the epoch:version-release string of a lock entry, the way tdnf
+    prints it (no epoch if it is 0)
+    """
+    if int(pkg.get('epoch', 0) or 0) != 0:
+        return f"{pkg['epoch']}:{pkg['version']}-{pkg['release']}"
+    return f"{pkg['version']}-{pkg['release']}"
+
+
+def package_spec(pkg):
+    """
+    Return the tdnf package spec that installs exactly this lock entry. tdnf
+    specs have no arch, the arch is checked after the installation.
+    """
+    return f"{pkg['name']}={evr(pkg)}"
+
+
+def load(filename):
+    with open(filename, "rt") as f:
+        lock = json.load(f)
+
+    if not isinstance(lock, dict) or 'packages' not in lock:
+        raise LockfileError(f"'{filename}' is not a package lock file")
+    if lock.get('version', None) != LOCKFILE_VERSION:
+        raise LockfileError(f"unsupported lock file version {lock.get('version', None)} in '{filename}'")
+    for pkg in lock['packages']:
+        for key in ['name', 'version', 'release', 'arch']:
+            if key not in pkg:
+                raise LockfileError(f"package entry {pkg} in '{filename}' has no '{key}'")
+    return lock
+
+
+def save(filename, packages, releasever=None, arch=None, repos=None):
+    lock = {
+        'version': LOCKFILE_VERSION,
+        'releasever': releasever,
+        'arch': arch,
+        'repos': repos or {},
+        'packages': sorted(packages, key=lambda p: (p['name'], p['arch'])),
+    }
+    with open(filename, "wt") as f:
+        json.dump(lock, f, indent=4)
+        f.write("\n")
+    return lock
+
+
+def compare(expected, actual):
+    """
+    Compare the package lists of two locks. Returns a list of
+    (name, expected, actual) for packages that are missing, have a different
+    version, or the same version with a different checksum (a rebuilt
+    package), and a list of names of packages that are not locked.
+    """
+    actual_map = {(p['name'], p['arch']): p for p in actual}
+    expected_keys = set()
+    mismatches = []
+    for pkg in expected:
+        key = (pkg['name'], pkg['arch'])
+        expected_keys.add(key)
+        if key not in actual_map:
+            mismatches.append((pkg['name'], evr(pkg), None))
+        elif evr(actual_map[key]) != evr(pkg):
+            mismatches.append((pkg['name'], evr(pkg), evr(actual_map[key])))
+        else:
+            expected_checksum = (pkg.get('checksum', None) or {}).get('value', None)
+            actual_checksum = (actual_map[key].get('checksum', None) or {}).get('value', None)
+            if expected_checksum and actual_checksum and expected_checksum != actual_checksum:
+                mismatches.append((pkg['name'], f"{evr(pkg)} ({expected_checksum})", f"{evr(pkg)} ({actual_checksum})"))
+
+    extra = sorted(name for name, arch in actual_map if (name, arch) not in expected_keys)
+    return mismatches, extra
@@ -4,11 +4,121 @@
 #  */
 #
 
+import atexit
+import contextvars
+import datetime
+import gzip
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
+from contextlib import contextmanager
+
+LOG_FORMATS = ["text", "json"]
+
+# id of the command whose output is being logged, set by Logger.command()
+current_command = contextvars.ContextVar("current_command", default=None)
+
+# 'extra' argument for logging a line of command output
+OUTPUT = {'stream': "output"}
+
+
+class ContextFilter(logging.Filter):
+    """
+    Tags records with the installer phase, the command and the stream they
+    belong to. Runs in the thread that logs, before the record is queued.
+    """
+
+    phase_fn = None
+
+    def filter(self, record):
+        if not hasattr(record, 'phase'):
+            record.phase = ContextFilter.phase_fn() if ContextFilter.phase_fn is not None else None
+        if not hasattr(record, 'command'):
+            record.command = current_command.get()
+        if not hasattr(record, 'stream'):
+            record.stream = "installer"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per record
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname.lower(),
+            'message': record.getMessage(),
+            'phase': getattr(record, 'phase', None),
+            'command': getattr(record, 'command', None),
+            'stream': getattr(record, 'stream', None),
+            'thread': record.threadName,
+        }
+        return json.dumps(entry)
+
+
+class CommandLogHandler(logging.Handler):
+    """
+    Writes the output of each command to its own file in 'log_dir', and
+    compresses the file when the command finished
+    """
+
+    def __init__(self, log_dir):
+        super().__init__()
+        self.log_dir = log_dir
+        self.files = {}
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _path(self, cmd_id):
+        return os.path.join(self.log_dir, f"{cmd_id}.log")
+
+    def emit(self, record):
+        cmd_id = getattr(record, 'command_end', None)
+        if cmd_id is not None:
+            self._finish(cmd_id)
+            return
+
+        cmd_id = getattr(record, 'command', None)
+        if cmd_id is None:
+            return
+        try:
+            if cmd_id not in self.files:
+                self.files[cmd_id] = open(self._path(cmd_id), "at")
+            self.files[cmd_id].write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def _finish(self, cmd_id):
+        f = self.files.pop(cmd_id, None)
+        if f is None:
+            return
+        f.close()
+        path = self._path(cmd_id)
+        with open(path, "rb") as fin, gzip.open(path + ".gz", "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+        os.remove(path)
+
+    def close(self):
+        for cmd_id in list(self.files):
+            self._finish(cmd_id)
+        super().close()
+
+
+def _not_command_end(record):
+    return not hasattr(record, 'command_end')
 
 
 class Logger(object):
+    # writes the queued records, see get_logger()
+    listener = None
+    queue = None
+    command_ids = itertools.count(1)
+
     @staticmethod
     def string_to_loglevel(loglevel):
         logLevelMap = {
@@ -20,9 +130,20 @@ class Logger(object):
         return logLevelMap.get(loglevel, logging.INFO)
 
     @staticmethod
-    def get_logger(logpath=None, loglevel="debug", console=False):
+    def get_logger(logpath=None, loglevel="debug", console=False, log_format="text", command_logs=False):
+        """
+        Log records are put on a queue and written to the log file (and the
+        console) by a separate thread, so the loops reading the output of
+        commands do not wait for disk or console writes. With 'log_format'
+        "json" the log file has one json object per line. With
+        'command_logs' the output of each command is also written to its
+        own compressed file in the 'commands' directory next to the log
+        file.
+        """
         logger = logging.getLogger("installer")
         if not logger.handlers:
+            handlers = []
+
             # file handler
             logfile = "installer.log"
             if logpath is not None:
@@ -30,10 +151,13 @@ class Logger(object):
                     os.makedirs(logpath)
                 logfile = logpath + "/" + logfile
             fhandler = logging.FileHandler(logfile)
-            fhformatter = logging.Formatter('%(asctime)s - %(message)s')
+            if log_format == "json":
+                fhformatter = JsonFormatter()
+            else:
+                fhformatter = logging.Formatter('%(asctime)s - %(message)s')
             fhandler.setFormatter(fhformatter)
             # fhandler.setLevel(logging.DEBUG)
-            logger.addHandler(fhandler)
+            handlers.append(fhandler)
 
             # console handler
             if console:
@@ -44,10 +168,67 @@ class Logger(object):
                     chformatter = logging.Formatter('%(message)s')
                 ch.setFormatter(chformatter)
                 # ch.setLevel(Logger.string_to_loglevel(loglevel))
-                logger.addHandler(ch)
+                handlers.append(ch)
+
+            for handler in handlers:
+                handler.addFilter(_not_command_end)
+
+            if command_logs:
+                cmd_handler = CommandLogHandler(os.path.join(os.path.dirname(os.path.abspath(logfile)), "commands"))
+                cmd_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+                handlers.append(cmd_handler)
+
+            Logger.queue = queue.SimpleQueue()
+            qhandler = logging.handlers.QueueHandler(Logger.queue)
+            qhandler.addFilter(ContextFilter())
+            logger.addHandler(qhandler)
+            Logger.listener = logging.handlers.QueueListener(Logger.queue, *handlers, respect_handler_level=True)
+            Logger.listener.start()
+            atexit.register(Logger.shutdown)
 
             logger.setLevel(Logger.string_to_loglevel(loglevel))
             logger.debug("-" * 75)
             logger.debug("Starting Log")
             logger.debug("-" * 75)
         return logger
+
+    @staticmethod
+    def shutdown():
+        """
+        Write all queued records and close the log files
+        """
+        listener = Logger.listener
+        if listener is None:
+            return
+        Logger.listener = None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    @staticmethod
+    def set_phase_fn(phase_fn):
+        """
+        'phase_fn' returns the name of the installer phase of the calling
+        thread, records are tagged with it
+        """
+        ContextFilter.phase_fn = phase_fn
+
+    @staticmethod
+    @contextmanager
+    def command():
+        """
+        Tag the records logged in the block with a new command id, so the
+        output of the command can be told apart from other output. When the
+        block ends, the command's own log file is compressed.
+        """
+        cmd_id = f"cmd-{next(Logger.command_ids):05d}"
+        token = current_command.set(cmd_id)
+        try:
+            yield cmd_id
+        finally:
+            current_command.reset(token)
+            if Logger.queue is not None:
+                # bypasses the logger's level, so the file is always
+                # finished, and passes the level of all handlers
+                Logger.queue.put_nowait(logging.makeLogRecord(
+                    {'msg': "", 'levelno': logging.CRITICAL, 'levelname': "CRITICAL", 'command_end': cmd_id}))
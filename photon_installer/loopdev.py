@@ -0,0 +1,219 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Loop devices for disk images, using the loop ioctls directly.
+
+Images are attached with partition scanning enabled, so the kernel creates
+/dev/loopXpY for the partitions itself, and no device mapper (kpartx) is
+needed.
+"""
+
+import errno
+import fcntl
+import glob
+import os
+import stat
+import struct
+import subprocess
+import threading
+
+import readiness
+
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_SET_BLOCK_SIZE = 0x4C09
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+
+LO_FLAGS_PARTSCAN = 8
+LO_NAME_SIZE = 64
+
+# struct loop_info64
+LOOP_INFO64 = "QQQQQIIII64s64s32sQQ"
+
+
+class LoopDeviceError(Exception):
+    pass
+
+
+def _loop_info64(filename, flags):
+    return struct.pack(LOOP_INFO64, 0, 0, 0, 0, 0, 0, 0, 0, flags,
+                       os.fsencode(filename)[:LO_NAME_SIZE - 1], b"", b"", 0, 0)
+
+
+def _loop_config(fd, block_size, filename, flags):
+    # struct loop_config: fd, block_size, loop_info64, 8 reserved u64
+    return struct.pack("II", fd, block_size) + _loop_info64(filename, flags) + bytes(8 * 8)
+
+
+def _sysfs_dir(device):
+    return os.path.join("/sys/class/block", os.path.basename(os.path.realpath(device)))
+
+
+def has_partscan(device):
+    """
+    Check if the kernel scans partitions of the loop device
+    """
+    try:
+        with open(os.path.join(_sysfs_dir(device), "loop/partscan"), "rt") as f:
+            return f.read().strip() == "1"
+    except OSError:
+        return False
+
+
+def partition_path(device, part_idx):
+    return f"{device}p{part_idx}"
+
+
+def _dev_is_devtmpfs():
+    with open("/proc/mounts", "rt") as f:
+        for line in f:
+            fields = line.split()
+            if fields[1] == "/dev":
+                return fields[2] == "devtmpfs"
+    return False
+
+
+def ensure_partition_nodes(device, timeout=10):
+    """
+    Make sure the device nodes of all partitions the kernel knows of exist.
+    devtmpfs creates them, but where /dev is a plain tmpfs (as in
+    containers) they never appear, so they are created from the major:minor
+    numbers in sysfs. Returns the number of partitions.
+    """
+    sysfs_dir = _sysfs_dir(device)
+    name = os.path.basename(sysfs_dir)
+    if not _dev_is_devtmpfs():
+        timeout = 0
+    part_dirs = sorted(glob.glob(os.path.join(sysfs_dir, f"{name}p*")))
+    for part_dir in part_dirs:
+        node = os.path.join(os.path.dirname(device), os.path.basename(part_dir))
+        with open(os.path.join(part_dir, "dev"), "rt") as f:
+            major, minor = [int(n) for n in f.read().strip().split(":")]
+        rdev = os.makedev(major, minor)
+
+        if readiness.wait_for_block_device(node, timeout=timeout):
+            # partition minors are allocated dynamically, a node we created
+            # for an earlier device may point to a different partition
+            if os.stat(node).st_rdev == rdev:
+                continue
+            os.remove(node)
+        os.mknod(node, 0o660 | stat.S_IFBLK, rdev)
+    return len(part_dirs)
+
+
+def _attach_ioctl(filename, sector_size, flags, read_only):
+    with open("/dev/loop-control", "rb") as ctl:
+        # another process may take the free device before we configure it
+        for _ in range(16):
+            number = fcntl.ioctl(ctl, LOOP_CTL_GET_FREE)
+            device = f"/dev/loop{number}"
+            if not readiness.wait_for_block_device(device, timeout=5):
+                raise LoopDeviceError(f"loop device {device} did not appear")
+
+            mode = os.O_RDONLY if read_only else os.O_RDWR
+            file_fd = os.open(filename, mode | os.O_CLOEXEC)
+            try:
+                loop_fd = os.open(device, mode | os.O_CLOEXEC)
+                try:
+                    try:
+                        fcntl.ioctl(loop_fd, LOOP_CONFIGURE, _loop_config(file_fd, sector_size, filename, flags))
+                    except OSError as e:
+                        if e.errno not in [errno.EINVAL, errno.ENOTTY]:
+                            raise
+                        # kernels before 5.8 have no LOOP_CONFIGURE
+                        fcntl.ioctl(loop_fd, LOOP_SET_FD, file_fd)
+                        fcntl.ioctl(loop_fd, LOOP_SET_STATUS64, _loop_info64(filename, flags))
+                        if sector_size != 512:
+                            fcntl.ioctl(loop_fd, LOOP_SET_BLOCK_SIZE, sector_size)
+                    return device
+                except OSError as e:
+                    if e.errno == errno.EBUSY:
+                        continue
+                    raise
+                finally:
+                    os.close(loop_fd)
+            finally:
+                os.close(file_fd)
+    raise LoopDeviceError(f"no free loop device for '{filename}'")
+
+
+def attach(filename, sector_size=512, partscan=True, read_only=False, logger=None):
+    """
+    Attach 'filename' to a free loop device, and return the device path.
+    Uses the loop ioctls, or losetup if they cannot be used.
+    """
+    flags = LO_FLAGS_PARTSCAN if partscan else 0
+    try:
+        device = _attach_ioctl(filename, sector_size, flags, read_only)
+    except (OSError, LoopDeviceError) as e:
+        if logger is not None:
+            logger.info(f"attaching '{filename}' with ioctls failed ({e}), using losetup")
+        cmd = ["losetup", "--show", "-f", "--sector-size", str(sector_size)]
+        if partscan:
+            cmd.append("-P")
+        if read_only:
+            cmd.append("-r")
+        try:
+            device = subprocess.check_output(cmd + [filename], text=True).strip()
+        except subprocess.CalledProcessError as e:
+            raise LoopDeviceError(f"failed to attach '{filename}': {e}")
+
+    if logger is not None:
+        logger.info(f"attached '{filename}' to {device}")
+    return device
+
+
+def detach(device, logger=None):
+    try:
+        with open(device, "rb") as f:
+            fcntl.ioctl(f, LOOP_CLR_FD)
+    except OSError as e:
+        if logger is not None:
+            logger.info(f"detaching {device} with ioctl failed ({e}), using losetup")
+        try:
+            subprocess.check_call(["losetup", "-d", device])
+        except subprocess.CalledProcessError as e:
+            raise LoopDeviceError(f"failed to detach {device}: {e}")
+
+
+class LoopRegistry(object):
+    """
+    Loop devices attached by the installer, so they can be detached again in
+    reverse order when the installation finishes or fails
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.devices = []
+        self.lock = threading.Lock()
+
+    def attach(self, filename, sector_size=512, partscan=True):
+        device = attach(filename, sector_size=sector_size, partscan=partscan, logger=self.logger)
+        with self.lock:
+            self.devices.append(device)
+        return device
+
+    def detach(self, device):
+        with self.lock:
+            if device not in self.devices:
+                return
+            self.devices.remove(device)
+        detach(device, logger=self.logger)
+
+    def detach_all(self):
+        """
+        Detach all devices, logs errors instead of raising, so all of them
+        are tried
+        """
+        with self.lock:
+            devices = list(reversed(self.devices))
+        for device in devices:
+            try:
+                self.detach(device)
+            except LoopDeviceError as e:
+                self.logger.error(str(e))
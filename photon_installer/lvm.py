@@ -0,0 +1,130 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import json
+import shlex
+import subprocess
+
+
+class LvmError(Exception):
+    pass
+
+
+class LvmState(object):
+    """
+    Snapshot of the LVM physical volumes, volume groups and logical volumes
+    """
+
+    def __init__(self, report=None):
+        # pv name -> vg name ('' for orphan pvs)
+        self.pvs = {}
+        # vg name -> set of lv names
+        self.vgs = {}
+
+        for entry in (report or {}).get('report', []):
+            vg_name = ''
+            for vg in entry.get('vg', []):
+                vg_name = vg['vg_name']
+                self.vgs.setdefault(vg_name, set())
+            for pv in entry.get('pv', []):
+                self.pvs[pv['pv_name']] = pv.get('vg_name', vg_name)
+            for lv in entry.get('lv', []):
+                self.vgs.setdefault(vg_name, set()).add(lv['lv_name'])
+
+    def has_lv(self, vg_name, lv_name):
+        return lv_name in self.vgs.get(vg_name, set())
+
+
+class Lvm(object):
+    """
+    Runs LVM commands. State is read with a single 'lvm fullreport' instead
+    of separate pvs/vgs/lvs calls, and multiple commands are run in one lvm
+    shell process.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def report(self):
+        """
+        Read the current state of all PVs, VGs and LVs
+        """
+        cmd = ["lvm", "fullreport", "--reportformat", "json"]
+        self.logger.info(f"running {cmd}")
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            # no LVM on the host, or no permission
+            self.logger.warning(f"{cmd} failed: {process.stderr.strip()}")
+            return LvmState()
+        try:
+            return LvmState(json.loads(process.stdout))
+        except (ValueError, KeyError) as e:
+            self.logger.warning(f"cannot parse output of {cmd}: {e}")
+            return LvmState()
+
+    def run(self, command):
+        """
+        Run a single lvm command (a list like ['vgcreate', vg, pv])
+        """
+        cmd = ["lvm"] + command
+        self.logger.info(f"running {cmd}")
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for line in process.stdout.splitlines():
+            self.logger.info(f"[lvm] {line}")
+        if process.returncode != 0:
+            raise LvmError(f"command {cmd} failed with {process.returncode}")
+
+    def run_batch(self, commands):
+        """
+        Run multiple lvm commands in one lvm shell process. The shell does not
+        report which commands failed, so callers need to check the result with
+        report().
+        """
+        script = "".join(shlex.join(c) + "\n" for c in commands) + "exit\n"
+        self.logger.info(f"running lvm shell with:\n{script}")
+        process = subprocess.run(["lvm"], input=script, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for line in process.stdout.splitlines():
+            self.logger.info(f"[lvm] {line}")
+        return process.returncode
+
+    def create_vg(self, vg_name, pv, lvs):
+        """
+        Create the volume group 'vg_name' on 'pv' with the logical volumes
+        'lvs', a list of (name, size in MB). Size 0 means all remaining space,
+        and must be the last one.
+
+        All commands are run in one lvm shell. If the result does not have
+        all PVs, VGs and LVs, the missing ones are created with single
+        commands, which also gives proper error messages.
+        """
+        state = self.report()
+        if vg_name in state.vgs:
+            # left over from a previous installation, pvcreate fails otherwise
+            self.logger.info(f"removing existing volume group {vg_name}")
+            try:
+                self.run(["vgremove", "-f", vg_name])
+            except LvmError as e:
+                self.logger.error(f"Error: Failed to remove existing vg before installation {vg_name}: {e}")
+
+        steps = [
+            (lambda s: pv in s.pvs or vg_name in s.vgs, ["pvcreate", "-ff", "-y", pv]),
+            (lambda s: vg_name in s.vgs, ["vgcreate", vg_name, pv]),
+        ]
+        for lv_name, size in lvs:
+            if size == 0:
+                size_args = ["-l", "100%FREE"]
+            else:
+                size_args = ["-L", f"{size}M"]
+            steps.append((lambda s, lv_name=lv_name: s.has_lv(vg_name, lv_name),
+                          ["lvcreate", "-y", "--zero", "n"] + size_args + ["-n", lv_name, vg_name]))
+
+        self.run_batch([command for _, command in steps])
+
+        state = self.report()
+        missing = [command for done, command in steps if not done(state)]
+        if missing:
+            self.logger.info(f"lvm shell did not complete, running {len(missing)} commands separately")
+            for command in missing:
+                self.run(command)
@@ -3,6 +3,7 @@
 #  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
 #  */
 
+import os
 import sys
 import traceback
 from argparse import ArgumentParser
@@ -25,6 +26,7 @@ def main():
     parser.add_argument("-t", "--license-title", dest="license_display_title", default=None)
     parser.add_argument("-v", "--photon-release-version", dest="photon_release_version", required=True)
     parser.add_argument("-p", "--param", dest='params', action='append', default=[])
+    parser.add_argument("-L", "--lockfile", dest="lockfile", default=None)
 
     options = parser.parse_args()
 
@@ -45,10 +47,16 @@ def main():
                     install_config = CommandUtils.readConfig(f, params=params)
             else:
                 raise Exception('install config file not provided')
+            if options.lockfile is not None:
+                install_config['lockfile'] = options.lockfile
             if options.repo_paths is None and "repos" not in install_config:
                 raise Exception('No repo available! Specify repo via "--repo-paths" or "repos" in install_config')
             if not options.working_directory:
                 raise Exception('Please provide "--working-directory"')
+            if install_config.get('build_mode') == "offline" and os.geteuid() != 0:
+                # continue as root in a user namespace
+                from offline import reexec_in_user_namespace
+                reexec_in_user_namespace()
 
             installer = Installer(
                 working_directory=options.working_directory,
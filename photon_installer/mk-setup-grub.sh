@@ -21,8 +21,9 @@ USER_CFG_FN="$5"
 POI_CMDLINE=$6
 
 # Install grub2.
-PARTUUID="$(blkid -s PARTUUID -o value "${ROOT_PARTITION_PATH}")"
-BOOT_UUID="$(blkid -s UUID -o value "${BOOT_PARTITION_PATH}")"
+# The installer passes the ids it already knows, ask blkid if not set or empty.
+PARTUUID="${POI_ROOT_PARTUUID:-$(blkid -s PARTUUID -o value "${ROOT_PARTITION_PATH}")}"
+BOOT_UUID="${POI_BOOT_UUID:-$(blkid -s UUID -o value "${BOOT_PARTITION_PATH}")}"
 
 # linux-esx tries to mount rootfs even before nvme got initialized.
 # rootwait fixes this issue
@@ -0,0 +1,172 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Helpers for the offline build mode. Filesystems are not created on loop
+devices and mounted, but built from directory trees with the mkfs options
+that populate a new filesystem from a directory, and then copied into the
+disk image at the partition offsets.
+"""
+
+import errno
+import os
+import shutil
+import struct
+import sys
+
+# filesystems that can be built from a directory
+FILESYSTEMS = ["ext2", "ext3", "ext4", "btrfs", "vfat", "swap", "squashfs", "erofs"]
+
+USERNS_ENV = "POI_USERNS"
+
+COPY_CHUNK = 4 * 1024 * 1024
+
+
+class OfflineBuildError(Exception):
+    pass
+
+
+def reexec_in_user_namespace():
+    """
+    Run the installer again in a new user and mount namespace, where it is
+    root and can bind mount directories. Additional user and group ids are
+    mapped from /etc/subuid and /etc/subgid, so files can be owned by other
+    users. Does not return.
+    """
+    if os.environ.get(USERNS_ENV):
+        raise OfflineBuildError("already running in a user namespace, but not as root")
+    if shutil.which("unshare") is None:
+        raise OfflineBuildError("'unshare' is needed to build without root privileges")
+
+    env = dict(os.environ)
+    env[USERNS_ENV] = "1"
+    cmd = ["unshare", "--user", "--map-root-user", "--map-auto", "--mount", "--propagation", "private",
+           "--", sys.executable] + sys.argv
+    os.execvpe(cmd[0], cmd, env)
+
+
+def vfat_volume_id():
+    """
+    A random vfat volume id, as the argument for 'mkfs.vfat -i' and as
+    blkid reports it as UUID
+    """
+    volume_id = struct.unpack("<I", os.urandom(4))[0]
+    return f"{volume_id:08X}", f"{volume_id >> 16:04X}-{volume_id & 0xFFFF:04X}"
+
+
+def mkfs_commands(fstype, src_dir, filename, uuid=None, label=None, mkfs_options=None):
+    """
+    Commands that create a filesystem of type 'fstype' in 'filename' with
+    the contents of 'src_dir'. For vfat 'uuid' is the volume id.
+    """
+    options = []
+    if mkfs_options:
+        options = ["-O", ",".join(mkfs_options)]
+
+    if fstype in ["ext2", "ext3", "ext4"]:
+        cmd = ["mkfs", "-t", fstype, "-F", "-d", src_dir] + options
+        if uuid is not None:
+            cmd.extend(["-U", uuid])
+        if label is not None:
+            cmd.extend(["-L", label])
+        return [cmd + [filename]]
+
+    if fstype == "btrfs":
+        cmd = ["mkfs.btrfs", "-f", "--rootdir", src_dir] + options
+        if uuid is not None:
+            cmd.extend(["-U", uuid])
+        if label is not None:
+            cmd.extend(["-L", label])
+        return [cmd + [filename]]
+
+    if fstype == "vfat":
+        cmd = ["mkfs.vfat"]
+        if uuid is not None:
+            cmd.extend(["-i", uuid])
+        if label is not None:
+            cmd.extend(["-n", label])
+        commands = [cmd + [filename]]
+        entries = sorted(os.listdir(src_dir))
+        if entries:
+            # -s recursive, -p keep attributes, -m keep times, -Q stop on error
+            commands.append(["mcopy", "-i", filename, "-s", "-p", "-m", "-Q"]
+                            + [os.path.join(src_dir, e) for e in entries] + ["::/"])
+        return commands
+
+    if fstype == "swap":
+        cmd = ["mkswap"]
+        if uuid is not None:
+            cmd.extend(["-U", uuid])
+        if label is not None:
+            cmd.extend(["-L", label])
+        return [cmd + [filename]]
+
+    if fstype == "squashfs":
+        return [["mksquashfs", src_dir, filename, "-noappend", "-comp", "gzip"]]
+
+    if fstype == "erofs":
+        cmd = ["mkfs.erofs"]
+        if uuid is not None:
+            cmd.extend(["-U", uuid])
+        if label is not None:
+            cmd.extend(["-L", label])
+        return [cmd + [filename, src_dir]]
+
+    raise OfflineBuildError(f"filesystem '{fstype}' cannot be built offline")
+
+
+def _data_ranges(fd, size):
+    """
+    Ranges of a file that contain data, skipping holes
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # only holes after offset
+                return
+            if e.errno != errno.EINVAL:
+                raise
+            # no SEEK_DATA support, copy everything
+            yield offset, size
+            return
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, min(end, size)
+        offset = end
+
+
+def copy_into(src, dst, offset, max_size):
+    """
+    Copy the file 'src' into the file 'dst' at 'offset', keeping holes.
+    The disk image 'dst' is sparse, so holes do not need to be written.
+    """
+    size = os.path.getsize(src)
+    if size > max_size:
+        raise OfflineBuildError(f"'{src}' ({size} bytes) does not fit into the partition ({max_size} bytes)")
+
+    src_fd = os.open(src, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CLOEXEC)
+        try:
+            for start, end in _data_ranges(src_fd, size):
+                pos = start
+                while pos < end:
+                    count = min(COPY_CHUNK, end - pos)
+                    try:
+                        copied = os.copy_file_range(src_fd, dst_fd, count, pos, offset + pos)
+                    except OSError as e:
+                        if e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL]:
+                            raise
+                        copied = os.pwrite(dst_fd, os.pread(src_fd, count, pos), offset + pos)
+                    if copied == 0:
+                        raise OfflineBuildError(f"short copy from '{src}' to '{dst}'")
+                    pos += copied
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
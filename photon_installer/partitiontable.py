@@ -0,0 +1,328 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Writes GPT and MBR partition tables directly, instead of running sgdisk
+several times per disk. The layout is the same as with sgdisk: partitions
+are aligned to 1 MiB, placed in the order of their numbers, and the
+extensible partition (size 0) is placed last and takes the remaining space.
+"""
+
+import fcntl
+import os
+import string
+import struct
+import uuid
+import zlib
+
+BLKRRPART = 0x125F
+BLKSSZGET = 0x1268
+
+ALIGNMENT = 1024 * 1024
+
+GPT_SIGNATURE = b"EFI PART"
+GPT_REVISION = 0x00010000
+GPT_HEADER_FORMAT = "<8sIIIIQQQQ16sQIII"
+GPT_ENTRY_FORMAT = "<16s16sQQQ72s"
+GPT_NUM_ENTRIES = 128
+GPT_ENTRY_SIZE = 128
+
+# type codes as used by sgdisk (see 'sgdisk -L'), the MBR type is the
+# upper byte of the code
+TYPE_GUIDS = {
+    '0700': "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7",
+    '8200': "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F",
+    '8300': "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+    '8302': "933AC7E1-2EB4-4F13-B844-0E14E2AEF915",
+    '8304': "4F68BCE3-E8CD-4DB1-96E7-FBCAF984B709",
+    '8305': "B921B045-1DF0-41C3-AF44-4C6F280D3FAE",
+    '8306': "3B8F8425-20E0-4F3B-907F-1A25A76F98E8",
+    '8310': "4D21B016-B534-45C2-A9FB-5C16E091FD2D",
+    '8311': "7EC6F557-3BC5-4ACA-B293-16EF5DF639D1",
+    '8314': "8484680C-9521-48C6-9C11-B0720656F69E",
+    '8316': "B0E01050-EE5F-4390-949A-9101B17104E9",
+    '8e00': "E6D6D379-F507-44C2-A23C-238F2A3DF928",
+    'ef00': "C12A7328-F81F-11D2-BA4B-00A0C93EC93B",
+    'ef02': "21686148-6449-6E6F-744E-656564454649",
+    'fd00': "A19D880F-05FC-4D3B-A006-743F0F84911E",
+}
+
+
+class PartitionTableError(Exception):
+    pass
+
+
+class Partition(object):
+    """
+    A partition to be created. 'size' is in MB, 0 for the extensible
+    partition. 'type_code' is an sgdisk type code or a GUID. 'uuid' is the
+    PARTUUID as blkid reports it once the table is written.
+    """
+
+    def __init__(self, number, size, type_code, name=None):
+        self.number = number
+        self.size = size
+        self.type_code = type_code
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.first_lba = None
+        self.last_lba = None
+
+    def type_guid(self):
+        return type_guid(self.type_code)
+
+
+def type_guid(type_code):
+    """
+    GUID for an sgdisk type code, or None if it is unknown
+    """
+    if type_code.lower() in TYPE_GUIDS:
+        return TYPE_GUIDS[type_code.lower()]
+    try:
+        return str(uuid.UUID(type_code)).upper()
+    except ValueError:
+        return None
+
+
+def is_supported(type_code, table_type="gpt"):
+    """
+    Check if a partition of this type can be written. An MBR takes any
+    sgdisk type code, a GPT needs to know its GUID.
+    """
+    if table_type == "msdos":
+        return len(type_code) == 4 and all(c in string.hexdigits for c in type_code)
+    return type_guid(type_code) is not None
+
+
+def _entries_sectors(sector_size):
+    return GPT_NUM_ENTRIES * GPT_ENTRY_SIZE // sector_size
+
+
+def usable_range(disk_size, sector_size):
+    """
+    First and last LBA that can be used for partitions with a GPT
+    """
+    last_lba = disk_size // sector_size - 1
+    entries_sectors = _entries_sectors(sector_size)
+    return 2 + entries_sectors, last_lba - 1 - entries_sectors
+
+
+def layout(partitions, disk_size, sector_size=512):
+    """
+    Set first_lba and last_lba of all partitions
+    """
+    align = ALIGNMENT // sector_size
+    first_usable, last_usable = usable_range(disk_size, sector_size)
+
+    def _align(lba):
+        return (lba + align - 1) // align * align
+
+    extensible = [p for p in partitions if p.size == 0]
+    if len(extensible) > 1:
+        raise PartitionTableError("only one extensible partition is allowed per disk")
+
+    next_lba = first_usable
+    for p in sorted(partitions, key=lambda p: p.number):
+        if p.size == 0:
+            continue
+        p.first_lba = _align(next_lba)
+        p.last_lba = p.first_lba + p.size * ALIGNMENT // sector_size - 1
+        next_lba = p.last_lba + 1
+
+    for p in extensible:
+        p.first_lba = _align(next_lba)
+        p.last_lba = last_usable
+
+    for p in partitions:
+        if p.last_lba > last_usable or p.first_lba > p.last_lba:
+            raise PartitionTableError(f"partition {p.number} does not fit on the disk")
+    return partitions
+
+
+def _protective_mbr(disk_size, sector_size):
+    sectors = min(disk_size // sector_size - 1, 0xFFFFFFFF)
+    entry = struct.pack("<B3sB3sII", 0, b"\x00\x02\x00", 0xEE, b"\xff\xff\xff", 1, sectors)
+    return _mbr([entry])
+
+
+def _mbr(entries, disk_signature=None):
+    mbr = bytearray(512)
+    if disk_signature is None:
+        disk_signature = struct.unpack("<I", os.urandom(4))[0]
+    mbr[440:444] = struct.pack("<I", disk_signature)
+    for i, entry in enumerate(entries):
+        mbr[446 + 16 * i:446 + 16 * (i + 1)] = entry
+    mbr[510:512] = b"\x55\xaa"
+    return bytes(mbr)
+
+
+def _gpt_entries(partitions):
+    entries = bytearray(GPT_NUM_ENTRIES * GPT_ENTRY_SIZE)
+    for p in partitions:
+        name = (p.name or "").encode("utf-16-le")[:72]
+        entry = struct.pack(GPT_ENTRY_FORMAT,
+                            uuid.UUID(p.type_guid()).bytes_le,
+                            uuid.UUID(p.uuid).bytes_le,
+                            p.first_lba, p.last_lba, 0, name)
+        offset = (p.number - 1) * GPT_ENTRY_SIZE
+        entries[offset:offset + GPT_ENTRY_SIZE] = entry
+    return bytes(entries)
+
+
+def _gpt_header(current_lba, backup_lba, first_usable, last_usable, disk_guid, entries_lba, entries_crc, sector_size):
+    def _pack(crc):
+        return struct.pack(GPT_HEADER_FORMAT, GPT_SIGNATURE, GPT_REVISION, 92, crc, 0,
+                           current_lba, backup_lba, first_usable, last_usable, disk_guid,
+                           entries_lba, GPT_NUM_ENTRIES, GPT_ENTRY_SIZE, entries_crc)
+
+    header = _pack(zlib.crc32(_pack(0)))
+    return header + bytes(sector_size - len(header))
+
+
+def gpt_image(partitions, disk_size, sector_size=512):
+    """
+    Return a list of (offset, data) to write for a GPT with 'partitions',
+    which need to have their geometry set (see layout())
+    """
+    for p in partitions:
+        if p.number < 1 or p.number > GPT_NUM_ENTRIES:
+            raise PartitionTableError(f"invalid partition number {p.number}")
+        if p.type_guid() is None:
+            raise PartitionTableError(f"unknown partition type '{p.type_code}'")
+
+    last_lba = disk_size // sector_size - 1
+    entries_sectors = _entries_sectors(sector_size)
+    first_usable, last_usable = usable_range(disk_size, sector_size)
+    disk_guid = uuid.uuid4().bytes_le
+
+    entries = _gpt_entries(partitions)
+    entries_crc = zlib.crc32(entries)
+    backup_entries_lba = last_lba - entries_sectors
+
+    primary = _gpt_header(1, last_lba, first_usable, last_usable, disk_guid, 2, entries_crc, sector_size)
+    backup = _gpt_header(last_lba, 1, first_usable, last_usable, disk_guid, backup_entries_lba, entries_crc, sector_size)
+
+    mbr = _protective_mbr(disk_size, sector_size)
+    return [
+        (0, mbr + bytes(sector_size - len(mbr))),
+        (sector_size, primary),
+        (2 * sector_size, entries),
+        (backup_entries_lba * sector_size, entries),
+        (last_lba * sector_size, backup),
+    ]
+
+
+def mbr_image(partitions, disk_size, sector_size=512):
+    """
+    Return a list of (offset, data) to write for an MBR (msdos) partition
+    table with 'partitions', which need to have their geometry set. Any GPT
+    is wiped, like 'sgdisk -m' does.
+    """
+    if len(partitions) > 4:
+        raise PartitionTableError("an MBR can have at most 4 partitions")
+
+    # the PARTUUIDs of MBR partitions are made of the disk signature and
+    # the partition number
+    disk_signature = struct.unpack("<I", os.urandom(4))[0]
+    entries = []
+    for p in sorted(partitions, key=lambda p: p.number):
+        p.uuid = f"{disk_signature:08x}-{p.number:02x}"
+        try:
+            mbr_type = int(p.type_code, 16) >> 8
+        except ValueError:
+            raise PartitionTableError(f"partition type '{p.type_code}' cannot be used in an MBR")
+        if p.last_lba > 0xFFFFFFFF:
+            raise PartitionTableError(f"partition {p.number} is too large for an MBR")
+        # CHS values are not used, mark them as too large like sgdisk
+        entries.append(struct.pack("<B3sB3sII", 0, b"\xfe\xff\xff", mbr_type, b"\xfe\xff\xff",
+                                   p.first_lba, p.last_lba - p.first_lba + 1))
+
+    last_lba = disk_size // sector_size - 1
+    entries_sectors = _entries_sectors(sector_size)
+    mbr = _mbr(entries, disk_signature)
+    return [
+        (0, mbr + bytes(sector_size - len(mbr))),
+        (sector_size, bytes((1 + entries_sectors) * sector_size)),
+        ((last_lba - entries_sectors) * sector_size, bytes((1 + entries_sectors) * sector_size)),
+    ]
+
+
+def _get_geometry(fd, sector_size):
+    disk_size = os.lseek(fd, 0, os.SEEK_END)
+    if sector_size is None:
+        try:
+            buf = fcntl.ioctl(fd, BLKSSZGET, struct.pack("i", 0))
+            sector_size = struct.unpack("i", buf)[0]
+        except OSError:
+            # a regular file
+            sector_size = 512
+    return disk_size, sector_size
+
+
+def reread(fd):
+    """
+    Tell the kernel to re-read the partition table. Returns False if it
+    cannot (regular files, devices without partition support, or partitions
+    in use).
+    """
+    try:
+        fcntl.ioctl(fd, BLKRRPART)
+    except OSError:
+        return False
+    return True
+
+
+def _write(device, writes):
+    fd = os.open(device, os.O_RDWR | os.O_CLOEXEC)
+    try:
+        for offset, data in writes:
+            os.pwrite(fd, data, offset)
+        os.fsync(fd)
+        return reread(fd)
+    finally:
+        os.close(fd)
+
+
+def write(device, partitions, table_type="gpt", sector_size=None):
+    """
+    Write a partition table with 'partitions' to 'device' (a block device or
+    an image file) in one pass, then have the kernel re-read it. Returns
+    the partitions with their geometry set, and whether the kernel re-read
+    the table.
+    """
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        disk_size, sector_size = _get_geometry(fd, sector_size)
+    finally:
+        os.close(fd)
+
+    layout(partitions, disk_size, sector_size)
+    if table_type == "gpt":
+        writes = gpt_image(partitions, disk_size, sector_size)
+    elif table_type == "msdos":
+        writes = mbr_image(partitions, disk_size, sector_size)
+    else:
+        raise PartitionTableError(f"unknown partition table type '{table_type}'")
+
+    return partitions, _write(device, writes)
+
+
+def zap(device, sector_size=None):
+    """
+    Remove all partition tables from 'device', like 'sgdisk -Z'
+    """
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        disk_size, sector_size = _get_geometry(fd, sector_size)
+    finally:
+        os.close(fd)
+
+    # MBR, primary header and entries, and backup entries and header
+    entries_sectors = _entries_sectors(sector_size)
+    last_lba = disk_size // sector_size - 1
+    return _write(device, [
+        (0, bytes((2 + entries_sectors) * sector_size)),
+        ((last_lba - entries_sectors) * sector_size, bytes((1 + entries_sectors) * sector_size)),
+    ])
@@ -0,0 +1,128 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer(object):
+    """
+    Records wall clock, CPU and child process time of installer phases.
+
+    Phases can be nested (for example the modules and plugins executed
+    during a module phase), nested phases are reported as 'steps' of the
+    enclosing phase.
+
+    CPU time is the time of the thread running the phase. Child process
+    time is only known for the whole process, so it is not reported for
+    phases that overlapped with phases running in other threads.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = time.monotonic()
+        # id of the running entries -> thread, and the ids of the ones that
+        # ran at the same time as entries of other threads
+        self.running = {}
+        self.overlapped = set()
+
+    @staticmethod
+    def _snapshot():
+        times = os.times()
+        return {
+            'wall': time.monotonic(),
+            'cpu': time.thread_time(),
+            'children': times.children_user + times.children_system,
+        }
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_phase(self):
+        """
+        Name of the innermost phase running in the calling thread, or None
+        """
+        stack = self._stack()
+        if stack:
+            return stack[-1]['name']
+        return None
+
+    def active_phases(self):
+        """
+        Names of the innermost phases running in any thread
+        """
+        def _innermost(entries):
+            names = []
+            for entry in entries:
+                if 'wall_time' in entry:
+                    continue
+                steps = _innermost(list(entry['steps']))
+                names.extend(steps if steps else [entry['name']])
+            return names
+
+        with self.lock:
+            phases = list(self.phases)
+        return _innermost(phases)
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._stack()
+        entry = {'name': name, 'thread': threading.current_thread().name, 'steps': []}
+        if stack:
+            stack[-1]['steps'].append(entry)
+        else:
+            with self.lock:
+                self.phases.append(entry)
+        stack.append(entry)
+
+        thread = threading.get_ident()
+        with self.lock:
+            others = [key for key, other_thread in self.running.items() if other_thread != thread]
+            if others:
+                self.overlapped.update(others + [id(entry)])
+            self.running[id(entry)] = thread
+
+        begin = PhaseTimer._snapshot()
+        entry['start'] = round(begin['wall'] - self.start_time, 3)
+        try:
+            yield entry
+        except BaseException:
+            entry['failed'] = True
+            raise
+        finally:
+            end = PhaseTimer._snapshot()
+            entry['wall_time'] = round(end['wall'] - begin['wall'], 3)
+            entry['cpu_time'] = round(end['cpu'] - begin['cpu'], 3)
+            with self.lock:
+                del self.running[id(entry)]
+                overlapped = id(entry) in self.overlapped
+                self.overlapped.discard(id(entry))
+            if not overlapped:
+                entry['children_time'] = round(end['children'] - begin['children'], 3)
+            stack.pop()
+
+    def report(self):
+        """
+        Return the timing breakdown as a dictionary suitable for the manifest
+        """
+        def _copy(entry):
+            result = {k: v for k, v in entry.items() if k != 'steps'}
+            if entry['steps']:
+                result['steps'] = [_copy(s) for s in entry['steps']]
+            return result
+
+        with self.lock:
+            phases = [_copy(p) for p in self.phases]
+
+        return {
+            'total_wall_time': round(time.monotonic() - self.start_time, 3),
+            'phases': phases,
+        }
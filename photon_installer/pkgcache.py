@@ -0,0 +1,213 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from rpmfetch import RpmFetcher
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class PackageCache(object):
+    """
+    Cache of downloaded rpms shared by installations.
+
+    Packages are stored once by their sha256 under 'objects/'. For each
+    repo (identified by its expanded base url) an index maps the paths of
+    its packages in the tdnf cache directory to the objects. Before an
+    installation the cached packages that match the checksums in the repo
+    metadata are linked into a private tdnf cache directory, so tdnf does
+    not download them, and afterwards the newly
+    downloaded packages are added. The least recently used objects are
+    removed if the cache grows beyond 'max_size' bytes. The cache directory
+    can be shared by concurrent installs, access is serialized with a lock
+    file.
+    """
+
+    def __init__(self, cache_dir, max_size, logger):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.logger = logger
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.repos_dir = os.path.join(cache_dir, "repos")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.repos_dir, exist_ok=True)
+
+    @staticmethod
+    def repo_key(baseurl):
+        return hashlib.sha256(baseurl.rstrip("/").encode()).hexdigest()[:16]
+
+    @staticmethod
+    def sha256(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256 + ".rpm")
+
+    def _index_path(self, baseurl):
+        return os.path.join(self.repos_dir, PackageCache.repo_key(baseurl) + ".json")
+
+    def _load_index(self, baseurl):
+        try:
+            with open(self._index_path(baseurl), "rt") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'baseurl': baseurl, 'packages': {}}
+        except ValueError as e:
+            self.logger.warning(f"ignoring broken package cache index for {baseurl}: {e}")
+            return {'baseurl': baseurl, 'packages': {}}
+
+    def _save_index(self, baseurl, index):
+        fd, tmp_path = tempfile.mkstemp(dir=self.repos_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wt") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self._index_path(baseurl))
+
+    @staticmethod
+    def _link(src, dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno not in [errno.EXDEV, errno.EPERM]:
+                raise
+            shutil.copy(src, dst)
+
+    def _checksum_ok(self, entry, checksum_type, checksum):
+        if checksum_type == "sha256":
+            return entry['sha256'] == checksum
+        return RpmFetcher.checksum_ok(self._object_path(entry['sha256']), checksum_type, checksum)
+
+    def restore(self, repos, tdnf_cache_dir, checksums):
+        """
+        Link the cached packages of 'repos' (a dictionary of repo id and
+        base url) into 'tdnf_cache_dir', where tdnf keeps the packages of
+        repo 'id' in '<id>/rpms/'. 'checksums' are the checksum type and
+        value of the packages in the repo metadata, by repo id and path.
+        Packages that are not in the metadata, or have a different checksum
+        (they were rebuilt), are not linked. Returns the paths of the
+        packages linked and their sizes.
+        """
+        restored = {}
+        stale = 0
+        with self._locked(exclusive=False):
+            for repo_id, baseurl in repos.items():
+                rpms_dir = os.path.join(tdnf_cache_dir, repo_id, "rpms")
+                repo_checksums = checksums.get(repo_id, {})
+                for relpath, entry in self._load_index(baseurl)['packages'].items():
+                    obj = self._object_path(entry['sha256'])
+                    if not os.path.exists(obj):
+                        # evicted
+                        continue
+                    if relpath not in repo_checksums or not self._checksum_ok(entry, *repo_checksums[relpath]):
+                        stale += 1
+                        continue
+                    dst = os.path.join(rpms_dir, relpath)
+                    PackageCache._link(obj, dst)
+                    # mark as recently used
+                    os.utime(obj)
+                    restored[dst] = entry['size']
+        self.logger.info(f"linked {len(restored)} packages from package cache {self.cache_dir}, "
+                         f"skipped {stale} that do not match the repo metadata")
+        return restored
+
+    def store(self, repos, tdnf_cache_dir, restored):
+        """
+        Add the packages in 'tdnf_cache_dir' that were downloaded (that is,
+        not in 'restored') to the cache, and evict old packages. Returns the
+        paths of the packages added and their sizes.
+        """
+        downloaded = {}
+        updates = {}
+        for repo_id, baseurl in repos.items():
+            rpms_dir = os.path.join(tdnf_cache_dir, repo_id, "rpms")
+            updates[repo_id] = {}
+            for dirpath, _, filenames in os.walk(rpms_dir):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if not filename.endswith(".rpm") or path in restored or os.path.islink(path):
+                        continue
+                    size = os.path.getsize(path)
+                    updates[repo_id][os.path.relpath(path, rpms_dir)] = {'sha256': PackageCache.sha256(path), 'size': size}
+                    downloaded[path] = size
+
+        with self._locked(exclusive=True):
+            for repo_id, packages in updates.items():
+                if not packages:
+                    continue
+                baseurl = repos[repo_id]
+                rpms_dir = os.path.join(tdnf_cache_dir, repo_id, "rpms")
+                for relpath, entry in packages.items():
+                    obj = self._object_path(entry['sha256'])
+                    if not os.path.exists(obj):
+                        os.makedirs(os.path.dirname(obj), exist_ok=True)
+                        # write to a temporary file first, readers must never
+                        # see a partial object
+                        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(obj), prefix=".tmp-")
+                        os.close(fd)
+                        shutil.copy(os.path.join(rpms_dir, relpath), tmp_path)
+                        os.rename(tmp_path, obj)
+                index = self._load_index(baseurl)
+                index['packages'].update(packages)
+                self._save_index(baseurl, index)
+            self._evict()
+
+        self.logger.info(f"added {len(downloaded)} packages to package cache {self.cache_dir}")
+        return downloaded
+
+    def _evict(self):
+        objects = []
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                # temporary files of objects being stored start with a '.'
+                if not filename.startswith("."):
+                    path = os.path.join(dirpath, filename)
+                    objects.append((os.stat(path), path))
+
+        total = sum(st.st_size for st, _ in objects)
+        removed = set()
+        # oldest first
+        for st, path in sorted(objects, key=lambda o: o[0].st_mtime):
+            if total <= self.max_size:
+                break
+            self.logger.info(f"removing {path} from package cache")
+            os.remove(path)
+            removed.add(os.path.basename(path)[:-len(".rpm")])
+            total -= st.st_size
+
+        if not removed:
+            return
+        # drop index entries of removed objects
+        for filename in os.listdir(self.repos_dir):
+            if filename.startswith(".") or not filename.endswith(".json"):
+                continue
+            with open(os.path.join(self.repos_dir, filename), "rt") as f:
+                index = json.load(f)
+            packages = {p: e for p, e in index['packages'].items() if e['sha256'] not in removed}
+            if len(packages) != len(index['packages']):
+                index['packages'] = packages
+                self._save_index(index['baseurl'], index)
@@ -55,6 +55,24 @@ def final_check(installer):
     _execute_phase('final_check', installer)
 
 
+def has_phase(phase_name):
+    """
+    Check if any module in the plugins package implements the phase function
+    """
+    for _, module_name, ispkg in pkgutil.iter_modules(__path__):
+        if ispkg or module_name.startswith('_'):
+            continue
+
+        try:
+            mod = importlib.import_module(f"{__name__}.{module_name}")
+        except Exception:
+            # assume it does, errors will be reported during execution
+            return True
+        if hasattr(mod, phase_name):
+            return True
+    return False
+
+
 def get_known_keys():
     """
     Iterate through all modules in the plugins package
@@ -0,0 +1,218 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Wait for devices, files and sockets to appear without sleeping for fixed
+intervals. Waiters are woken up by inotify events on the directory the path
+will appear in, and for devices also by kernel/udev uevents. If neither is
+available (for example in some containers), the path is polled.
+"""
+
+import ctypes
+import os
+import select
+import socket
+import stat
+import time
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+NETLINK_KOBJECT_UEVENT = 15
+# multicast groups of kernel and udev events
+UEVENT_GROUPS = 0x1 | 0x2
+
+# wake up at least this often even if no event came, in case an event was
+# missed, for example for paths behind symlinks
+MAX_EVENT_WAIT = 1.0
+POLL_INTERVAL = 0.1
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def _existing_ancestor(path):
+    path = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(path):
+        path = os.path.dirname(path)
+    return path
+
+
+class Waiter(object):
+    """
+    Collects the file descriptors that signal changes of a path. Use as a
+    context manager, and call wait() until the path is ready.
+    """
+
+    def __init__(self, path, uevents=False):
+        self.path = path
+        self.inotify_fd = None
+        self.watched = set()
+        self.uevent_sock = None
+
+        try:
+            fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.inotify_fd = fd
+        except (OSError, AttributeError):
+            pass
+
+        if uevents:
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                                     NETLINK_KOBJECT_UEVENT)
+                sock.bind((0, UEVENT_GROUPS))
+                self.uevent_sock = sock
+            except (OSError, AttributeError):
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        if self.uevent_sock is not None:
+            self.uevent_sock.close()
+            self.uevent_sock = None
+
+    def _watch(self, path, mask):
+        if self.inotify_fd is None or path in self.watched:
+            return
+        wd = _get_libc().inotify_add_watch(self.inotify_fd, os.fsencode(path),
+                                           ctypes.c_uint32(mask))
+        if wd >= 0:
+            self.watched.add(path)
+
+    def _drain(self, fd):
+        """
+        Read all pending events, returns the list of messages
+        """
+        messages = []
+        try:
+            while True:
+                if self.uevent_sock is not None and fd == self.uevent_sock.fileno():
+                    messages.append(self.uevent_sock.recv(65536))
+                else:
+                    messages.append(os.read(fd, 65536))
+        except (BlockingIOError, InterruptedError):
+            pass
+        return messages
+
+    def wait(self, timeout):
+        """
+        Wait until something may have changed, or 'timeout' seconds passed.
+        Returns the uevents received.
+        """
+        # the directory the path will appear in may not exist yet, watch the
+        # deepest existing one and go further down when it appears
+        self._watch(_existing_ancestor(self.path), IN_CREATE | IN_MOVED_TO | IN_ATTRIB)
+
+        fds = []
+        if self.inotify_fd is not None:
+            fds.append(self.inotify_fd)
+        if self.uevent_sock is not None:
+            fds.append(self.uevent_sock.fileno())
+
+        if not fds:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return []
+
+        ready, _, _ = select.select(fds, [], [], min(timeout, MAX_EVENT_WAIT))
+        uevents = []
+        for fd in ready:
+            messages = self._drain(fd)
+            if self.uevent_sock is not None and fd == self.uevent_sock.fileno():
+                uevents.extend(messages)
+        return uevents
+
+
+def wait_for_path(path, timeout=30, check=os.path.exists, uevents=False):
+    """
+    Wait until check(path) returns True. Returns False after 'timeout'
+    seconds.
+    """
+    deadline = time.monotonic() + timeout
+    with Waiter(path, uevents=uevents) as waiter:
+        while True:
+            if check(path):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            waiter.wait(remaining)
+
+
+def _is_block_device(path):
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def wait_for_block_device(path, timeout=30):
+    """
+    Wait for the block device node (or a symlink to it) to appear
+    """
+    return wait_for_path(path, timeout=timeout, check=_is_block_device, uevents=True)
+
+
+def wait_for_socket(path, timeout=30):
+    """
+    Wait for a unix socket to be created, for example by a daemon that was
+    just started
+    """
+    return wait_for_path(path, timeout=timeout, check=_is_socket)
+
+
+def _uevent_matches(data, devname):
+    for field in data.split(b"\0"):
+        if field.startswith(b"DEVNAME=") and os.path.basename(field[len(b"DEVNAME="):]) == devname:
+            return True
+    return False
+
+
+def wait_for_device_change(path, timeout=5):
+    """
+    Wait for an event for an existing device, like a medium being inserted
+    or becoming readable. Returns True if there was an event, False after
+    'timeout' seconds. Waits for the device to appear if it does not exist.
+    """
+    if not os.path.exists(path):
+        return wait_for_block_device(path, timeout=timeout)
+
+    devname = os.fsencode(os.path.basename(os.path.realpath(path)))
+    deadline = time.monotonic() + timeout
+    with Waiter(path, uevents=True) as waiter:
+        if waiter.uevent_sock is None:
+            time.sleep(timeout)
+            return False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            for data in waiter.wait(remaining):
+                if _uevent_matches(data, devname):
+                    return True
@@ -0,0 +1,225 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Samples the system resources while the installer runs, to tell whether an
+installation is CPU, I/O or memory bound. At a fixed interval a thread
+reads /proc/stat, /proc/meminfo, /proc/diskstats and the RSS of the
+installer and all its child processes, and tags the sample with the phases
+running at that time.
+"""
+
+import os
+import resource
+import threading
+import time
+
+import cmdtrace
+
+MB = 1024 * 1024
+SECTOR_SIZE = 512
+
+
+def _read_cpu():
+    # user nice system idle iowait irq softirq steal
+    with open("/proc/stat", "rt") as f:
+        fields = [int(v) for v in f.readline().split()[1:9]]
+    return {'total': sum(fields), 'idle': fields[3], 'iowait': fields[4]}
+
+
+def _read_meminfo():
+    meminfo = {}
+    with open("/proc/meminfo", "rt") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            # values are in kB
+            meminfo[key] = int(value.split()[0]) * 1024
+    return meminfo
+
+
+def _read_diskstats(match_fn):
+    stats = {}
+    with open("/proc/diskstats", "rt") as f:
+        for line in f:
+            fields = line.split()
+            if match_fn(fields[2]):
+                stats[fields[2]] = {
+                    'read': int(fields[5]) * SECTOR_SIZE,
+                    'write': int(fields[9]) * SECTOR_SIZE,
+                    'io_ticks': int(fields[12]),
+                }
+    return stats
+
+
+def _tree_rss(root_pid):
+    """
+    RSS of 'root_pid' and all its descendants, and their number
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children = {}
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rt") as f:
+                stat = f.read()
+        except OSError:
+            # gone already
+            continue
+        # the command name may contain spaces and parentheses
+        fields = stat[stat.rindex(")") + 2:].split()
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page_size
+
+    total = 0
+    count = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        count += 1
+        pending.extend(children.get(pid, []))
+    return total, count
+
+
+class ResourceSampler(object):
+    """
+    Samples resources every 'interval' seconds in a thread. 'phases_fn'
+    returns the names of the running phases, 'disks_fn' the names of the
+    target disks, whose statistics are sampled together with those of all
+    loop devices.
+    """
+
+    def __init__(self, interval, start_time, phases_fn, disks_fn, logger):
+        self.interval = interval
+        self.start_time = start_time
+        self.phases_fn = phases_fn
+        self.disks_fn = disks_fn
+        self.logger = logger
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last = None
+
+    def start(self):
+        self.last = self._read()
+        self.thread = threading.Thread(target=self._loop, name="resource-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                # sampling must never break the installation
+                self.logger.warning(f"resource sampler stopped: {e}")
+                return
+
+    def _read(self):
+        disks = set(self.disks_fn())
+        return {
+            'time': time.monotonic(),
+            'cpu': _read_cpu(),
+            'meminfo': _read_meminfo(),
+            'disks': _read_diskstats(lambda name: name in disks or name.startswith("loop")),
+        }
+
+    def _sample(self):
+        current = self._read()
+        last, self.last = self.last, current
+        elapsed = current['time'] - last['time']
+
+        cpu_total = max(current['cpu']['total'] - last['cpu']['total'], 1)
+        cpu_idle = current['cpu']['idle'] - last['cpu']['idle']
+        cpu_iowait = current['cpu']['iowait'] - last['cpu']['iowait']
+
+        disks = {}
+        for name, stats in current['disks'].items():
+            if name not in last['disks']:
+                continue
+            prev = last['disks'][name]
+            read = stats['read'] - prev['read']
+            write = stats['write'] - prev['write']
+            if read == 0 and write == 0 and stats['io_ticks'] == prev['io_ticks']:
+                continue
+            disks[name] = {
+                'read_mb_s': round(read / MB / elapsed, 2),
+                'write_mb_s': round(write / MB / elapsed, 2),
+                # share of the time the device had I/O in flight
+                'busy': round(min((stats['io_ticks'] - prev['io_ticks']) / 10 / elapsed, 100), 1),
+            }
+
+        meminfo = current['meminfo']
+        rss, processes = _tree_rss(os.getpid())
+        sample = {
+            'time': round(current['time'] - self.start_time, 3),
+            'phases': self.phases_fn(),
+            'cpu_busy': round(100 * (cpu_total - cpu_idle - cpu_iowait) / cpu_total, 1),
+            'cpu_iowait': round(100 * cpu_iowait / cpu_total, 1),
+            'mem_used_mb': round((meminfo['MemTotal'] - meminfo.get('MemAvailable', meminfo['MemFree'])) / MB, 1),
+            'mem_available_mb': round(meminfo.get('MemAvailable', meminfo['MemFree']) / MB, 1),
+            'dirty_mb': round(meminfo.get('Dirty', 0) / MB, 1),
+            'rss_mb': round(rss / MB, 1),
+            'processes': processes,
+            'disks': disks,
+        }
+        self.samples.append(sample)
+
+        cmdtrace.counter("cpu", {'busy': sample['cpu_busy'], 'iowait': sample['cpu_iowait']})
+        cmdtrace.counter("memory", {'used_mb': sample['mem_used_mb'], 'rss_mb': sample['rss_mb']})
+        if disks:
+            cmdtrace.counter("disk busy", {name: d['busy'] for name, d in disks.items()})
+
+    def summary(self):
+        """
+        Peak memory use, and averages of CPU and disk use by phase
+        """
+        samples = list(self.samples)
+        # catches short lived peaks between samples, ru_maxrss is in kB
+        max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+        summary = {
+            'interval': self.interval,
+            'samples': len(samples),
+            'cpus': os.cpu_count(),
+            'max_process_rss_mb': round(max_rss / MB, 1),
+        }
+        if not samples:
+            return summary
+
+        peak = max(samples, key=lambda s: s['rss_mb'])
+        summary['peak_rss_mb'] = peak['rss_mb']
+        summary['peak_rss_phases'] = peak['phases']
+        summary['min_mem_available_mb'] = min(s['mem_available_mb'] for s in samples)
+
+        by_phase = {}
+        for sample in samples:
+            for name in sample['phases'] or ["(none)"]:
+                by_phase.setdefault(name, []).append(sample)
+
+        def _avg(values):
+            values = list(values)
+            return round(sum(values) / len(values), 1) if values else 0
+
+        phases = {}
+        for name, phase_samples in by_phase.items():
+            phases[name] = {
+                'samples': len(phase_samples),
+                'cpu_busy': _avg(s['cpu_busy'] for s in phase_samples),
+                'cpu_iowait': _avg(s['cpu_iowait'] for s in phase_samples),
+                'disk_busy': _avg(max([d['busy'] for d in s['disks'].values()] or [0]) for s in phase_samples),
+                'peak_rss_mb': max(s['rss_mb'] for s in phase_samples),
+            }
+        summary['phases'] = phases
+        return summary
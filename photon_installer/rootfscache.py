@@ -0,0 +1,125 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+# not part of the installed tree (special mounts, tdnf cache). The mount
+# points already exist when a snapshot is restored.
+EXCLUDE_DIRS = ["dev", "proc", "sys", "run", "tmp", "var/cache/tdnf"]
+
+
+class RootfsCache(object):
+    """
+    Cache of snapshots of the target root after the packages were installed.
+
+    Snapshots are tarballs named by a hash of everything that determines the
+    installed tree (see key()). The least recently used snapshots are removed
+    if the cache grows beyond 'max_size' bytes. The cache directory can be
+    shared by concurrent installs, access is serialized with a lock file.
+    """
+
+    def __init__(self, cache_dir, max_size, logger):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.logger = logger
+        os.makedirs(cache_dir, exist_ok=True)
+
+        if shutil.which("zstd") is not None:
+            self.suffix = ".tar.zst"
+            self.compress = ["-I", "zstd -T0"]
+        else:
+            self.suffix = ".tar"
+            self.compress = []
+
+    @staticmethod
+    def key(inputs):
+        """
+        Hash of a dictionary with all inputs of the package installation
+        """
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _snapshots(self):
+        # temporary files of snapshots being stored start with a '.'
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+                if not f.startswith(".") and (f.endswith(".tar") or f.endswith(".tar.zst"))]
+
+    def _find(self, key):
+        for suffix in [".tar.zst", ".tar"]:
+            path = os.path.join(self.cache_dir, key + suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def restore(self, key, root):
+        """
+        Extract the snapshot for 'key' into 'root'. Returns False if there
+        is no snapshot.
+        """
+        with self._locked(exclusive=False):
+            path = self._find(key)
+            if path is None:
+                return False
+
+            self.logger.info(f"restoring {root} from rootfs cache {path}")
+            cmd = ["tar", "-C", root, "--numeric-owner", "--xattrs", "--xattrs-include=*", "--acls", "-xpf", path]
+            if path.endswith(".zst"):
+                cmd[1:1] = ["-I", "zstd"]
+            subprocess.check_call(cmd)
+
+            # mark as recently used
+            os.utime(path)
+        return True
+
+    def store(self, key, root, exclude=None):
+        """
+        Add a snapshot of 'root' for 'key' and evict old snapshots.
+        'exclude' is a list of additional directories (relative to 'root') to
+        leave out.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-", suffix=self.suffix)
+        os.close(fd)
+        try:
+            cmd = ["tar", "-C", root] + self.compress + \
+                  ["--numeric-owner", "--xattrs", "--xattrs-include=*", "--acls", "--sparse"]
+            for d in EXCLUDE_DIRS + (exclude or []):
+                cmd.append(f"--exclude=./{d.strip('/')}")
+            cmd.extend(["-cpf", tmp_path, "."])
+            subprocess.check_call(cmd)
+
+            with self._locked(exclusive=True):
+                os.rename(tmp_path, os.path.join(self.cache_dir, key + self.suffix))
+                self._evict()
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.logger.info(f"stored {root} in rootfs cache as {key}")
+
+    def _evict(self):
+        snapshots = [(os.stat(p), p) for p in self._snapshots()]
+        total = sum(st.st_size for st, _ in snapshots)
+        # oldest first
+        for st, path in sorted(snapshots, key=lambda s: s[0].st_mtime):
+            if total <= self.max_size:
+                break
+            self.logger.info(f"removing {path} from rootfs cache")
+            os.remove(path)
+            total -= st.st_size
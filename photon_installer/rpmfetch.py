@@ -0,0 +1,301 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Parallel download of the packages of a tdnf transaction. tdnf downloads
+packages one after another, so with a remote repo most of the time is
+spent waiting for round trips. The packages of the resolved transaction are
+looked up in the repo metadata and downloaded with a bounded number of
+keep-alive connections before tdnf runs, partial files are resumed, and
+each file is verified against the checksum from the metadata. tdnf then
+finds the packages in its cache (or download directory) and only downloads
+what is missing.
+"""
+
+import bz2
+import configparser
+import glob
+import gzip
+import hashlib
+import lzma
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+NS_REPO = "{http://linux.duke.edu/metadata/repo}"
+NS_COMMON = "{http://linux.duke.edu/metadata/common}"
+NS_XML = "{http://www.w3.org/XML/1998/namespace}"
+
+CHUNK_SIZE = 1024 * 1024
+
+# keys of the json output of 'tdnf -j --assumeno install' with packages to download
+TRANSACTION_KEYS = ["Install", "Upgrade", "Downgrade", "Reinstall"]
+
+DECOMPRESSORS = {
+    ".gz": gzip.decompress,
+    ".xz": lzma.decompress,
+    ".bz2": bz2.decompress,
+}
+
+
+class RpmFetchError(Exception):
+    pass
+
+
+def evr(epoch, version, release):
+    """
+    Version string in the format tdnf uses
+    """
+    if epoch and int(epoch) != 0:
+        return f"{epoch}:{version}-{release}"
+    return f"{version}-{release}"
+
+
+def expand_baseurl(baseurl, releasever, basearch):
+    """
+    Replace the variables tdnf expands in base urls
+    """
+    return baseurl.replace("$releasever", releasever).replace("$basearch", basearch)
+
+
+def read_repo_files(reposdir, releasever, basearch):
+    """
+    Base urls of the enabled repos in the .repo files in 'reposdir', by
+    repo id, with $releasever and $basearch expanded
+    """
+    repos = {}
+    for repo_file in sorted(glob.glob(os.path.join(reposdir, "*.repo"))):
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(repo_file)
+        for repo_id in config.sections():
+            section = config[repo_id]
+            if section.get("enabled", "1").strip() in ["0", "false", "False"]:
+                continue
+            baseurl = section.get("baseurl", None)
+            if baseurl:
+                repos[repo_id] = expand_baseurl(baseurl.split()[0], releasever, basearch)
+    return repos
+
+
+class Package(object):
+    def __init__(self, name, arch, evr, checksum_type, checksum, size, url):
+        self.name = name
+        self.arch = arch
+        self.evr = evr
+        self.checksum_type = checksum_type
+        self.checksum = checksum
+        self.size = size
+        self.url = url
+        # path of the package relative to the repo
+        self.location = None
+
+
+class RepoMetadata(object):
+    """
+    Packages of a repo, from its primary metadata
+    """
+
+    def __init__(self, baseurl, packages):
+        self.baseurl = baseurl
+        self.packages = packages
+
+    @staticmethod
+    def load(fetcher, baseurl):
+        baseurl = baseurl.rstrip("/") + "/"
+        repomd = ET.fromstring(fetcher.get(baseurl + "repodata/repomd.xml"))
+
+        primary_href = None
+        for data in repomd.iter(f"{NS_REPO}data"):
+            if data.get("type") == "primary":
+                primary_href = data.find(f"{NS_REPO}location").get("href")
+        if primary_href is None:
+            raise RpmFetchError(f"no primary metadata in repo {baseurl}")
+
+        content = fetcher.get(baseurl + primary_href)
+        ext = os.path.splitext(primary_href)[1]
+        if ext in DECOMPRESSORS:
+            content = DECOMPRESSORS[ext](content)
+        elif ext != ".xml":
+            raise RpmFetchError(f"unsupported compression of {primary_href} in repo {baseurl}")
+
+        packages = {}
+        for pkg in ET.fromstring(content).iter(f"{NS_COMMON}package"):
+            version = pkg.find(f"{NS_COMMON}version")
+            checksum = pkg.find(f"{NS_COMMON}checksum")
+            location = pkg.find(f"{NS_COMMON}location")
+            href = location.get("href")
+            base = location.get(f"{NS_XML}base", baseurl)
+            package = Package(pkg.findtext(f"{NS_COMMON}name"),
+                              pkg.findtext(f"{NS_COMMON}arch"),
+                              evr(version.get("epoch"), version.get("ver"), version.get("rel")),
+                              checksum.get("type"),
+                              checksum.text.strip(),
+                              int(pkg.find(f"{NS_COMMON}size").get("package")),
+                              base.rstrip("/") + "/" + href)
+            package.location = href
+            packages[(package.name, package.arch, package.evr)] = package
+        return RepoMetadata(baseurl, packages)
+
+    def find(self, name, arch, evr):
+        return self.packages.get((name, arch, evr), None)
+
+
+class RpmFetcher(object):
+    """
+    Downloads files with up to 'connections' parallel keep-alive
+    connections
+    """
+
+    def __init__(self, logger, connections=4, verify=True, retries=3, timeout=30):
+        self.logger = logger
+        self.connections = connections
+        self.verify = verify
+        self.retries = retries
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _session(self):
+        # one session, and so one connection per host, for each thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get(self, url):
+        r = self._session().get(url, verify=self.verify, timeout=self.timeout)
+        if not r.ok:
+            raise RpmFetchError(f"downloading {url} failed with status {r.status_code}")
+        return r.content
+
+    @staticmethod
+    def checksum_ok(path, checksum_type, checksum):
+        # 'sha' is sha1 in old repo metadata
+        digest = hashlib.new("sha1" if checksum_type == "sha" else checksum_type)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest() == checksum
+
+    def _download(self, url, part):
+        """
+        Download 'url' to 'part', resuming if 'part' exists
+        """
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f"bytes={offset}-"
+
+        with self._session().get(url, headers=headers, stream=True, verify=self.verify, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                # nothing left to download
+                return 0
+            if not r.ok:
+                raise RpmFetchError(f"downloading {url} failed with status {r.status_code}")
+            # the server may ignore the range and send the whole file
+            mode = "ab" if r.status_code == 206 else "wb"
+            count = 0
+            with open(part, mode) as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    count += len(chunk)
+            return count
+
+    def fetch(self, package, dest):
+        """
+        Download 'package' to 'dest' and verify it. Returns the number of
+        bytes downloaded, 0 if 'dest' already existed and was valid.
+        """
+        if os.path.exists(dest):
+            if RpmFetcher.checksum_ok(dest, package.checksum_type, package.checksum):
+                return 0
+            os.remove(dest)
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        part = dest + ".part"
+        downloaded = 0
+        for attempt in range(self.retries):
+            try:
+                downloaded += self._download(package.url, part)
+            except (requests.RequestException, OSError) as e:
+                self.logger.info(f"downloading {package.url} failed: {e}")
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+
+            if RpmFetcher.checksum_ok(part, package.checksum_type, package.checksum):
+                os.rename(part, dest)
+                return downloaded
+
+            self.logger.info(f"checksum mismatch for {package.url}")
+            os.remove(part)
+
+        if os.path.exists(part) and os.path.getsize(part) >= package.size:
+            # a corrupt complete file cannot be resumed
+            os.remove(part)
+        raise RpmFetchError(f"downloading {package.url} failed after {self.retries} attempts")
+
+    def fetch_all(self, jobs):
+        """
+        Download the (package, dest) pairs in 'jobs' in parallel. Returns the
+        number of files and bytes downloaded, and the failed packages.
+        """
+        def _fetch(job):
+            package, dest = job
+            try:
+                return self.fetch(package, dest), None
+            except RpmFetchError as e:
+                self.logger.warning(str(e))
+                return 0, package
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            results = list(executor.map(_fetch, jobs))
+
+        failed = [package for _, package in results if package is not None]
+        return {
+            'files': len([count for count, package in results if count > 0]),
+            'bytes': sum(count for count, _ in results),
+            'failed': failed,
+        }
+
+
+def load_metadata(fetcher, repos):
+    """
+    Metadata of the remote repos 'repos' (base urls by repo id), by repo
+    id. Repos whose metadata cannot be read are left out.
+    """
+    metadata = {}
+    for repo_id, baseurl in repos.items():
+        try:
+            metadata[repo_id] = RepoMetadata.load(fetcher, baseurl)
+        except (RpmFetchError, requests.RequestException, ET.ParseError, OSError) as e:
+            fetcher.logger.warning(f"cannot read metadata of repo '{repo_id}': {e}")
+    return metadata
+
+
+def fetch_transaction(fetcher, solved, repos, dest_path):
+    """
+    Download the packages of the tdnf transaction 'solved' (the json output
+    of 'tdnf -j --assumeno install'). 'repos' are the base urls of the
+    remote repos by repo id, 'dest_path(repo_id, package)' returns where a
+    package is stored. Packages that are not in the repo metadata are left
+    to tdnf. Returns the statistics of RpmFetcher.fetch_all().
+    """
+    metadata = load_metadata(fetcher, repos)
+
+    jobs = []
+    for key in TRANSACTION_KEYS:
+        for pkg in solved.get(key, None) or []:
+            # prefer the repo tdnf picked, if it tells
+            repo_ids = [pkg['Repo']] if pkg.get('Repo', None) in metadata else list(metadata)
+            for repo_id in repo_ids:
+                package = metadata[repo_id].find(pkg['Name'], pkg['Arch'], pkg['Evr'])
+                if package is not None:
+                    jobs.append((package, dest_path(repo_id, package)))
+                    break
+
+    fetcher.logger.info(f"downloading {len(jobs)} packages with {fetcher.connections} connections")
+    return fetcher.fetch_all(jobs)
@@ -0,0 +1,123 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class Phase(object):
+    """
+    An installation phase.
+
+    'requires' is a list of resources that need to be provided by previous
+    phases before this phase can run, 'provides' is the list of resources
+    that are available once this phase has completed.
+    """
+
+    def __init__(self, name, func, requires=None, provides=None):
+        self.name = name
+        self.func = func
+        self.requires = set(requires or [])
+        self.provides = set(provides or [])
+
+    def __repr__(self):
+        return f"Phase({self.name})"
+
+
+class PhaseScheduler(object):
+    """
+    Runs a list of phases, either one after another in the order given
+    ('serial' mode), or as soon as all resources they require are available
+    on a pool of worker threads ('parallel' mode).
+    """
+
+    modes = ["serial", "parallel"]
+
+    def __init__(self, phases, timer, logger, mode="serial", workers=None):
+        if mode not in PhaseScheduler.modes:
+            raise SchedulerError(f"unknown scheduler mode '{mode}'")
+
+        self.phases = phases
+        self.timer = timer
+        self.logger = logger
+        self.mode = mode
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.workers = workers
+
+        self._check()
+
+    def _check(self):
+        """
+        Make sure every required resource is provided by exactly one earlier
+        phase, which also makes sure the serial order is a valid topological
+        order of the graph.
+        """
+        names = set()
+        available = set()
+        for phase in self.phases:
+            if phase.name in names:
+                raise SchedulerError(f"duplicate phase '{phase.name}'")
+            names.add(phase.name)
+
+            missing = phase.requires - available
+            if missing:
+                raise SchedulerError(f"phase '{phase.name}' requires {sorted(missing)} which no earlier phase provides")
+
+            duplicate = phase.provides & available
+            if duplicate:
+                raise SchedulerError(f"phase '{phase.name}' provides {sorted(duplicate)} which is already provided")
+            available |= phase.provides
+
+    def _run_phase(self, phase):
+        self.logger.info(f"starting phase {phase.name}")
+        with self.timer.phase(phase.name):
+            phase.func()
+        self.logger.info(f"finished phase {phase.name}")
+
+    def run(self):
+        if self.mode == "serial" or self.workers <= 1:
+            for phase in self.phases:
+                self._run_phase(phase)
+        else:
+            self._run_parallel()
+
+    def _run_parallel(self):
+        available = set()
+        pending = list(self.phases)
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="phase") as executor:
+            while pending or running:
+                if error is None:
+                    # keep declaration order among ready phases
+                    for phase in [p for p in pending if p.requires <= available]:
+                        pending.remove(phase)
+                        running[executor.submit(self._run_phase, phase)] = phase
+
+                if not running:
+                    if error is None:
+                        raise SchedulerError(f"phases {pending} can never run")
+                    break
+
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    phase = running.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        # do not start any more phases, but let the running ones finish
+                        if error is None:
+                            self.logger.error(f"phase {phase.name} failed: {exc}")
+                            error = exc
+                    else:
+                        available |= phase.provides
+
+        if error is not None:
+            raise error
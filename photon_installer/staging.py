@@ -0,0 +1,58 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+
+"""
+Staging of the installation on a tmpfs. Packages are installed to memory,
+and the tree is copied to the target filesystems in one pass at the end,
+so the many small writes and fsyncs of rpm do not go to the disks.
+"""
+
+import shlex
+
+# memory that is left for the installer, tdnf and rpm, in MB
+MEM_RESERVE = 1024
+
+STAGING_TYPES = ["direct", "tmpfs"]
+
+TAR_OPTIONS = ["--numeric-owner", "--xattrs", "--xattrs-include=*", "--acls", "--sparse"]
+
+
+def mem_available():
+    """
+    Memory available for new allocations without swapping, in bytes
+    """
+    with open("/proc/meminfo", "rt") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key == "MemAvailable":
+                # the value is in kB
+                return int(value.split()[0]) * 1024
+    return 0
+
+
+def is_below(path, parent):
+    """
+    Check if the relative path 'path' is inside 'parent' (but not 'parent'
+    itself). '.' is the top level.
+    """
+    if path == parent:
+        return False
+    return parent == "." or path.startswith(parent + "/")
+
+
+def copy_command(src, dst, excludes):
+    """
+    Command that copies the tree 'src' to 'dst', keeping ownership, modes,
+    xattrs (including SELinux labels) and ACLs. The contents of the
+    directories 'excludes' (relative to 'src') are skipped, but the
+    directories themselves are copied. tar streams the files in large
+    sequential writes.
+    """
+    create = ["tar", "-C", src] + TAR_OPTIONS + ["--anchored"]
+    for path in excludes:
+        create.append(f"--exclude=./{path}/*")
+    create.extend(["-cf", "-", "."])
+    extract = ["tar", "-C", dst] + TAR_OPTIONS + ["-xpf", "-"]
+    return ["/bin/bash", "-c", f"set -o pipefail; {shlex.join(create)} | {shlex.join(extract)}"]
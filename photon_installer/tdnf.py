@@ -10,7 +10,8 @@ import platform
 import shutil
 import subprocess
 
-from logger import Logger
+import cmdtrace
+from logger import OUTPUT, Logger
 
 
 class TdnfError(Exception):
@@ -28,6 +29,62 @@ class TdnfBinaryNotUsableError(TdnfError):
     pass
 
 
+# settings of the 'tdnf_options' profiles, explicit settings override them
+PROFILES = {
+    'default': {},
+    'minimal': {
+        'excludedocs': True,
+        'install_langs': ["en_US"],
+        'exclude_paths': ["/usr/share/man", "/usr/share/info", "/usr/share/doc", "/usr/share/gtk-doc", "/usr/share/help"],
+    },
+}
+
+
+def resolve_options(options):
+    """
+    Effective tdnf options: the settings of the profile, updated with the
+    explicit ones
+    """
+    options = dict(options or {})
+    resolved = dict(PROFILES[options.pop('profile', 'default')])
+    resolved.update(options)
+    if isinstance(resolved.get('install_langs', None), str):
+        resolved['install_langs'] = resolved['install_langs'].split(":")
+    return resolved
+
+
+def options_rpm_defines(options):
+    """
+    rpm macros (for --rpmdefine) for resolved tdnf options. Paths in
+    'exclude_paths' are prefixes, rpm does not install files below them.
+    """
+    defines = []
+    if options.get('excludedocs', False):
+        defines.append("_excludedocs 1")
+    if options.get('install_langs'):
+        defines.append("_install_langs " + ":".join(options['install_langs']))
+    if options.get('exclude_paths'):
+        defines.append("_netsharedpath " + ":".join(options['exclude_paths']))
+    for name, value in options.get('rpm_macros', {}).items():
+        defines.append(f"{name.lstrip('%')} {value}")
+    return defines
+
+
+# commands that only read the repo metadata
+METADATA_COMMANDS = ["list", "info", "search", "provides", "repoquery", "repolist", "check-update", "updateinfo"]
+
+
+def reads_metadata_only(args):
+    """
+    Check if the tdnf arguments 'args' only read the repo metadata, and
+    do not download packages
+    """
+    if "--assumeno" in args:
+        return True
+    commands = [arg for arg in args if not arg.startswith("-")]
+    return len(commands) > 0 and commands[0] in METADATA_COMMANDS
+
+
 def create_repo_conf(repos, reposdir="/etc/yum.repos.d", insecure=False, skip_md_extras=True):
     """
     Create .repo file as per configurations passed.
@@ -61,12 +118,18 @@ class Tdnf:
             'reposdir',
             'releasever',
             'installroot',
+            # additional environment variables and rpm macros for all commands
+            'env',
+            'rpm_defines',
         ]
 
         for kw in kwords:
             attr = kwargs.get(kw, None)
             setattr(self, kw, attr)
 
+        # set by start_session()
+        self.cacheonly = False
+
         # only need to specify arch if it's different
         if self.arch == platform.machine():
             self.arch = None
@@ -93,6 +156,32 @@ class Tdnf:
             self.logger.error(f"tdnf binary found at {self.tdnf_bin} is not usable: {e}")
             raise TdnfBinaryNotUsableError(f"tdnf binary is not functional: {e}")
 
+    def start_session(self):
+        """
+        Refresh the repo metadata cache once, and run the following commands
+        that only read the metadata (see reads_metadata_only()) from the
+        cache instead of checking (and possibly loading) the repo metadata
+        again for each call. Commands that may download packages still run
+        without '--cacheonly'. Returns True if the session was started.
+        """
+        try:
+            self.run(["makecache"], do_json=False)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"tdnf makecache failed ({e}), not using a tdnf session")
+            return False
+
+        self.cacheonly = True
+        self.logger.info("started tdnf session, using cached metadata from now on")
+        return True
+
+    def end_session(self):
+        """
+        Check the repo metadata again for the following commands
+        """
+        if self.cacheonly:
+            self.logger.info("ended tdnf session")
+        self.cacheonly = False
+
     def get_rpm_dbpath(self):
         if self.releasever == "4.0":
             return "/var/lib/rpm"
@@ -113,6 +202,8 @@ class Tdnf:
             args += ["--installroot", self.installroot]
         if self.releasever != "5.0":
             args += ["--rpmdefine", f"_dbpath {self.get_rpm_dbpath()}"]
+        for define in self.rpm_defines or []:
+            args += ["--rpmdefine", define]
         return args
 
     def get_command(self, args=None, do_json=True):
@@ -125,17 +216,32 @@ class Tdnf:
             tdnf_args.append("-j")
         if "--assumeno" not in args:
             tdnf_args.append("-y")
-        tdnf_args += self.default_args() + args
+        tdnf_args += self.default_args()
+        if self.cacheonly and reads_metadata_only(args):
+            tdnf_args.append("--cacheonly")
+        tdnf_args += args
 
         return [self.tdnf_bin] + tdnf_args
 
     def execute(self, args, do_json=True):
+        with Logger.command(), cmdtrace.command(args) as traced:
+            return self._execute(args, traced, do_json=do_json)
+
+    def _execute(self, args, traced, do_json=True):
         self.logger.info(f"running {' '.join(args)}")
 
+        env = None
+        if self.env:
+            env = {**os.environ, **self.env}
+
         if do_json:
-            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+            traced.pid = process.pid
             out, err = process.communicate()
             retval = process.returncode
+            traced.exit_code = retval
+            traced.add_output(out)
+            traced.add_output(err)
 
             out_json = None
 
@@ -174,11 +280,14 @@ class Tdnf:
             # overlays the progress bar with tdnf/rpm messages such as file
             # paths (e.g. /etc/os-release).
             process = subprocess.Popen(
-                args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
             )
+            traced.pid = process.pid
             for line in process.stdout:
-                self.logger.info(line.decode('utf-8', errors='replace').rstrip())
+                self.logger.info(line.decode('utf-8', errors='replace').rstrip(), extra=OUTPUT)
+                traced.add_output(line)
             retval = process.wait()
+            traced.exit_code = retval
             if retval != 0:
                 raise subprocess.CalledProcessError(retval, args)
             return retval
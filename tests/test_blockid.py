@@ -0,0 +1,64 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Block device id cache: parsing of 'blkid -o export' and lookups."""
+
+import logging
+import os
+import sys
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from blockid import BlockIdCache  # noqa: E402
+
+EXPORT = """DEVNAME=/dev/sda1
+PARTLABEL=EFI System
+PARTUUID=7b5a0c6e-2d0f-4a3b-9c1d-5e6f7a8b9c0d
+
+DEVNAME=/dev/sda2
+UUID=0b56138b-6124-4ec4-a7a3-7c503516a65c
+BLOCK_SIZE=4096
+TYPE=ext4
+PARTUUID=1a2b3c4d-02
+
+DEVNAME=/dev/mapper/vg-root
+LABEL=root=fs
+TYPE=xfs
+"""
+
+
+def test_parse():
+    devices = BlockIdCache.parse(EXPORT)
+    assert sorted(devices) == ["/dev/mapper/vg-root", "/dev/sda1", "/dev/sda2"]
+    assert devices["/dev/sda1"] == {
+        'PARTLABEL': "EFI System",
+        'PARTUUID': "7b5a0c6e-2d0f-4a3b-9c1d-5e6f7a8b9c0d",
+    }
+    assert devices["/dev/sda2"]['UUID'] == "0b56138b-6124-4ec4-a7a3-7c503516a65c"
+    # values may contain '='
+    assert devices["/dev/mapper/vg-root"]['LABEL'] == "root=fs"
+
+
+def test_parse_empty():
+    assert BlockIdCache.parse("") == {}
+    # lines before the first DEVNAME are ignored
+    assert BlockIdCache.parse("UUID=1234\n") == {}
+
+
+def test_set_get(tmp_path):
+    cache = BlockIdCache(logging.getLogger())
+    path = os.path.join(tmp_path, "disk.img")
+    link = os.path.join(tmp_path, "link")
+    os.symlink(path, link)
+
+    cache.set(path, {'UUID': "1234-ABCD", 'TYPE': "vfat"})
+
+    # devices are known by their real path
+    assert cache.get(link, 'UUID') == "1234-ABCD"
+    assert cache.get(path, 'PARTUUID') == ''
+    assert cache.tags(path) == {'UUID': "1234-ABCD", 'TYPE': "vfat"}
+
+    cache.invalidate()
+    assert cache.devices == {}
@@ -0,0 +1,146 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Running commands concurrently with CommandUtils.run_parallel(), and in
+a persistent chroot session."""
+
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from commandutils import (ChrootSession, ChrootSessionError,  # noqa: E402
+                          CommandUtils)
+
+# the sessions run in a chroot of the host's root
+needs_root = pytest.mark.skipif(os.geteuid() != 0, reason="chroot needs root")
+
+
+def _cmd():
+    return CommandUtils(logging.getLogger())
+
+
+def test_results_and_output():
+    results = _cmd().run_parallel([
+        ["sh", "-c", "echo one; echo two; exit 3"],
+        (["sh", "-c", "printf 'no newline'"], "prefix"),
+    ])
+
+    assert [r.retval for r in results] == [3, 0]
+    assert results[0].output == ["one", "two"]
+    assert results[0].prefix == "sh"
+    assert results[1].output == ["no newline"]
+    assert results[1].prefix == "prefix"
+    assert _cmd().run_parallel([]) == []
+
+
+def test_concurrent(tmp_path):
+    # each command waits for the other one
+    a = os.path.join(tmp_path, "a")
+    b = os.path.join(tmp_path, "b")
+    wait = "for i in $(seq 100); do [ -e {} ] && exit 0; sleep 0.1; done; exit 1"
+    results = _cmd().run_parallel([
+        ["sh", "-c", f"touch {a}; " + wait.format(b)],
+        ["sh", "-c", f"touch {b}; " + wait.format(a)],
+    ], timeout=30)
+    assert [r.retval for r in results] == [0, 0]
+
+
+def test_max_jobs(tmp_path):
+    # with one job at a time the second command starts after the first
+    marker = os.path.join(tmp_path, "marker")
+    results = _cmd().run_parallel([
+        ["sh", "-c", f"sleep 0.2; touch {marker}"],
+        ["test", "-e", marker],
+    ], max_jobs=1)
+    assert [r.retval for r in results] == [0, 0]
+
+
+def test_fail_fast():
+    start = time.monotonic()
+    results = _cmd().run_parallel([
+        ["sh", "-c", "exit 1"],
+        ["sleep", "30"],
+    ], fail_fast=True)
+
+    assert time.monotonic() - start < 10
+    assert results[0].retval == 1
+    # cancelled
+    assert results[1].retval is None
+
+
+def test_timeout():
+    start = time.monotonic()
+    results = _cmd().run_parallel([["sleep", "30"], ["true"]], timeout=0.5)
+
+    assert time.monotonic() - start < 10
+    assert results[0].timed_out
+    assert results[0].retval != 0
+    assert not results[1].timed_out
+    assert results[1].retval == 0
+
+
+def _session_run(session, cmd, timeout=10):
+    output = []
+    return session.run(cmd, output.append, timeout=timeout), output
+
+
+@needs_root
+def test_session_output():
+    session = ChrootSession("/", dict(os.environ))
+    try:
+        assert _session_run(session, "echo one; echo; printf two") == (0, ["one", "", "two"])
+        assert _session_run(session, "echo one; exit 3") == (3, ["one"])
+        # each command runs in a subshell
+        assert _session_run(session, "cd /tmp; X=1")[0] == 0
+        assert _session_run(session, 'test "$PWD" = / && test -z "$X"')[0] == 0
+    finally:
+        session.close()
+
+
+@needs_root
+@pytest.mark.parametrize("cmd", ["echo 'unterminated", "cat <<EOF\nno end", "if true; then"])
+def test_session_syntax_error(cmd):
+    session = ChrootSession("/", dict(os.environ))
+    try:
+        # fails (or warns) like 'bash -c'
+        retval, _ = _session_run(session, cmd)
+        assert retval == subprocess.call(["bash", "-c", cmd], stderr=subprocess.DEVNULL)
+        # the shell does not wait for the rest of the command
+        assert _session_run(session, "echo ok") == (0, ["ok"])
+    finally:
+        session.close()
+
+
+@needs_root
+def test_session_timeout():
+    session = ChrootSession("/", dict(os.environ))
+    start = time.monotonic()
+    with pytest.raises(ChrootSessionError):
+        _session_run(session, "sleep 30", timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert not session.alive()
+    session.close()
+
+
+@needs_root
+def test_session_environment(monkeypatch):
+    cmd = _cmd()
+    try:
+        monkeypatch.setenv("POI_TEST_VAR", "one")
+        assert cmd.run_in_chroot("/", 'test "$POI_TEST_VAR" = one') == 0
+        # like after a command run with 'update_env'
+        monkeypatch.setenv("POI_TEST_VAR", "two")
+        assert cmd.run_in_chroot("/", 'test "$POI_TEST_VAR" = two') == 0
+        cmd.chroot_env = {'POI_TEST_VAR': "three"}
+        assert cmd.run_in_chroot("/", 'test "$POI_TEST_VAR" = three') == 0
+        assert len(cmd.chroot_sessions) == 1
+    finally:
+        cmd.close_chroot_sessions()
@@ -0,0 +1,121 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Package lock files: package specs, loading and comparing locks."""
+
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import lockfile  # noqa: E402
+from installer import Installer  # noqa: E402
+
+
+def _pkg(name, version, release="1.ph5", epoch=0, arch="x86_64", checksum=None):
+    pkg = {'name': name, 'epoch': epoch, 'version': version, 'release': release, 'arch': arch}
+    if checksum is not None:
+        pkg['checksum'] = {'type': "sha256header", 'value': checksum}
+    return pkg
+
+
+def test_package_spec():
+    assert lockfile.package_spec(_pkg("bash", "5.2")) == "bash=5.2-1.ph5"
+    assert lockfile.package_spec(_pkg("openssl", "3.0.9", epoch=1)) == "openssl=1:3.0.9-1.ph5"
+
+
+def test_save_load(tmp_path):
+    filename = os.path.join(tmp_path, "lock.json")
+    packages = [_pkg("openssl", "3.0.9"), _pkg("bash", "5.2")]
+    lockfile.save(filename, packages, releasever="5.0", arch="x86_64")
+
+    lock = lockfile.load(filename)
+    assert lock['releasever'] == "5.0"
+    assert [p['name'] for p in lock['packages']] == ["bash", "openssl"]
+
+
+@pytest.mark.parametrize("content", [
+    [],
+    {'version': 2, 'packages': []},
+    {'version': 1, 'packages': [{'name': "bash", 'version': "5.2", 'release': "1.ph5"}]},
+])
+def test_load_invalid(tmp_path, content):
+    filename = os.path.join(tmp_path, "lock.json")
+    with open(filename, "wt") as f:
+        json.dump(content, f)
+    with pytest.raises(lockfile.LockfileError):
+        lockfile.load(filename)
+
+
+def test_compare_match():
+    expected = [_pkg("bash", "5.2", checksum="aa"), _pkg("filesystem", "1.1", arch="noarch")]
+    actual = [_pkg("bash", "5.2", checksum="aa"), _pkg("filesystem", "1.1", arch="noarch")]
+    assert lockfile.compare(expected, actual) == ([], [])
+
+
+def test_compare_mismatches():
+    expected = [
+        _pkg("bash", "5.2"),
+        _pkg("curl", "8.1"),
+        _pkg("openssl", "3.0.9", checksum="aa"),
+        _pkg("zlib", "1.3", arch="noarch"),
+    ]
+    actual = [
+        _pkg("bash", "5.3"),
+        _pkg("openssl", "3.0.9", checksum="bb"),
+        _pkg("zlib", "1.3"),
+        _pkg("vim", "9.0"),
+    ]
+
+    mismatches, extra = lockfile.compare(expected, actual)
+
+    assert mismatches == [
+        ("bash", "5.2-1.ph5", "5.3-1.ph5"),
+        ("curl", "8.1-1.ph5", None),
+        ("openssl", "3.0.9-1.ph5 (aa)", "3.0.9-1.ph5 (bb)"),
+        # a different arch is a different package
+        ("zlib", "1.3-1.ph5", None),
+    ]
+    assert extra == ["vim", "zlib"]
+
+
+def test_compare_without_checksum():
+    # locks without checksums only compare versions
+    assert lockfile.compare([_pkg("bash", "5.2")], [_pkg("bash", "5.2", checksum="aa")]) == ([], [])
+
+
+class _Cmd(object):
+    def __init__(self):
+        self.commands = []
+
+    def run_in_chroot(self, chroot_path, cmd, update_env=False):
+        self.commands.append(cmd)
+        return 0
+
+
+def test_replay_selinux_label(tmp_path):
+    filename = os.path.join(tmp_path, "lock.json")
+    lockfile.save(filename, [_pkg("selinux-policy", "38.1", arch="noarch"), _pkg("bash", "5.2")],
+                  releasever="5.0", arch="x86_64")
+
+    # only the parts of the installer that replay the lock and label
+    inst = Installer.__new__(Installer)
+    inst.logger = logging.getLogger()
+    inst.cwd = str(tmp_path)
+    inst.photon_release_version = "5.0"
+    inst.photon_root = "/nonexistent"
+    inst.cmd = _Cmd()
+    install_config = {'lockfile': filename, 'arch': "x86_64"}
+    install_config['packages'] = inst._get_locked_packages(install_config, ["selinux-policy", "bash"])
+    inst.install_config = install_config
+
+    assert "selinux-policy=38.1-1.ph5" in install_config['packages']
+    inst._selinux_label()
+    assert len(inst.cmd.commands) == 1
+    assert "setfiles" in inst.cmd.commands[0]
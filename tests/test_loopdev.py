@@ -0,0 +1,121 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Loop devices: the ioctl structs, the losetup fallback and detaching."""
+
+import logging
+import os
+import struct
+import subprocess
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import loopdev  # noqa: E402
+
+
+def test_loop_info64():
+    # sizeof(struct loop_info64) in linux/loop.h
+    assert struct.calcsize(loopdev.LOOP_INFO64) == 232
+
+    info = loopdev._loop_info64("/images/disk.img", loopdev.LO_FLAGS_PARTSCAN)
+    assert len(info) == 232
+    # lo_flags follows five u64 and three u32
+    assert struct.unpack_from("I", info, 52) == (loopdev.LO_FLAGS_PARTSCAN,)
+    assert info[56:56 + 64].rstrip(b"\0") == b"/images/disk.img"
+
+
+def test_loop_info64_long_name():
+    # the name is cut so it stays NUL terminated
+    info = loopdev._loop_info64("/" + "a" * 100, 0)
+    assert info[56:56 + 64] == b"/" + b"a" * 62 + b"\0"
+
+
+def test_loop_config():
+    config = loopdev._loop_config(7, 4096, "/images/disk.img", loopdev.LO_FLAGS_PARTSCAN)
+    # sizeof(struct loop_config): fd, block_size, loop_info64, 8 reserved u64
+    assert len(config) == 304
+    assert struct.unpack_from("II", config, 0) == (7, 4096)
+    assert config[8:8 + 232] == loopdev._loop_info64("/images/disk.img", loopdev.LO_FLAGS_PARTSCAN)
+    assert config[240:] == bytes(64)
+
+
+def _no_ioctls(monkeypatch):
+    def _attach_ioctl(filename, sector_size, flags, read_only):
+        raise OSError(1, "Operation not permitted")
+    monkeypatch.setattr(loopdev, "_attach_ioctl", _attach_ioctl)
+
+
+@pytest.mark.parametrize("partscan, read_only, args", [
+    (True, False, ["-P"]),
+    (False, True, ["-r"]),
+])
+def test_attach_losetup(monkeypatch, partscan, read_only, args):
+    _no_ioctls(monkeypatch)
+    commands = []
+
+    def _check_output(cmd, text=False):
+        commands.append(cmd)
+        return "/dev/loop7\n"
+    monkeypatch.setattr(subprocess, "check_output", _check_output)
+
+    device = loopdev.attach("/disk.img", sector_size=4096, partscan=partscan, read_only=read_only,
+                            logger=logging.getLogger())
+
+    assert device == "/dev/loop7"
+    assert commands == [["losetup", "--show", "-f", "--sector-size", "4096"] + args + ["/disk.img"]]
+
+
+def test_attach_losetup_fails(monkeypatch):
+    _no_ioctls(monkeypatch)
+
+    def _check_output(cmd, text=False):
+        raise subprocess.CalledProcessError(1, cmd)
+    monkeypatch.setattr(subprocess, "check_output", _check_output)
+
+    with pytest.raises(loopdev.LoopDeviceError):
+        loopdev.attach("/disk.img")
+
+
+def test_detach_losetup(monkeypatch, tmp_path):
+    # a file is not a loop device, the ioctl fails
+    device = os.path.join(tmp_path, "loop7")
+    with open(device, "wt") as f:
+        f.write("")
+    commands = []
+    monkeypatch.setattr(subprocess, "check_call", lambda cmd: commands.append(cmd))
+
+    loopdev.detach(device)
+
+    assert commands == [["losetup", "-d", device]]
+
+
+def test_registry_detach_all(monkeypatch):
+    attached = iter(["/dev/loop1", "/dev/loop2", "/dev/loop3"])
+    monkeypatch.setattr(loopdev, "attach", lambda filename, **kwargs: next(attached))
+    detached = []
+
+    def _detach(device, logger=None):
+        detached.append(device)
+        if device == "/dev/loop2":
+            raise loopdev.LoopDeviceError(f"failed to detach {device}")
+    monkeypatch.setattr(loopdev, "detach", _detach)
+
+    registry = loopdev.LoopRegistry(logging.getLogger())
+    for filename in ["a.img", "b.img", "c.img"]:
+        registry.attach(filename)
+    registry.detach("/dev/loop1")
+    # not attached by us
+    registry.detach("/dev/loop9")
+
+    # reverse order, and an error does not stop the others
+    registry.detach_all()
+    assert detached == ["/dev/loop1", "/dev/loop3", "/dev/loop2"]
+    assert registry.devices == []
+
+    registry.detach_all()
+    assert len(detached) == 3
@@ -0,0 +1,141 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""LVM: reading 'lvm fullreport', and creating volume groups in one lvm
+shell with fallbacks."""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from lvm import Lvm, LvmError, LvmState  # noqa: E402
+
+PV = "/dev/sda3"
+VG = "vg_root_0"
+LVS = [("root", 4096), ("home", 0)]
+
+
+def _report(vgs=None, orphans=None):
+    """
+    'lvm fullreport --reportformat json' output: one entry for each VG, with
+    its PVs and LVs, and one for the PVs without a VG
+    """
+    report = []
+    for vg_name, (pvs, lvs) in (vgs or {}).items():
+        report.append({
+            'vg': [{'vg_name': vg_name}],
+            'pv': [{'pv_name': pv} for pv in pvs],
+            'lv': [{'lv_name': lv} for lv in lvs],
+            'pvseg': [],
+            'seg': [],
+        })
+    if orphans:
+        report.append({'vg': [], 'pv': [{'pv_name': pv} for pv in orphans], 'lv': [], 'pvseg': [], 'seg': []})
+    return {'report': report}
+
+
+class _Lvm(object):
+    """
+    Replaces subprocess.run: returns the reports in turn for 'lvm fullreport',
+    and records all other commands
+    """
+
+    def __init__(self, reports, failing=None):
+        self.reports = list(reports)
+        self.failing = failing or []
+        self.commands = []
+        self.batches = []
+
+    def __call__(self, cmd, input=None, **kwargs):
+        if cmd[:2] == ["lvm", "fullreport"]:
+            return subprocess.CompletedProcess(cmd, 0, stdout=json.dumps(self.reports.pop(0)), stderr="")
+        if cmd == ["lvm"]:
+            self.batches.append(input.splitlines())
+            return subprocess.CompletedProcess(cmd, 0, stdout="", stderr=None)
+        self.commands.append(cmd[1:])
+        retval = 5 if cmd[1] in self.failing else 0
+        return subprocess.CompletedProcess(cmd, retval, stdout="", stderr=None)
+
+
+def _create_vg(monkeypatch, reports, failing=None):
+    fake = _Lvm(reports, failing=failing)
+    monkeypatch.setattr(subprocess, "run", fake)
+    Lvm(logging.getLogger()).create_vg(VG, PV, LVS)
+    assert fake.reports == []
+    return fake
+
+
+def test_state():
+    state = LvmState(_report({VG: ([PV], ["root", "home"]), "other": (["/dev/sdb1"], [])}, orphans=["/dev/sdc1"]))
+    assert state.pvs == {PV: VG, "/dev/sdb1": "other", "/dev/sdc1": ""}
+    assert state.vgs == {VG: {"root", "home"}, "other": set()}
+    assert state.has_lv(VG, "root")
+    assert not state.has_lv("other", "root")
+    assert not state.has_lv("missing", "root")
+
+
+def test_report_fails(monkeypatch):
+    monkeypatch.setattr(subprocess, "run",
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 5, stdout="", stderr="no lvm"))
+    state = Lvm(logging.getLogger()).report()
+    assert state.pvs == {} and state.vgs == {}
+
+
+def test_create_vg(monkeypatch):
+    fake = _create_vg(monkeypatch, [_report(), _report({VG: ([PV], ["root", "home"])})])
+
+    assert fake.batches == [[
+        f"pvcreate -ff -y {PV}",
+        f"vgcreate {VG} {PV}",
+        f"lvcreate -y --zero n -L 4096M -n root {VG}",
+        f"lvcreate -y --zero n -l 100%FREE -n home {VG}",
+        "exit",
+    ]]
+    # everything was done in the shell
+    assert fake.commands == []
+
+
+def test_create_vg_partial(monkeypatch):
+    # the shell stopped after the first LV
+    fake = _create_vg(monkeypatch, [_report(), _report({VG: ([PV], ["root"])})])
+
+    assert len(fake.batches) == 1
+    assert fake.commands == [["lvcreate", "-y", "--zero", "n", "-l", "100%FREE", "-n", "home", VG]]
+
+
+def test_create_vg_nothing_done(monkeypatch):
+    fake = _create_vg(monkeypatch, [_report(), _report(orphans=["/dev/sdc1"])])
+
+    assert [c[0] for c in fake.commands] == ["pvcreate", "vgcreate", "lvcreate", "lvcreate"]
+
+
+def test_create_vg_fails(monkeypatch):
+    # the single command gives the error
+    with pytest.raises(LvmError):
+        _create_vg(monkeypatch, [_report(), _report({VG: ([PV], [])})], failing=["lvcreate"])
+
+
+def test_create_vg_existing(monkeypatch):
+    # left over from a previous installation
+    fake = _create_vg(monkeypatch, [_report({VG: ([PV], ["root"])}), _report({VG: ([PV], ["root", "home"])})])
+
+    assert fake.commands == [["vgremove", "-f", VG]]
+    assert len(fake.batches) == 1
+    assert fake.batches[0][0] == f"pvcreate -ff -y {PV}"
+
+
+def test_create_vg_existing_remove_fails(monkeypatch):
+    # the error is logged, the shell runs anyway
+    fake = _create_vg(monkeypatch, [_report({VG: ([PV], ["root"])}), _report({VG: ([PV], ["root", "home"])})],
+                      failing=["vgremove"])
+
+    assert fake.commands == [["vgremove", "-f", VG]]
+    assert len(fake.batches) == 1
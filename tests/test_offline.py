@@ -0,0 +1,96 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Offline build mode: mkfs commands and copying filesystems into images."""
+
+import os
+import re
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import offline  # noqa: E402
+
+UUID = "0b56138b-6124-4ec4-a7a3-7c503516a65c"
+
+
+def test_mkfs_ext4():
+    assert offline.mkfs_commands("ext4", "/src", "/fs.img", uuid=UUID, label="root",
+                                 mkfs_options=["^metadata_csum", "64bit"]) == [
+        ["mkfs", "-t", "ext4", "-F", "-d", "/src", "-O", "^metadata_csum,64bit", "-U", UUID, "-L", "root", "/fs.img"],
+    ]
+    assert offline.mkfs_commands("ext2", "/src", "/fs.img") == [["mkfs", "-t", "ext2", "-F", "-d", "/src", "/fs.img"]]
+
+
+def test_mkfs_btrfs():
+    assert offline.mkfs_commands("btrfs", "/src", "/fs.img", uuid=UUID) == [
+        ["mkfs.btrfs", "-f", "--rootdir", "/src", "-U", UUID, "/fs.img"],
+    ]
+
+
+def test_mkfs_vfat(tmp_path):
+    src = os.path.join(tmp_path, "esp")
+    os.makedirs(os.path.join(src, "EFI"))
+    with open(os.path.join(src, "startup.nsh"), "wt") as f:
+        f.write("")
+
+    commands = offline.mkfs_commands("vfat", src, "/esp.img", uuid="1234ABCD", label="ESP")
+
+    assert commands == [
+        ["mkfs.vfat", "-i", "1234ABCD", "-n", "ESP", "/esp.img"],
+        ["mcopy", "-i", "/esp.img", "-s", "-p", "-m", "-Q",
+         os.path.join(src, "EFI"), os.path.join(src, "startup.nsh"), "::/"],
+    ]
+
+
+def test_mkfs_vfat_empty(tmp_path):
+    # nothing to copy
+    assert offline.mkfs_commands("vfat", str(tmp_path), "/esp.img") == [["mkfs.vfat", "/esp.img"]]
+
+
+def test_mkfs_others():
+    assert offline.mkfs_commands("swap", "/src", "/swap.img", uuid=UUID) == [["mkswap", "-U", UUID, "/swap.img"]]
+    assert offline.mkfs_commands("squashfs", "/src", "/fs.img") == [
+        ["mksquashfs", "/src", "/fs.img", "-noappend", "-comp", "gzip"],
+    ]
+    # erofs takes the image before the source
+    assert offline.mkfs_commands("erofs", "/src", "/fs.img", label="usr") == [["mkfs.erofs", "-L", "usr", "/fs.img", "/src"]]
+
+
+def test_mkfs_unsupported():
+    with pytest.raises(offline.OfflineBuildError):
+        offline.mkfs_commands("xfs", "/src", "/fs.img")
+
+
+def test_vfat_volume_id():
+    volume_id, uuid = offline.vfat_volume_id()
+    assert re.fullmatch("[0-9A-F]{8}", volume_id)
+    assert uuid == f"{volume_id[:4]}-{volume_id[4:]}"
+
+
+def test_copy_into(tmp_path):
+    src = os.path.join(tmp_path, "fs.img")
+    dst = os.path.join(tmp_path, "disk.img")
+    with open(src, "wb") as f:
+        f.write(b"a" * 4096)
+        f.seek(1024 * 1024)
+        f.write(b"b" * 4096)
+    with open(dst, "wb") as f:
+        f.truncate(4 * 1024 * 1024)
+
+    offline.copy_into(src, dst, 1024 * 1024, 2 * 1024 * 1024)
+
+    with open(dst, "rb") as f:
+        data = f.read()
+    assert data[:1024 * 1024] == bytes(1024 * 1024)
+    assert data[1024 * 1024:1024 * 1024 + 4096] == b"a" * 4096
+    assert data[1024 * 1024 + 4096:2 * 1024 * 1024] == bytes(1024 * 1024 - 4096)
+    assert data[2 * 1024 * 1024:2 * 1024 * 1024 + 4096] == b"b" * 4096
+    assert os.path.getsize(dst) == 4 * 1024 * 1024
+
+    with pytest.raises(offline.OfflineBuildError):
+        offline.copy_into(src, dst, 0, 1024 * 1024)
@@ -0,0 +1,155 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Partition layout and the GPT/MBR tables written to image files.
+
+The tables are written to sparse files and read back with struct, so the
+headers, checksums and entries can be checked without root or sgdisk.
+"""
+
+import os
+import struct
+import sys
+import uuid
+import zlib
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import partitiontable  # noqa: E402
+from partitiontable import Partition, PartitionTableError  # noqa: E402
+
+MB = 1024 * 1024
+SECTOR = 512
+DISK_SIZE = 64 * MB
+ENTRIES_SECTORS = 128 * 128 // SECTOR
+
+
+def _image(tmp_path, size=DISK_SIZE):
+    filename = os.path.join(tmp_path, "disk.img")
+    with open(filename, "wb") as f:
+        f.truncate(size)
+    return filename
+
+
+def _read(filename, offset, size):
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _partitions():
+    return [
+        Partition(1, 0, "8300", "root"),
+        Partition(2, 8, "ef00", "esp"),
+        Partition(3, 4, "8200", "swap"),
+    ]
+
+
+def test_layout():
+    partitions = partitiontable.layout(_partitions(), DISK_SIZE)
+    root, esp, swap = partitions
+
+    # aligned to 1 MiB, in the order of their numbers, the extensible
+    # partition last up to the end of the usable space
+    assert esp.first_lba == MB // SECTOR
+    assert esp.last_lba == esp.first_lba + 8 * MB // SECTOR - 1
+    assert swap.first_lba == esp.last_lba + 1
+    assert swap.last_lba == swap.first_lba + 4 * MB // SECTOR - 1
+    assert root.first_lba == swap.last_lba + 1
+    assert root.last_lba == DISK_SIZE // SECTOR - 2 - ENTRIES_SECTORS
+    for p in partitions:
+        assert p.first_lba * SECTOR % MB == 0
+
+
+def test_layout_errors():
+    with pytest.raises(PartitionTableError):
+        partitiontable.layout([Partition(1, 0, "8300"), Partition(2, 0, "8300")], DISK_SIZE)
+    with pytest.raises(PartitionTableError):
+        partitiontable.layout([Partition(1, 64, "8300")], DISK_SIZE)
+
+
+def test_is_supported():
+    assert partitiontable.is_supported("8300")
+    assert partitiontable.is_supported("0FC63DAF-8483-4772-8E79-3D69D8477DE4")
+    assert not partitiontable.is_supported("1234")
+    assert partitiontable.is_supported("1234", "msdos")
+    assert not partitiontable.is_supported("0FC63DAF-8483-4772-8E79-3D69D8477DE4", "msdos")
+
+
+def _check_header(data, current_lba, backup_lba, entries_lba, entries):
+    header = struct.unpack(partitiontable.GPT_HEADER_FORMAT, data[:92])
+    signature, revision, size, crc, _, current, backup, first_usable, last_usable, _, entries_start, num, entry_size, entries_crc = header
+    assert signature == b"EFI PART"
+    assert revision == 0x00010000
+    assert size == 92
+    assert zlib.crc32(data[:16] + bytes(4) + data[20:92]) == crc
+    assert (current, backup, entries_start) == (current_lba, backup_lba, entries_lba)
+    assert (first_usable, last_usable) == partitiontable.usable_range(DISK_SIZE, SECTOR)
+    assert (num, entry_size) == (128, 128)
+    assert zlib.crc32(entries) == entries_crc
+
+
+def test_gpt(tmp_path):
+    filename = _image(tmp_path)
+    partitions, reread = partitiontable.write(filename, _partitions())
+    assert not reread
+
+    mbr = _read(filename, 0, SECTOR)
+    assert mbr[510:512] == b"\x55\xaa"
+    assert mbr[446 + 4] == 0xEE
+
+    last_lba = DISK_SIZE // SECTOR - 1
+    entries = _read(filename, 2 * SECTOR, ENTRIES_SECTORS * SECTOR)
+    _check_header(_read(filename, SECTOR, SECTOR), 1, last_lba, 2, entries)
+    backup_entries_lba = last_lba - ENTRIES_SECTORS
+    assert _read(filename, backup_entries_lba * SECTOR, ENTRIES_SECTORS * SECTOR) == entries
+    _check_header(_read(filename, last_lba * SECTOR, SECTOR), last_lba, 1, backup_entries_lba, entries)
+
+    for p in partitions:
+        entry = entries[(p.number - 1) * 128:p.number * 128]
+        type_guid, part_guid, first_lba, last_lba, _, name = struct.unpack(partitiontable.GPT_ENTRY_FORMAT, entry)
+        assert str(uuid.UUID(bytes_le=type_guid)).upper() == p.type_guid()
+        assert str(uuid.UUID(bytes_le=part_guid)) == p.uuid
+        assert (first_lba, last_lba) == (p.first_lba, p.last_lba)
+        assert name.decode("utf-16-le").rstrip("\0") == p.name
+    # unused entries are empty
+    assert entries[3 * 128:] == bytes(125 * 128)
+
+
+def test_mbr(tmp_path):
+    filename = _image(tmp_path)
+    # a GPT is replaced
+    partitiontable.write(filename, _partitions())
+    partitions, _ = partitiontable.write(filename, [Partition(1, 8, "ef00"), Partition(2, 0, "8300")], table_type="msdos")
+
+    mbr = _read(filename, 0, SECTOR)
+    assert mbr[510:512] == b"\x55\xaa"
+    signature = struct.unpack("<I", mbr[440:444])[0]
+    for p in partitions:
+        entry = mbr[446 + 16 * (p.number - 1):446 + 16 * p.number]
+        _, _, mbr_type, _, first_lba, sectors = struct.unpack("<B3sB3sII", entry)
+        assert mbr_type == int(p.type_code, 16) >> 8
+        assert (first_lba, sectors) == (p.first_lba, p.last_lba - p.first_lba + 1)
+        assert p.uuid == f"{signature:08x}-{p.number:02x}"
+    assert _read(filename, SECTOR, 8) == bytes(8)
+    assert _read(filename, DISK_SIZE - SECTOR, 8) == bytes(8)
+
+
+def test_mbr_errors(tmp_path):
+    filename = _image(tmp_path)
+    with pytest.raises(PartitionTableError):
+        partitiontable.write(filename, [Partition(n, 1, "8300") for n in range(1, 6)], table_type="msdos")
+    with pytest.raises(PartitionTableError):
+        partitiontable.write(filename, [Partition(1, 1, "0FC63DAF-8483-4772-8E79-3D69D8477DE4")], table_type="msdos")
+
+
+def test_zap(tmp_path):
+    filename = _image(tmp_path)
+    partitiontable.write(filename, _partitions())
+    partitiontable.zap(filename)
+    assert _read(filename, 0, (2 + ENTRIES_SECTORS) * SECTOR) == bytes((2 + ENTRIES_SECTORS) * SECTOR)
+    assert _read(filename, DISK_SIZE - (1 + ENTRIES_SECTORS) * SECTOR, (1 + ENTRIES_SECTORS) * SECTOR) == bytes((1 + ENTRIES_SECTORS) * SECTOR)
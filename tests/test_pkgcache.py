@@ -0,0 +1,154 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Package cache: repo keys, storing and restoring packages, and eviction."""
+
+import hashlib
+import logging
+import os
+import sys
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from installer import Installer  # noqa: E402
+from pkgcache import PackageCache  # noqa: E402
+
+BASEURL = "https://packages.example.com/photon/5.0/photon_release_5.0_x86_64"
+
+
+def _cache(tmp_path, max_size=1024 * 1024):
+    return PackageCache(os.path.join(tmp_path, "cache"), max_size, logging.getLogger())
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _download(tdnf_cache_dir, packages, repo_id="photon"):
+    # what tdnf leaves in its cache directory
+    for relpath, content in packages.items():
+        _write(os.path.join(tdnf_cache_dir, repo_id, "rpms", relpath), content)
+
+
+def _checksums(packages, checksum_type="sha256"):
+    return {relpath: (checksum_type, hashlib.new(checksum_type, content).hexdigest())
+            for relpath, content in packages.items()}
+
+
+def test_repo_key():
+    assert PackageCache.repo_key(BASEURL) == PackageCache.repo_key(BASEURL + "/")
+    assert PackageCache.repo_key(BASEURL) != PackageCache.repo_key(BASEURL.replace("x86_64", "aarch64"))
+    assert len(PackageCache.repo_key(BASEURL)) == 16
+
+
+def test_store_restore(tmp_path):
+    cache = _cache(tmp_path)
+    packages = {"x86_64/bash-5.2-1.ph5.x86_64.rpm": b"bash", "noarch/filesystem-1.1-1.ph5.noarch.rpm": b"fs"}
+    first = os.path.join(tmp_path, "first")
+    _download(first, packages)
+    # not a package
+    _write(os.path.join(first, "photon", "rpms", "x86_64", "bash.rpm.part"), b"ba")
+
+    downloaded = cache.store({'photon': BASEURL}, first, {})
+    assert sorted(os.path.relpath(p, first) for p in downloaded) == [
+        "photon/rpms/noarch/filesystem-1.1-1.ph5.noarch.rpm",
+        "photon/rpms/x86_64/bash-5.2-1.ph5.x86_64.rpm",
+    ]
+
+    second = os.path.join(tmp_path, "second")
+    restored = cache.restore({'photon': BASEURL}, second, {'photon': _checksums(packages)})
+    assert len(restored) == 2
+    for relpath, content in packages.items():
+        path = os.path.join(second, "photon", "rpms", relpath)
+        with open(path, "rb") as f:
+            assert f.read() == content
+        assert restored[path] == len(content)
+
+    # restored packages are not stored again
+    assert cache.store({'photon': BASEURL}, second, restored) == {}
+
+
+def test_restore_other_checksum_types(tmp_path):
+    cache = _cache(tmp_path)
+    packages = {"x86_64/bash-5.2-1.ph5.x86_64.rpm": b"bash"}
+    _download(os.path.join(tmp_path, "first"), packages)
+    cache.store({'photon': BASEURL}, os.path.join(tmp_path, "first"), {})
+
+    restored = cache.restore({'photon': BASEURL}, os.path.join(tmp_path, "second"),
+                             {'photon': _checksums(packages, "sha512")})
+    assert len(restored) == 1
+
+
+def test_restore_stale(tmp_path):
+    cache = _cache(tmp_path)
+    packages = {
+        "x86_64/bash-5.2-1.ph5.x86_64.rpm": b"bash",
+        "x86_64/curl-8.1-1.ph5.x86_64.rpm": b"curl",
+        "x86_64/vim-9.0-1.ph5.x86_64.rpm": b"vim",
+    }
+    _download(os.path.join(tmp_path, "first"), packages)
+    cache.store({'photon': BASEURL}, os.path.join(tmp_path, "first"), {})
+
+    checksums = _checksums(packages)
+    # rebuilt with the same name
+    checksums["x86_64/bash-5.2-1.ph5.x86_64.rpm"] = ("sha256", hashlib.sha256(b"rebuilt").hexdigest())
+    # removed from the repo
+    del checksums["x86_64/curl-8.1-1.ph5.x86_64.rpm"]
+
+    second = os.path.join(tmp_path, "second")
+    restored = cache.restore({'photon': BASEURL}, second, {'photon': checksums})
+    assert list(restored) == [os.path.join(second, "photon", "rpms", "x86_64/vim-9.0-1.ph5.x86_64.rpm")]
+
+    # nothing is restored without metadata
+    assert cache.restore({'photon': BASEURL}, os.path.join(tmp_path, "third"), {}) == {}
+
+
+def test_restore_other_repo(tmp_path):
+    # the index is per base url
+    cache = _cache(tmp_path)
+    packages = {"x86_64/bash-5.2-1.ph5.x86_64.rpm": b"bash"}
+    _download(os.path.join(tmp_path, "first"), packages)
+    cache.store({'photon': BASEURL}, os.path.join(tmp_path, "first"), {})
+
+    other = BASEURL.replace("5.0", "6.0")
+    assert cache.restore({'photon': other}, os.path.join(tmp_path, "second"), {'photon': _checksums(packages)}) == {}
+
+
+def test_evict(tmp_path):
+    cache = _cache(tmp_path, max_size=8)
+    old = {"x86_64/old-1-1.ph5.x86_64.rpm": b"old-pkg"}
+    new = {"x86_64/new-1-1.ph5.x86_64.rpm": b"new-pkg"}
+    _download(os.path.join(tmp_path, "first"), old)
+    cache.store({'photon': BASEURL}, os.path.join(tmp_path, "first"), {})
+    obj = cache._object_path(hashlib.sha256(b"old-pkg").hexdigest())
+    os.utime(obj, (1, 1))
+
+    # the least recently used package goes when the cache grows too large
+    _download(os.path.join(tmp_path, "second"), new)
+    cache.store({'photon': BASEURL}, os.path.join(tmp_path, "second"), {})
+    assert not os.path.exists(obj)
+    assert list(cache._load_index(BASEURL)['packages']) == list(new)
+
+    checksums = {'photon': {**_checksums(old), **_checksums(new)}}
+    restored = cache.restore({'photon': BASEURL}, os.path.join(tmp_path, "third"), checksums)
+    assert [os.path.basename(p) for p in restored] == ["new-1-1.ph5.x86_64.rpm"]
+
+
+def test_installer_repos():
+    inst = Installer.__new__(Installer)
+    inst.photon_release_version = "5.0"
+    inst.install_config = {
+        'arch': "aarch64",
+        'repos': {
+            'photon': {'baseurl': "https://packages.example.com/photon/$releasever/photon_release_$releasever_$basearch"},
+            'disabled': {'baseurl': "https://packages.example.com/disabled", 'enabled': 0},
+            'local': {'baseurl': "file:///repo"},
+        },
+    }
+    assert inst._get_package_cache_repos() == {
+        'photon': "https://packages.example.com/photon/5.0/photon_release_5.0_aarch64",
+    }
@@ -0,0 +1,105 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Rootfs cache: keys, storing and restoring snapshots, and eviction."""
+
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from rootfscache import RootfsCache  # noqa: E402
+
+INPUTS = {
+    'packages': ["bash", "minimal"],
+    'repos': {'photon': "aa"},
+    'arch': "x86_64",
+    'releasever': "5.0",
+}
+
+
+def _cache(tmp_path, max_size=1024 * 1024 * 1024):
+    return RootfsCache(os.path.join(tmp_path, "cache"), max_size, logging.getLogger())
+
+
+def _write(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wt") as f:
+        f.write(content)
+
+
+def _root(tmp_path, name="root"):
+    root = os.path.join(tmp_path, name)
+    _write(os.path.join(root, "etc/os-release"), "NAME=Photon\n")
+    _write(os.path.join(root, "usr/bin/bash"), "bash")
+    os.chmod(os.path.join(root, "usr/bin/bash"), 0o755)
+    os.symlink("usr/bin", os.path.join(root, "bin"))
+    return root
+
+
+def test_key():
+    assert RootfsCache.key(INPUTS) == RootfsCache.key(dict(reversed(list(INPUTS.items()))))
+    assert RootfsCache.key(INPUTS) != RootfsCache.key({**INPUTS, 'arch': "aarch64"})
+    assert RootfsCache.key(INPUTS) != RootfsCache.key({**INPUTS, 'packages': ["bash", "minimal", "vim"]})
+
+
+def test_store_restore(tmp_path):
+    cache = _cache(tmp_path)
+    key = RootfsCache.key(INPUTS)
+    root = _root(tmp_path)
+    # not part of the installed tree
+    _write(os.path.join(root, "var/cache/tdnf/photon/rpms/bash.rpm"), "rpm")
+    _write(os.path.join(root, "tmp/scratch"), "tmp")
+    _write(os.path.join(root, "proc/1/status"), "proc")
+    _write(os.path.join(root, "mnt/build/src"), "bind mount")
+    _write(os.path.join(root, "var/cache/other/file"), "kept")
+
+    assert not cache.restore(key, os.path.join(tmp_path, "empty"))
+    cache.store(key, root, exclude=["/mnt/build"])
+    assert [f for f in os.listdir(cache.cache_dir) if f.startswith(".tmp-")] == []
+
+    target = os.path.join(tmp_path, "target")
+    os.makedirs(target)
+    assert cache.restore(key, target)
+
+    with open(os.path.join(target, "etc/os-release")) as f:
+        assert f.read() == "NAME=Photon\n"
+    assert os.stat(os.path.join(target, "usr/bin/bash")).st_mode & 0o777 == 0o755
+    assert os.readlink(os.path.join(target, "bin")) == "usr/bin"
+    assert os.path.exists(os.path.join(target, "var/cache/other/file"))
+    for d in ["var/cache/tdnf", "tmp", "proc", "mnt/build"]:
+        assert not os.path.exists(os.path.join(target, d))
+
+
+def test_store_fails(tmp_path):
+    cache = _cache(tmp_path)
+    with pytest.raises(subprocess.CalledProcessError):
+        cache.store(RootfsCache.key(INPUTS), os.path.join(tmp_path, "missing"))
+    # no partial snapshot is left
+    assert [f for f in os.listdir(cache.cache_dir) if f != ".lock"] == []
+
+
+def test_evict(tmp_path):
+    cache = _cache(tmp_path)
+    root = _root(tmp_path)
+    keys = [RootfsCache.key({**INPUTS, 'packages': [name]}) for name in ["a", "b", "c"]]
+    for i, key in enumerate(keys):
+        cache.store(key, root)
+        os.utime(cache._find(key), (i + 1, i + 1))
+
+    # restoring marks a snapshot as recently used
+    target = os.path.join(tmp_path, "target")
+    os.makedirs(target)
+    assert cache.restore(keys[0], target)
+
+    # the least recently used snapshot goes first
+    total = sum(os.path.getsize(p) for p in cache._snapshots())
+    cache.max_size = total - 1
+    cache._evict()
+    assert [cache._find(key) is not None for key in keys] == [True, False, True]
@@ -0,0 +1,195 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Parallel package downloads against a local HTTP stand-in repo.
+
+The repo is served from memory by a small HTTP/1.1 server that supports
+range requests and counts connections, so resuming, checksum verification
+and connection reuse can be checked without tdnf or network access.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from rpmfetch import (RepoMetadata, RpmFetcher,  # noqa: E402
+                      fetch_transaction, read_repo_files)
+
+PACKAGES = [
+    # name, arch, epoch, version, release
+    ("bash", "x86_64", 0, "5.2", "1.ph5"),
+    ("filesystem", "noarch", 0, "1.1", "4.ph5"),
+    ("openssl", "x86_64", 1, "3.0.9", "2.ph5"),
+]
+
+
+def _location(name, arch, version, release):
+    return f"RPMS/{arch}/{name}-{version}-{release}.{arch}.rpm"
+
+
+def _make_repo():
+    files = {}
+    entries = []
+    for name, arch, epoch, version, release in PACKAGES:
+        content = os.urandom(200 * 1024)
+        location = _location(name, arch, version, release)
+        files["/" + location] = content
+        entries.append(f"""
+<package type="rpm">
+  <name>{name}</name>
+  <arch>{arch}</arch>
+  <version epoch="{epoch}" ver="{version}" rel="{release}"/>
+  <checksum type="sha256" pkgid="YES">{hashlib.sha256(content).hexdigest()}</checksum>
+  <size package="{len(content)}" installed="0" archive="0"/>
+  <location href="{location}"/>
+</package>""")
+
+    primary = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+               f'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{len(entries)}">'
+               + "".join(entries) + "\n</metadata>\n")
+    files["/repodata/primary.xml.gz"] = gzip.compress(primary.encode())
+    files["/repodata/repomd.xml"] = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<repomd xmlns="http://linux.duke.edu/metadata/repo">'
+        '<data type="primary"><location href="repodata/primary.xml.gz"/></data>'
+        '</repomd>\n').encode()
+    return files
+
+
+class _RepoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header is not None:
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def repo():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RepoHandler)
+    server.daemon_threads = True
+    server.files = _make_repo()
+    server.requests = []
+    server.connections = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def _solved():
+    install = []
+    for name, arch, epoch, version, release in PACKAGES:
+        evr = f"{epoch}:{version}-{release}" if epoch else f"{version}-{release}"
+        install.append({"Name": name, "Arch": arch, "Evr": evr, "Size": 0})
+    return {"Install": install}
+
+
+def _dest_path(tmp_path):
+    return lambda repo_id, package: os.path.join(tmp_path, repo_id, "rpms", package.location)
+
+
+def test_fetch_transaction(repo, tmp_path):
+    server, baseurl = repo
+    fetcher = RpmFetcher(logging.getLogger(), connections=2)
+
+    stats = fetch_transaction(fetcher, _solved(), {"photon": baseurl}, _dest_path(tmp_path))
+
+    assert stats['files'] == len(PACKAGES)
+    assert stats['failed'] == []
+    for name, arch, _, version, release in PACKAGES:
+        location = _location(name, arch, version, release)
+        with open(os.path.join(tmp_path, "photon", "rpms", location), "rb") as f:
+            assert f.read() == server.files["/" + location]
+    # connections are kept alive and reused, one for the metadata and one
+    # per worker
+    assert server.connections <= 3
+
+    # valid files are not downloaded again
+    stats = fetch_transaction(fetcher, _solved(), {"photon": baseurl}, _dest_path(tmp_path))
+    assert stats['files'] == 0
+
+
+def test_resume_partial_download(repo, tmp_path):
+    server, baseurl = repo
+    fetcher = RpmFetcher(logging.getLogger(), connections=1)
+    package = RepoMetadata.load(fetcher, baseurl).find("bash", "x86_64", "5.2-1.ph5")
+    content = server.files["/" + package.location]
+
+    dest = os.path.join(tmp_path, "bash.rpm")
+    with open(dest + ".part", "wb") as f:
+        f.write(content[:1000])
+
+    assert fetcher.fetch(package, dest) == len(content) - 1000
+    assert ("/" + package.location, "bytes=1000-") in server.requests
+    with open(dest, "rb") as f:
+        assert f.read() == content
+
+
+def test_checksum_mismatch(repo, tmp_path):
+    server, baseurl = repo
+    fetcher = RpmFetcher(logging.getLogger(), connections=1, retries=2)
+    package = RepoMetadata.load(fetcher, baseurl).find("openssl", "x86_64", "1:3.0.9-2.ph5")
+    server.files["/" + package.location] = os.urandom(package.size)
+
+    stats = fetcher.fetch_all([(package, os.path.join(tmp_path, "openssl.rpm"))])
+
+    assert stats['failed'] == [package]
+    assert not os.path.exists(os.path.join(tmp_path, "openssl.rpm"))
+
+
+def test_read_repo_files(tmp_path):
+    (tmp_path / "photon.repo").write_text(
+        "[photon]\n"
+        "baseurl=https://packages.example.com/photon/$releasever/photon_release_$releasever_$basearch\n"
+        "enabled=1\n"
+        "[photon-debuginfo]\n"
+        "baseurl=https://packages.example.com/photon/debuginfo\n"
+        "enabled=0\n"
+    )
+    assert read_repo_files(str(tmp_path), "5.0", "x86_64") == {
+        "photon": "https://packages.example.com/photon/5.0/photon_release_5.0_x86_64",
+    }
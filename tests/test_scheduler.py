@@ -0,0 +1,151 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Installation phase graph: checks, serial and parallel runs, and timing."""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+from installer import Installer  # noqa: E402
+from phasetimer import PhaseTimer  # noqa: E402
+from scheduler import Phase, PhaseScheduler, SchedulerError  # noqa: E402
+
+
+def _scheduler(phases, mode="serial", workers=None):
+    return PhaseScheduler(phases, PhaseTimer(), logging.getLogger(), mode=mode, workers=workers)
+
+
+def _noop():
+    pass
+
+
+@pytest.mark.parametrize("phases", [
+    # requires something no earlier phase provides
+    [Phase("a", _noop, requires=["x"]), Phase("b", _noop, provides=["x"])],
+    # provided twice
+    [Phase("a", _noop, provides=["x"]), Phase("b", _noop, provides=["x"])],
+    # duplicate name
+    [Phase("a", _noop), Phase("a", _noop)],
+])
+def test_check(phases):
+    with pytest.raises(SchedulerError):
+        _scheduler(phases)
+
+
+def test_unknown_mode():
+    with pytest.raises(SchedulerError):
+        _scheduler([], mode="random")
+
+
+def test_serial_order():
+    order = []
+    phases = [Phase(name, lambda name=name: order.append(name)) for name in "abc"]
+    _scheduler(phases).run()
+    assert order == ["a", "b", "c"]
+
+
+def test_parallel():
+    # b and c only finish if they run at the same time
+    barrier = threading.Barrier(2, timeout=10)
+    order = []
+    lock = threading.Lock()
+
+    def _phase(name, wait=False):
+        def _run():
+            if wait:
+                barrier.wait()
+            with lock:
+                order.append(name)
+        return _run
+
+    phases = [
+        Phase("a", _phase("a"), provides=["x"]),
+        Phase("b", _phase("b", wait=True), requires=["x"], provides=["y"]),
+        Phase("c", _phase("c", wait=True), requires=["x"], provides=["z"]),
+        Phase("d", _phase("d"), requires=["y", "z"]),
+    ]
+    scheduler = _scheduler(phases, mode="parallel", workers=2)
+    scheduler.run()
+
+    assert order[0] == "a"
+    assert sorted(order[1:3]) == ["b", "c"]
+    assert order[3] == "d"
+    report = scheduler.timer.report()
+    assert [p['name'] for p in report['phases']][0] == "a"
+    for p in report['phases']:
+        assert 'cpu_time' in p
+        # only known for phases that did not overlap with others
+        assert ('children_time' in p) == (p['name'] in ["a", "d"])
+
+
+def test_parallel_failure():
+    started = []
+
+    def _fail():
+        raise RuntimeError("failed")
+
+    phases = [
+        Phase("a", _fail, provides=["x"]),
+        Phase("b", lambda: started.append("b"), requires=["x"]),
+    ]
+    with pytest.raises(RuntimeError):
+        _scheduler(phases, mode="parallel", workers=2).run()
+    # phases that depend on a failed one never start
+    assert started == []
+
+
+def test_timer_steps():
+    timer = PhaseTimer()
+    with timer.phase("a"):
+        with timer.phase("step"):
+            assert timer.current_phase() == "step"
+            assert timer.active_phases() == ["step"]
+    with pytest.raises(ValueError):
+        with timer.phase("b"):
+            raise ValueError()
+
+    a, b = timer.report()['phases']
+    assert a['steps'][0]['name'] == "step"
+    assert 'children_time' in a
+    assert b['failed']
+
+
+def test_install_phases_parallel():
+    # the phases of the installation, with their work replaced by
+    # recording when they run
+    events = []
+    lock = threading.Lock()
+
+    def _record(name):
+        def _run():
+            with lock:
+                events.append(("start", name))
+            time.sleep(0.01)
+            with lock:
+                events.append(("end", name))
+        return _run
+
+    phases = Installer._install_phases(Installer.__new__(Installer))
+    for phase in phases:
+        phase.func = _record(phase.name)
+    _scheduler(phases, mode="parallel", workers=8).run()
+
+    def _before(first, second):
+        return events.index(("end", first)) < events.index(("start", second))
+
+    assert len(events) == 2 * len(phases)
+    # the rpm db is read after everything that may change it
+    assert _before("finalize_system", "write_lockfile")
+    assert _before("post-install", "write_lockfile")
+    # resolv.conf is copied before additional files may overwrite it
+    assert _before("setup_network", "enable_network_in_chroot")
+    assert _before("enable_network_in_chroot", "finalize_system")
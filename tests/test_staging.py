@@ -0,0 +1,59 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Copying a staged tree to the target filesystems."""
+
+import os
+import subprocess
+import sys
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import staging  # noqa: E402
+
+
+def _write(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wt") as f:
+        f.write(content)
+
+
+def test_is_below():
+    assert staging.is_below("boot", ".")
+    assert staging.is_below("boot/efi", "boot")
+    assert not staging.is_below("boot", "boot")
+    assert not staging.is_below("bootx", "boot")
+    assert not staging.is_below(".", ".")
+
+
+def test_copy_command(tmp_path):
+    src = os.path.join(tmp_path, "src")
+    dst = os.path.join(tmp_path, "dst")
+    os.makedirs(dst)
+    _write(os.path.join(src, "etc/hostname"), "photon\n")
+    _write(os.path.join(src, "boot/vmlinuz"), "kernel")
+    _write(os.path.join(src, "boot/efi/EFI/BOOT/bootx64.efi"), "efi")
+    _write(os.path.join(src, "var/log/poi/install.log"))
+    os.chmod(os.path.join(src, "etc/hostname"), 0o600)
+    os.symlink("../boot/vmlinuz", os.path.join(src, "etc/kernel"))
+
+    subprocess.check_call(staging.copy_command(src, dst, ["boot/efi", "var/log"]))
+
+    with open(os.path.join(dst, "etc/hostname")) as f:
+        assert f.read() == "photon\n"
+    assert os.stat(os.path.join(dst, "etc/hostname")).st_mode & 0o777 == 0o600
+    assert os.readlink(os.path.join(dst, "etc/kernel")) == "../boot/vmlinuz"
+    assert os.path.isfile(os.path.join(dst, "boot/vmlinuz"))
+    # excluded directories are created, but not their contents
+    assert os.listdir(os.path.join(dst, "boot/efi")) == []
+    assert os.listdir(os.path.join(dst, "var/log")) == []
+
+
+def test_copy_command_fails(tmp_path):
+    # pipefail: an error of the creating tar fails the command
+    dst = os.path.join(tmp_path, "dst")
+    os.makedirs(dst)
+    assert subprocess.call(staging.copy_command(os.path.join(tmp_path, "missing"), dst, []),
+                           stderr=subprocess.DEVNULL) != 0
@@ -0,0 +1,52 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""Resolution of 'tdnf_options' profiles and the rpm macros they set."""
+
+import os
+import sys
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import tdnf  # noqa: E402
+
+
+def test_resolve_default():
+    assert tdnf.resolve_options(None) == {}
+    assert tdnf.resolve_options({'excludedocs': True}) == {'excludedocs': True}
+
+
+def test_resolve_profile():
+    options = {'profile': "minimal", 'install_langs': "en_US:de_DE", 'exclude_packages': ["vim"]}
+    resolved = tdnf.resolve_options(options)
+
+    assert resolved['excludedocs'] is True
+    # explicit settings override the profile
+    assert resolved['install_langs'] == ["en_US", "de_DE"]
+    assert resolved['exclude_paths'] == tdnf.PROFILES['minimal']['exclude_paths']
+    assert resolved['exclude_packages'] == ["vim"]
+    assert 'profile' not in resolved
+    # the config and the profile are not changed
+    assert options['profile'] == "minimal"
+    assert tdnf.PROFILES['minimal']['install_langs'] == ["en_US"]
+
+
+def test_rpm_defines():
+    assert tdnf.options_rpm_defines({}) == []
+    assert tdnf.options_rpm_defines({'excludedocs': False, 'install_langs': []}) == []
+
+    defines = tdnf.options_rpm_defines({
+        'excludedocs': True,
+        'install_langs': ["en_US", "de_DE"],
+        'exclude_paths': ["/usr/share/man", "/usr/share/doc"],
+        'rpm_macros': {'%_smp_ncpus_max': "4", '_foo': "bar"},
+    })
+    assert defines == [
+        "_excludedocs 1",
+        "_install_langs en_US:de_DE",
+        "_netsharedpath /usr/share/man:/usr/share/doc",
+        "_smp_ncpus_max 4",
+        "_foo bar",
+    ]
@@ -0,0 +1,98 @@
+# /*
+#  * Copyright © 2026 VMware, Inc.
+#  * SPDX-License-Identifier: Apache-2.0 OR GPL-2.0-only
+#  */
+"""tdnf sessions: which commands use the cached metadata, and what is merged
+into the main package transaction."""
+
+import logging
+import os
+import sys
+
+import pytest
+
+POI_INSTALLER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photon_installer")
+sys.path.insert(0, POI_INSTALLER_DIR)
+
+import tdnf  # noqa: E402
+from installer import Installer  # noqa: E402
+
+
+def _tdnf(cacheonly):
+    # without looking for the tdnf binary
+    cmd = tdnf.Tdnf.__new__(tdnf.Tdnf)
+    for kw in ['arch', 'config_file', 'reposdir', 'releasever', 'installroot', 'env', 'rpm_defines']:
+        setattr(cmd, kw, None)
+    cmd.releasever = "5.0"
+    cmd.tdnf_bin = "/usr/bin/tdnf"
+    cmd.cacheonly = cacheonly
+    return cmd
+
+
+@pytest.mark.parametrize("args, metadata_only", [
+    (["--assumeno", "install", "bash"], True),
+    (["list", "--installed", "--disablerepo=*"], True),
+    (["--disablerepo=*", "list"], True),
+    (["install", "bash"], False),
+    (["install", "list"], False),
+    (["--downloadonly", "install", "bash"], False),
+    ([], False),
+])
+def test_reads_metadata_only(args, metadata_only):
+    assert tdnf.reads_metadata_only(args) == metadata_only
+
+
+def test_cacheonly():
+    # packages are never installed from the cache only, they may not have
+    # been downloaded
+    assert "--cacheonly" not in _tdnf(True).get_command(["install", "bash"], do_json=False)
+    assert "--cacheonly" in _tdnf(True).get_command(["--assumeno", "install", "bash"])
+    assert "--cacheonly" not in _tdnf(False).get_command(["--assumeno", "install", "bash"])
+
+
+class _Tdnf(object):
+    def __init__(self, solved):
+        self.solved = solved
+        self.commands = []
+
+    def run(self, args, do_json=True):
+        self.commands.append(args)
+        return 0, self.solved
+
+
+def _installer(tmp_path, solved, rpms):
+    inst = Installer.__new__(Installer)
+    inst.logger = logging.getLogger()
+    inst.additional_rpms_merged = False
+    inst.loaded_plugins = []
+    rpms_path = os.path.join(tmp_path, "rpms")
+    os.makedirs(rpms_path)
+    for rpm in rpms:
+        with open(os.path.join(rpms_path, rpm), "wb"):
+            pass
+    inst.install_config = {'packages': ["minimal", "linux"], 'additional_rpms_path': rpms_path}
+    inst._adjust_packages_based_on_selected_flavor = lambda: None
+    inst.tdnf = _Tdnf(solved)
+    return inst
+
+
+def test_merged_transaction(tmp_path):
+    solved = {'Install': [{'Name': "filesystem"}, {'Name': "bash"}, {'Name': "linux"}]}
+    inst = _installer(tmp_path, solved, ["custom-tool-1.0-1.ph5.x86_64.rpm"])
+
+    merged = inst._get_merged_transaction()
+
+    assert merged == [os.path.join(tmp_path, "rpms", "custom-tool-1.0-1.ph5.x86_64.rpm")]
+    assert inst.additional_rpms_merged
+    # filesystem is installed separately before
+    assert inst.tdnf.commands == [["--assumeno", "install", "minimal", "linux"]]
+
+
+def test_merged_transaction_replaces(tmp_path):
+    # an additional rpm replacing a dependency is installed after the main
+    # transaction
+    solved = {'Install': [{'Name': "filesystem"}, {'Name': "bash"}, {'Name': "linux"}]}
+    inst = _installer(tmp_path, solved, ["bash-5.2-2.ph5.x86_64.rpm"])
+
+    assert inst._get_merged_transaction() == []
+    assert not inst.additional_rpms_merged